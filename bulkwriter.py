@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+"""Chunked bulk loading of cycle writes into MySQL.
+
+Rows are streamed from any iterable and written in chunks bounded by row count
+and statement size, committing once per chunk, either as multi-row
+``INSERT ... VALUES (..), (..)`` statements (default) or through
+``LOAD DATA LOCAL INFILE`` from a temporary file (needs ``local_infile``
+enabled on server and in the ``mysqlpool`` config).
+"""
+
+import logging
+import os
+import tempfile
+import time
+from collections import namedtuple
+
+from dbpool import checkout
+
+logger = logging.getLogger("workflowmonitLogger")
+
+DEFAULT_MAXROWS = 1000
+DEFAULT_MAXBYTES = 2 << 20  # below the server's max_allowed_packet
+
+
+class BulkStats(namedtuple('BulkStats', ['table', 'rows', 'chunks', 'seconds'])):
+    @property
+    def rate(self):
+        """rows per second"""
+        return self.rows / self.seconds if self.seconds > 0 else float('inf')
+
+
+# -----------------------------------------------------------------------------
+
+def _chunks(rows, render, maxrows, maxbytes):
+    """group rendered rows into chunks of at most ``maxrows`` rows / ``maxbytes`` bytes"""
+
+    chunk, size = [], 0
+    for row in rows:
+        rendered = render(row)
+        if chunk and (len(chunk) >= maxrows or size + len(rendered) > maxbytes):
+            yield chunk
+            chunk, size = [], 0
+        chunk.append(rendered)
+        size += len(rendered)
+    if chunk:
+        yield chunk
+
+
+def _infile_field(value):
+    """a value as a field of LOAD DATA's default (tab-separated, backslash-escaped) format"""
+
+    if value is None:
+        return b'\\N'
+    if isinstance(value, str):
+        value = value.encode('utf-8')
+    elif not isinstance(value, (bytes, bytearray)):
+        value = str(value).encode('utf-8')
+    return (bytes(value)
+            .replace(b'\\', b'\\\\')
+            .replace(b'\t', b'\\t')
+            .replace(b'\n', b'\\n')
+            .replace(b'\0', b'\\0'))
+
+
+def bulk_insert(config, table, columns, rows, verb='INSERT', ondup=None, method='values',
+                maxrows=DEFAULT_MAXROWS, maxbytes=DEFAULT_MAXBYTES, conn=None):
+    """write ``rows`` into ``table`` in chunks, one commit per chunk (none
+    when writing over the caller's ``conn``)
+
+    :param dict config: config dictionary
+    :param str table: table name
+    :param list columns: column names, in the order of row values
+    :param rows: iterable of row tuples
+    :param str verb: ``INSERT``, ``REPLACE`` or ``INSERT IGNORE``
+    :param str ondup: ``ON DUPLICATE KEY UPDATE`` clause; forces the ``values`` method
+    :param str method: ``values`` (multi-row insert) or ``infile`` (LOAD DATA LOCAL INFILE)
+    :param int maxrows: max rows per chunk
+    :param int maxbytes: max statement/file bytes per chunk
+    :param conn: connection of the caller's transaction, default one of the pool
+    :returns: rows, chunks and time taken
+    :rtype: BulkStats
+    """
+
+    if method not in ('values', 'infile'):
+        raise ValueError("Unknown bulk write method: {}".format(method))
+    if ondup:
+        method = 'values'
+
+    starttime = time.time()
+    nrows, nchunks = 0, 0
+    commit = conn is None
+
+    with checkout(config, conn) as conn:
+        with conn.cursor() as cursor:
+            if method == 'values':
+                placeholder = "({})".format(', '.join(['%s'] * len(columns)))
+                head = "{} INTO {} ({}) VALUES ".format(verb, table, ', '.join(columns))
+                tail = " ON DUPLICATE KEY UPDATE {}".format(ondup) if ondup else ""
+                for chunk in _chunks(rows, lambda r: cursor.mogrify(placeholder, r), maxrows, maxbytes):
+                    cursor.execute(head + ', '.join(chunk) + tail)
+                    if commit:
+                        conn.commit()
+                    nrows += len(chunk)
+                    nchunks += 1
+            else:
+                modifier = {'REPLACE': ' REPLACE', 'INSERT IGNORE': ' IGNORE'}.get(verb, '')
+                render = lambda r: b'\t'.join(_infile_field(v) for v in r) + b'\n'
+                for chunk in _chunks(rows, render, maxrows, maxbytes):
+                    fd, tmpfn = tempfile.mkstemp(prefix='bulk_{}_'.format(table), suffix='.tsv')
+                    try:
+                        with os.fdopen(fd, 'wb') as f:
+                            f.writelines(chunk)
+                        cursor.execute(
+                            "LOAD DATA LOCAL INFILE %s{} INTO TABLE {} CHARACTER SET binary ({})".format(
+                                modifier, table, ', '.join(columns)),
+                            (tmpfn,))
+                        if commit:
+                            conn.commit()
+                    finally:
+                        os.remove(tmpfn)
+                    nrows += len(chunk)
+                    nchunks += 1
+
+    stats = BulkStats(table, nrows, nchunks, time.time() - starttime)
+    if nrows:
+        logger.info("{}: {} rows in {} chunks, {:.2f}s ({:.0f} rows/s)".format(
+            table, stats.rows, stats.chunks, stats.seconds, stats.rate))
+    return stats
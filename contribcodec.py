@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+"""Storage codec of prediction contributions in `PredictionContribs`.
+
+A workflow's contributions (SHAP values, in margin space) are a
+(classes x (features + bias)) array, stored as little-endian float16 bytes.
+Only needs numpy, so that the web dashboard decodes them without xgboost.
+"""
+
+import numpy as np
+
+from featurenames import FEATURE_NAMES
+
+CLASSES = ['good', 'acdc', 'resubmit']
+# contribution columns: one per feature, then the bias
+COLUMNS = FEATURE_NAMES + ['bias']
+
+
+def encode_contributions(contribs):
+    """compact float16 bytes of one workflow's contributions"""
+    return np.asarray(contribs, dtype='<f2').tobytes()
+
+
+def decode_contributions(blob):
+    """inverse of :py:func:`encode_contributions`
+
+    :returns: array of shape (len(CLASSES), len(COLUMNS))
+    :rtype: numpy.ndarray
+    """
+    return np.frombuffer(blob, dtype='<f2').astype(np.float32).reshape(len(CLASSES), -1)
@@ -0,0 +1,379 @@
+#!/usr/bin/env python
+"""Versioned schema migrations of OSDroidDB, and a query-plan check of the hot
+queries of the pipeline and the web dashboard.
+
+Applied versions are recorded in `SchemaVersion`. Tables themselves are
+created with the ``create_*_db`` helpers of `monitutils` (or the README);
+migrations bring them up to date. Index steps are idempotent and
+re-checked at every run, so an index dropped by hand, or a table created
+after its migration was applied, is fixed by the next run.
+
+usage: python dbmigrations.py [--status] [--check-only] [--minrows N]
+"""
+
+import argparse
+import logging
+import sys
+from collections import namedtuple
+from os.path import abspath, dirname, join
+
+import pymysql
+from dbpool import get_pool_from_config
+from monitutils import (create_error_counts_table, get_yamlconfig,
+                        partition_doc_archive)
+
+CONFIG_FILE_PATH = join(dirname(abspath(__file__)), 'config/config.yml')
+
+logger = logging.getLogger("workflowmonitLogger")
+
+Migration = namedtuple('Migration', ['version', 'description', 'steps'])
+Index = namedtuple('Index', ['table', 'name', 'columns'])
+Column = namedtuple('Column', ['table', 'name', 'definition'])
+
+# a step is either an :py:class:`Index`, a :py:class:`Column`, a SQL statement or a callable taking a cursor
+MIGRATIONS = [
+    Migration(1, "index prediction history and document archive by time and workflow", [
+        Index('PredictionHistory', 'idx_timestamp', ('timestamp',)),
+        Index('PredictionHistory', 'idx_name_timestamp', ('name', 'timestamp')),
+        Index('DocsOneMonthArchive', 'idx_timestamp', ('timestamp',)),
+        Index('DocsOneMonthArchive', 'idx_name_timestamp', ('name', 'timestamp')),
+        Index('LabelArchive', 'idx_name', ('name',)),
+        Index('ShadowPredictionHistory', 'idx_model_timestamp', ('model', 'timestamp')),
+        Index('ShadowPredictionHistory', 'idx_name_timestamp', ('name', 'timestamp')),
+    ]),
+    Migration(2, "latest prediction snapshot and cycle marker, backfilled from history", [
+        """\
+        CREATE TABLE IF NOT EXISTS PredictionLatest (
+            name VARCHAR(255) NOT NULL PRIMARY KEY,
+            good FLOAT,
+            acdc FLOAT,
+            resubmit FLOAT,
+            firstseen TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );""",
+        """\
+        CREATE TABLE IF NOT EXISTS PredictionCycle (
+            id TINYINT NOT NULL PRIMARY KEY,
+            timestamp TIMESTAMP NULL
+        );""",
+        Index('PredictionLatest', 'idx_timestamp', ('timestamp',)),
+        """\
+        INSERT IGNORE INTO PredictionLatest (name, good, acdc, resubmit, firstseen, timestamp)
+        SELECT H.name, H.good, H.acdc, H.resubmit, F.firstseen, H.timestamp
+        FROM PredictionHistory AS H
+            JOIN (
+                SELECT name, MIN(timestamp) AS firstseen, MAX(timestamp) AS lastseen
+                FROM PredictionHistory
+                GROUP BY name
+            ) AS F
+            ON H.name = F.name AND H.timestamp = F.lastseen;""",
+        """\
+        REPLACE INTO PredictionCycle (id, timestamp)
+        SELECT 1, MAX(timestamp) FROM PredictionHistory;""",
+    ]),
+    Migration(3, "labels on the latest prediction snapshot, backfilled from label archive", [
+        "ALTER TABLE PredictionLatest ADD COLUMN label INT NOT NULL DEFAULT -1",
+        """\
+        UPDATE PredictionLatest AS P
+            JOIN LabelArchive AS L
+            ON P.name = L.name
+        SET P.label = L.label;""",
+    ]),
+    Migration(4, "compressed document archive: binary documents with a storage format", [
+        # existing rows keep their json text as bytes, format 0 (see doccodec.py)
+        "ALTER TABLE DocsOneMonthArchive MODIFY document LONGBLOB",
+        Column('DocsOneMonthArchive', 'format', 'TINYINT NOT NULL DEFAULT 0'),
+    ]),
+    Migration(5, "daily range partitions of document archive, replacing the DELETE retention event", [
+        partition_doc_archive,
+    ]),
+    Migration(6, "hourly and daily rollups of prediction history", [
+        """\
+        CREATE TABLE IF NOT EXISTS PredictionHourly (
+            name VARCHAR(255) NOT NULL,
+            bucket BIGINT NOT NULL,
+            n INT NOT NULL,
+            good_mean FLOAT, acdc_mean FLOAT, resubmit_mean FLOAT,
+            good_max FLOAT, acdc_max FLOAT, resubmit_max FLOAT,
+            ngood INT, nacdc INT, nresubmit INT,
+            PRIMARY KEY (name, bucket),
+            INDEX idx_bucket (bucket)
+        );""",
+        """\
+        CREATE TABLE IF NOT EXISTS PredictionDaily (
+            name VARCHAR(255) NOT NULL,
+            bucket BIGINT NOT NULL,
+            n INT NOT NULL,
+            good_mean FLOAT, acdc_mean FLOAT, resubmit_mean FLOAT,
+            good_max FLOAT, acdc_max FLOAT, resubmit_max FLOAT,
+            ngood INT, nacdc INT, nresubmit INT,
+            PRIMARY KEY (name, bucket),
+            INDEX idx_bucket (bucket)
+        );""",
+        """\
+        CREATE TABLE IF NOT EXISTS RollupState (
+            tier VARCHAR(16) NOT NULL PRIMARY KEY,
+            watermark BIGINT NOT NULL
+        );""",
+    ]),
+    Migration(7, "error counts per cycle, workflow, task, site and code (fill with errorcounts.py --backfill)", [
+        create_error_counts_table,
+    ]),
+    Migration(8, "index prediction contributions by time, for retention", [
+        Index('PredictionContribs', 'idx_timestamp', ('timestamp',)),
+    ]),
+]
+
+# schema version the pipeline writes to
+LATEST_VERSION = max(m.version for m in MIGRATIONS)
+
+
+class SchemaOutdated(Exception):
+    pass
+
+
+# (label, query, params) EXPLAINed by :py:func:`check_query_plans`; views reading
+# (nearly) all of PredictionLatest, e.g. archived and all workflows, scan it by design
+HOT_QUERIES = [
+    ("last update time",
+     "SELECT timestamp FROM PredictionCycle WHERE id=1", ()),
+    ("running workflows",
+     "SELECT name, good, acdc, resubmit, timestamp FROM PredictionLatest "
+     "WHERE timestamp>=(SELECT timestamp FROM PredictionCycle WHERE id=1)", ()),
+    ("workflow prediction history",
+     "SELECT good, acdc, resubmit, timestamp FROM PredictionHistory WHERE name=%s ORDER BY timestamp ASC",
+     ('dummy',)),
+    ("workflow running period",
+     "SELECT timestamp AS maxts, firstseen AS mints FROM PredictionLatest WHERE name=%s",
+     ('dummy',)),
+    ("last documents",
+     "SELECT document FROM DocsOneMonthArchive "
+     "WHERE timestamp=(SELECT timestamp FROM PredictionCycle WHERE id=1)", ()),
+    ("workflow last document",
+     "SELECT document FROM DocsOneMonthArchive WHERE name=%s ORDER BY timestamp DESC LIMIT 1", ('dummy',)),
+    ("workflow document at time",
+     "SELECT document FROM DocsOneMonthArchive WHERE name=%s AND timestamp=%s",
+     ('dummy', '2020-01-01 00:00:00')),
+    ("workflow label",
+     "SELECT label FROM LabelArchive WHERE name=%s", ('dummy',)),
+    ("errors per site",
+     "SELECT site, SUM(counts) FROM CycleErrorCounts "
+     "WHERE timestamp=(SELECT timestamp FROM PredictionCycle WHERE id=1) AND errorCode=-1 GROUP BY site", ()),
+    ("workflow errors per code and site",
+     "SELECT errorCode, site, SUM(counts) FROM CycleErrorCounts "
+     "WHERE name=%s AND timestamp=%s AND errorCode<>-1 GROUP BY errorCode, site",
+     ('dummy', '2020-01-01 00:00:00')),
+    ("site errors per workflow and code",
+     "SELECT name, errorCode, SUM(counts) FROM CycleErrorCounts "
+     "WHERE site=%s AND timestamp=%s AND errorCode<>-1 GROUP BY name, errorCode",
+     ('dummy', '2020-01-01 00:00:00')),
+]
+
+
+# -----------------------------------------------------------------------------
+
+def _table_exists(cursor, table):
+    cursor.execute("""\
+        SELECT COUNT(*) FROM information_schema.tables
+        WHERE table_schema=DATABASE() AND table_name=%s""", (table,))
+    return cursor.fetchone()[0] > 0
+
+
+def _index_columns(cursor, table):
+    """{index name: (column, ...)} of ``table``"""
+
+    cursor.execute("""\
+        SELECT index_name, column_name FROM information_schema.statistics
+        WHERE table_schema=DATABASE() AND table_name=%s
+        ORDER BY index_name, seq_in_index""", (table,))
+    indexes = {}
+    for name, column in cursor.fetchall():
+        indexes[name] = indexes.get(name, ()) + (column,)
+    return indexes
+
+
+def ensure_index(cursor, index):
+    """create ``index`` unless its table is missing, or an index with the same
+    leading columns (primary key included) already covers it.
+
+    :param cursor: MySQL cursor
+    :param Index index: index to ensure
+    :returns: ``True`` if the index was created
+    :rtype: bool
+    """
+
+    if not _table_exists(cursor, index.table):
+        logger.warning("Table {} does not exist, index {} skipped.".format(index.table, index.name))
+        return False
+
+    ncols = len(index.columns)
+    for columns in _index_columns(cursor, index.table).values():
+        if tuple(columns[:ncols]) == tuple(index.columns):
+            return False
+
+    logger.info("Creating index {} on {} ({})..".format(index.name, index.table, ', '.join(index.columns)))
+    cursor.execute("ALTER TABLE {} ADD INDEX {} ({})".format(
+        index.table, index.name, ', '.join(index.columns)))
+    return True
+
+
+def ensure_column(cursor, column):
+    """add ``column`` to its table unless already there (e.g. table created
+    with the up-to-date definition)
+
+    :param cursor: MySQL cursor
+    :param Column column: column to ensure
+    :returns: ``True`` if the column was added
+    :rtype: bool
+    """
+
+    cursor.execute("""\
+        SELECT COUNT(*) FROM information_schema.columns
+        WHERE table_schema=DATABASE() AND table_name=%s AND column_name=%s""",
+        (column.table, column.name))
+    if cursor.fetchone()[0] > 0:
+        return False
+
+    logger.info("Adding column {} to {}..".format(column.name, column.table))
+    cursor.execute("ALTER TABLE {} ADD COLUMN {} {}".format(column.table, column.name, column.definition))
+    return True
+
+
+def _apply_step(cursor, step):
+    if isinstance(step, Index):
+        ensure_index(cursor, step)
+    elif isinstance(step, Column):
+        ensure_column(cursor, step)
+    elif callable(step):
+        step(cursor)
+    else:
+        cursor.execute(step)
+
+# -----------------------------------------------------------------------------
+
+def current_version(config):
+    """latest applied migration version, 0 if none
+
+    :param dict config: config dictionary
+    :rtype: int
+    """
+
+    with get_pool_from_config(config).connection() as conn:
+        with conn.cursor() as cursor:
+            if not _table_exists(cursor, 'SchemaVersion'):
+                return 0
+            cursor.execute("SELECT COALESCE(MAX(version), 0) FROM SchemaVersion")
+            return cursor.fetchone()[0]
+
+
+def check_schema(config, required=LATEST_VERSION):
+    """make sure migrations are applied before the pipeline writes, e.g. after
+    deploying new code
+
+    :param dict config: config dictionary
+    :param int required: schema version needed
+    :raises SchemaOutdated: when the database is behind ``required``
+    """
+
+    version = current_version(config)
+    if version < required:
+        raise SchemaOutdated(
+            "OSDroidDB schema is at version {}, this code needs version {}: "
+            "run `python dbmigrations.py` before the next cycle.".format(version, required))
+
+
+def migrate(config, migrations=MIGRATIONS):
+    """apply pending migrations in version order, then re-ensure indexes of
+    applied ones
+
+    :param dict config: config dictionary
+    :param list migrations: migrations to consider
+    :returns: versions applied by this call
+    :rtype: list
+    """
+
+    applied = []
+    with get_pool_from_config(config).connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""\
+                CREATE TABLE IF NOT EXISTS SchemaVersion (
+                    version INT NOT NULL PRIMARY KEY,
+                    description VARCHAR(255),
+                    applied TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                );""")
+            cursor.execute("SELECT version FROM SchemaVersion")
+            done = {row[0] for row in cursor.fetchall()}
+
+            for migration in sorted(migrations, key=lambda m: m.version):
+                if migration.version in done:
+                    for step in migration.steps:
+                        if isinstance(step, Index):
+                            ensure_index(cursor, step)
+                    continue
+
+                logger.info("Applying migration {}: {}".format(migration.version, migration.description))
+                for step in migration.steps:
+                    _apply_step(cursor, step)
+                cursor.execute("INSERT INTO SchemaVersion (version, description) VALUES (%s, %s)",
+                               (migration.version, migration.description))
+                # DDL commits implicitly anyway, record each version as it lands
+                conn.commit()
+                applied.append(migration.version)
+
+    return applied
+
+# -----------------------------------------------------------------------------
+
+def check_query_plans(config, queries=HOT_QUERIES, minrows=0):
+    """EXPLAIN hot queries and report those falling back to full table scans.
+
+    :param dict config: config dictionary
+    :param list queries: (label, query, params)
+    :param int minrows: ignore full scans estimated below this many rows
+    :returns: offenders as (label, table, estimated rows)
+    :rtype: list
+    """
+
+    offenders = []
+    with get_pool_from_config(config).connection() as conn:
+        with conn.cursor(pymysql.cursors.DictCursor) as cursor:
+            for label, query, params in queries:
+                cursor.execute("EXPLAIN " + query, params)
+                for row in cursor.fetchall():
+                    rows = row.get('rows') or 0
+                    if row.get('type') == 'ALL' and rows >= minrows:
+                        offenders.append((label, row.get('table'), rows))
+    return offenders
+
+# -----------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate OSDroidDB schema and check hot query plans.")
+    parser.add_argument('--config', default=CONFIG_FILE_PATH, help="config file with MySQL credentials")
+    parser.add_argument('--status', action='store_true', help="print current schema version and exit")
+    parser.add_argument('--check-only', action='store_true', help="only check query plans, do not migrate")
+    parser.add_argument('--minrows', type=int, default=0, help="ignore full scans estimated below this many rows")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    config = get_yamlconfig(args.config)
+
+    if args.status:
+        print("schema version: {} (latest: {})".format(current_version(config), LATEST_VERSION))
+        return 0
+
+    if not args.check_only:
+        applied = migrate(config)
+        logger.info("Applied migrations: {}".format(applied or 'none'))
+
+    offenders = check_query_plans(config, minrows=args.minrows)
+    for label, table, rows in offenders:
+        logger.error("Full scan of {} (~{} rows) in query: {}".format(table, rows, label))
+    if offenders:
+        return 1
+    logger.info("All {} hot queries use indexes.".format(len(HOT_QUERIES)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+"""Bounded, process-wide pool of pymysql connections shared by the monitoring
+pipeline (`monitutils`) and the web dashboard (`web.database`).
+
+Connections are checked out with a context manager::
+
+    with get_pool(user, password, dbname).connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(sql)
+
+The transaction is committed when the block exits cleanly and rolled back
+otherwise; the connection then goes back to the pool. At most ``maxsize``
+connections are open at any time, callers beyond that wait up to ``timeout``
+seconds for one to be returned.
+"""
+
+import contextlib
+import logging
+import threading
+import time
+
+import pymysql
+
+logger = logging.getLogger("workflowmonitLogger")
+
+DEFAULT_POOL_SETTINGS = dict(
+    maxsize=10,     # max open connections
+    timeout=30.,    # seconds to wait for a free connection
+    pingafter=60.,  # ping connections idle for longer than this (seconds) at checkout
+    recycle=3600.,  # close connections older than this (seconds), below server wait_timeout
+)
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+# -----------------------------------------------------------------------------
+
+class ConnectionPool:
+    """
+    :param str user: MySQL user
+    :param str password: MySQL password
+    :param str dbname: database name
+    :param str host: MySQL host
+    :param int maxsize: max number of open connections
+    :param float timeout: seconds to wait for a free connection
+    :param float pingafter: ping a connection idle for longer than this before handing it out
+    :param float recycle: close a connection older than this instead of handing it out
+    :param bool local_infile: allow ``LOAD DATA LOCAL INFILE`` on the connections
+    """
+
+    def __init__(self, user, password, dbname, host='localhost',
+                 maxsize=DEFAULT_POOL_SETTINGS['maxsize'],
+                 timeout=DEFAULT_POOL_SETTINGS['timeout'],
+                 pingafter=DEFAULT_POOL_SETTINGS['pingafter'],
+                 recycle=DEFAULT_POOL_SETTINGS['recycle'],
+                 local_infile=False):
+        self._connargs = dict(host=host, user=user, password=password, db=dbname,
+                              local_infile=local_infile)
+        self._maxsize = maxsize
+        self._timeout = timeout
+        self._pingafter = pingafter
+        self._recycle = recycle
+
+        self._slots = threading.BoundedSemaphore(maxsize)
+        self._lock = threading.Lock()
+        self._idle = []  # [(conn, created, lastused)], most recently used last
+        self._nopen = 0
+
+    @property
+    def maxsize(self):
+        return self._maxsize
+
+    def stats(self):
+        """:returns: dict of open and idle connection counts"""
+        with self._lock:
+            return dict(open=self._nopen, idle=len(self._idle), maxsize=self._maxsize)
+
+    def _connect(self):
+        conn = pymysql.connect(**self._connargs)
+        with self._lock:
+            self._nopen += 1
+        return conn, time.time()
+
+    def _discard(self, conn):
+        with self._lock:
+            self._nopen -= 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _healthy(self, conn, created, lastused):
+        now = time.time()
+        if now - created > self._recycle:
+            return False
+        if now - lastused > self._pingafter:
+            try:
+                conn.ping(reconnect=False)
+            except Exception:
+                return False
+        return True
+
+    def _checkout(self):
+        if not self._slots.acquire(timeout=self._timeout):
+            raise PoolTimeout("No MySQL connection available after {}s (maxsize={})".format(
+                self._timeout, self._maxsize))
+        try:
+            while True:
+                with self._lock:
+                    entry = self._idle.pop() if self._idle else None
+                if entry is None:
+                    return self._connect()
+                conn, created, lastused = entry
+                if self._healthy(conn, created, lastused):
+                    return conn, created
+                logger.debug("Dropping stale MySQL connection from pool.")
+                self._discard(conn)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _checkin(self, conn, created, broken=False):
+        try:
+            if broken or not conn.open:
+                self._discard(conn)
+            else:
+                with self._lock:
+                    self._idle.append((conn, created, time.time()))
+        finally:
+            self._slots.release()
+
+    @contextlib.contextmanager
+    def connection(self):
+        """check out a connection, committing on clean exit and rolling back otherwise
+
+        :returns: context manager yielding a ``pymysql.connections.Connection``
+        """
+
+        conn, created = self._checkout()
+        broken = False
+        try:
+            yield conn
+            conn.commit()
+        except Exception as e:
+            broken = isinstance(e, (pymysql.err.OperationalError, pymysql.err.InterfaceError))
+            if not broken:
+                try:
+                    conn.rollback()
+                except Exception:
+                    broken = True
+            raise
+        finally:
+            self._checkin(conn, created, broken)
+
+    def close(self):
+        """close all idle connections; connections checked out are closed when returned"""
+
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _, _ in idle:
+            self._discard(conn)
+
+# -----------------------------------------------------------------------------
+
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def get_pool(user, password, dbname, host='localhost', **settings):
+    """process-wide :py:class:`ConnectionPool` for the given credentials.
+    ``settings`` (see :py:data:`DEFAULT_POOL_SETTINGS`) only apply when the pool is created.
+
+    :rtype: ConnectionPool
+    """
+
+    key = (host, user, dbname)
+    with _POOLS_LOCK:
+        if key not in _POOLS:
+            _POOLS[key] = ConnectionPool(user, password, dbname, host=host, **settings)
+        return _POOLS[key]
+
+
+def get_pool_from_config(config):
+    """process-wide pool for the ``mysql`` credentials of ``config``, sized by its
+    optional ``mysqlpool`` section
+
+    :param dict config: config dictionary
+    :rtype: ConnectionPool
+    """
+
+    username_, password_, dbname_ = config['mysql']
+    return get_pool(username_, password_, dbname_, **(config.get('mysqlpool', None) or {}))
+
+
+def connect_from_config(config, **kwargs):
+    """connection with the ``mysql`` credentials and host of ``config``'s pool,
+    outside of the pool: it holds no pool slot, e.g. for a long streaming read.
+    The caller closes it.
+
+    :param dict config: config dictionary
+    :param kwargs: extra ``pymysql.connect`` arguments
+    :rtype: pymysql.connections.Connection
+    """
+
+    username_, password_, dbname_ = config['mysql']
+    settings = config.get('mysqlpool', None) or {}
+    return pymysql.connect(host=settings.get('host', 'localhost'), user=username_,
+                           password=password_, db=dbname_, **kwargs)
+
+
+def checkout(config, conn=None):
+    """connection of ``config``'s pool, or ``conn`` itself when given: writes
+    then join the caller's transaction, which the caller commits
+
+    :param dict config: config dictionary
+    :param conn: connection already checked out, or ``None``
+    :returns: context manager yielding a connection
+    """
+
+    if conn is not None:
+        return contextlib.nullcontext(conn)
+    return get_pool_from_config(config).connection()
+
+
+def close_all():
+    with _POOLS_LOCK:
+        for pool in _POOLS.values():
+            pool.close()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+"""Storage codec of documents archived in `DocsOneMonthArchive`.
+
+Each row carries a ``format`` next to its ``document`` blob, so rows written
+in different formats can live side by side and are decoded transparently
+by :py:func:`decode_doc`:
+
+    0  plain json text (rows written before compression)
+    1  zlib-compressed compact json
+
+usage (convert existing plain rows): python doccodec.py --backfill [--batchsize N]
+"""
+
+import argparse
+import json
+import logging
+import time
+import zlib
+from os.path import abspath, dirname, join
+
+FORMAT_JSON = 0
+FORMAT_ZLIB = 1
+DEFAULT_FORMAT = FORMAT_ZLIB
+ZLIB_LEVEL = 6
+
+CONFIG_FILE_PATH = join(dirname(abspath(__file__)), 'config/config.yml')
+
+logger = logging.getLogger("workflowmonitLogger")
+
+
+# -----------------------------------------------------------------------------
+
+def encode_doc(doc, fmt=DEFAULT_FORMAT):
+    """serialize a document for storage
+
+    :param doc: document, as dict or json string
+    :param int fmt: storage format
+    :returns: (format, payload)
+    :rtype: tuple
+    """
+
+    if isinstance(doc, str):
+        text = doc
+    else:
+        text = json.dumps(doc, separators=(',', ':'))
+
+    if fmt == FORMAT_JSON:
+        return FORMAT_JSON, text
+    if fmt == FORMAT_ZLIB:
+        return FORMAT_ZLIB, zlib.compress(text.encode('utf-8'), ZLIB_LEVEL)
+    raise ValueError("Unknown document format: {}".format(fmt))
+
+
+def decode_doc(payload, fmt=FORMAT_JSON):
+    """deserialize a stored document
+
+    :param payload: stored document (str or bytes)
+    :param int fmt: storage format of ``payload``
+    :returns: document
+    :rtype: dict
+    """
+
+    if fmt is None or fmt == FORMAT_JSON:
+        if isinstance(payload, (bytes, bytearray)):
+            payload = payload.decode('utf-8')
+        return json.loads(payload)
+    if fmt == FORMAT_ZLIB:
+        return json.loads(zlib.decompress(payload).decode('utf-8'))
+    raise ValueError("Unknown document format: {}".format(fmt))
+
+# -----------------------------------------------------------------------------
+
+def backfill_doc_archive(config, fmt=DEFAULT_FORMAT, batchsize=500):
+    """re-encode archived rows stored as plain json into ``fmt``, in id order,
+    committing batch by batch so it can be interrupted and resumed.
+
+    :param dict config: config dictionary
+    :param int fmt: target storage format
+    :param int batchsize: rows converted per transaction
+    :returns: (rows converted, bytes before, bytes after)
+    :rtype: tuple
+    """
+
+    from dbpool import get_pool_from_config
+
+    pool = get_pool_from_config(config)
+    lastid, nrows, nbefore, nafter = 0, 0, 0, 0
+    while True:
+        with pool.connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("""\
+                    SELECT id, document FROM DocsOneMonthArchive
+                    WHERE format=%s AND id>%s ORDER BY id LIMIT %s""",
+                    (FORMAT_JSON, lastid, batchsize))
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+
+                values = []
+                for id_, payload in rows:
+                    _, encoded = encode_doc(decode_doc(payload, FORMAT_JSON), fmt)
+                    values.append((encoded, fmt, id_, FORMAT_JSON))
+                    nbefore += len(payload)
+                    nafter += len(encoded)
+                cursor.executemany(
+                    "UPDATE DocsOneMonthArchive SET document=%s, format=%s WHERE id=%s AND format=%s",
+                    values)
+
+        lastid = rows[-1][0]
+        nrows += len(rows)
+        logger.info("{} rows converted, {:.1f} -> {:.1f} MB".format(nrows, nbefore / 1e6, nafter / 1e6))
+
+    return nrows, nbefore, nafter
+
+# -----------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Archived document codec utilities.")
+    parser.add_argument('--backfill', action='store_true', help="compress archived rows stored as plain json")
+    parser.add_argument('--batchsize', type=int, default=500, help="rows converted per transaction")
+    parser.add_argument('--config', default=CONFIG_FILE_PATH, help="config file with MySQL credentials")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    if args.backfill:
+        from monitutils import get_yamlconfig
+
+        starttime = time.time()
+        nrows, nbefore, nafter = backfill_doc_archive(get_yamlconfig(args.config), batchsize=args.batchsize)
+        logger.info("{} rows converted in {:.1f}s, payload {:.1f} -> {:.1f} MB".format(
+            nrows, time.time() - starttime, nbefore / 1e6, nafter / 1e6))
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+"""Normalized error counts of archived documents, in `CycleErrorCounts`.
+
+Each document archived in a cycle is flattened at ingest into one row per
+(task, site, errorCode) with its counts, so that the dashboard aggregates
+errors per site/code/workflow with ``GROUP BY`` instead of decoding documents.
+A task's total failures at a site (``siteErrors`` of the document, which
+also counts failures without an error code) are stored under the pseudo
+code :py:data:`SITE_TOTAL`.
+
+Rows carry the archive time of their document, and are partitioned by day
+like `DocsOneMonthArchive`.
+
+usage (fill from already archived documents): python errorcounts.py --backfill [--days N] [--batchsize N]
+"""
+
+import argparse
+import logging
+import time
+from datetime import datetime, timedelta
+from os.path import abspath, dirname, join
+
+from doccodec import decode_doc
+
+SITE_TOTAL = -1
+
+CONFIG_FILE_PATH = join(dirname(abspath(__file__)), 'config/config.yml')
+
+logger = logging.getLogger("workflowmonitLogger")
+
+
+# -----------------------------------------------------------------------------
+
+def error_count_rows(doc):
+    """flatten the error counts of a document
+
+    :param dict doc: workflow document
+    :returns: list of (name, task, site, errorCode, counts)
+    :rtype: list
+    """
+
+    counts = {}
+    for tsk in doc.get('tasks', []):
+        task = tsk.get('name', '')
+        for se in tsk.get('siteErrors', []):
+            key = (task, se['site'], SITE_TOTAL)
+            counts[key] = counts.get(key, 0) + se['counts']
+        for err in tsk.get('errors', []):
+            key = (task, err['siteName'], err['errorCode'])
+            counts[key] = counts.get(key, 0) + err['counts']
+
+    return [(doc['name'], *key, cnt) for key, cnt in counts.items()]
+
+# -----------------------------------------------------------------------------
+
+def backfill_error_counts(config, days=None, batchsize=500):
+    """flatten documents already archived (the last ``days`` only, if given) into
+    error counts, in id order, committing batch by batch. Rows are replaced, so
+    it can be interrupted and re-run.
+
+    :param dict config: config dictionary
+    :param int days: only documents archived during the last ``days``
+    :param int batchsize: documents flattened per transaction
+    :returns: (documents read, rows written)
+    :rtype: tuple
+    """
+
+    from dbpool import get_pool_from_config
+
+    pool = get_pool_from_config(config)
+    since = datetime.now() - timedelta(days=days) if days is not None else datetime.fromtimestamp(0)
+    lastid, ndocs, nrows = 0, 0, 0
+    while True:
+        with pool.connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("""\
+                    SELECT id, document, format, timestamp FROM DocsOneMonthArchive
+                    WHERE id>%s AND timestamp>=%s ORDER BY id LIMIT %s""",
+                    (lastid, since, batchsize))
+                docs = cursor.fetchall()
+                if not docs:
+                    break
+
+                values = []
+                for _, payload, fmt, timestamp in docs:
+                    values.extend((timestamp, *row) for row in error_count_rows(decode_doc(payload, fmt)))
+                cursor.executemany("""\
+                    REPLACE INTO CycleErrorCounts (timestamp, name, task, site, errorCode, counts)
+                    VALUES (%s, %s, %s, %s, %s, %s)""", values)
+
+        lastid = docs[-1][0]
+        ndocs += len(docs)
+        nrows += len(values)
+        logger.info("{} documents flattened into {} rows".format(ndocs, nrows))
+
+    return ndocs, nrows
+
+# -----------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Error counts of archived documents.")
+    parser.add_argument('--backfill', action='store_true', help="fill error counts from archived documents")
+    parser.add_argument('--days', type=int, default=None, help="only documents archived during the last N days")
+    parser.add_argument('--batchsize', type=int, default=500, help="documents flattened per transaction")
+    parser.add_argument('--config', default=CONFIG_FILE_PATH, help="config file with MySQL credentials")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    if args.backfill:
+        from monitutils import get_yamlconfig
+
+        starttime = time.time()
+        ndocs, nrows = backfill_error_counts(get_yamlconfig(args.config), days=args.days,
+                                             batchsize=args.batchsize)
+        logger.info("{} documents flattened into {} rows in {:.1f}s".format(
+            ndocs, nrows, time.time() - starttime))
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+"""Names of the prediction features, in feature matrix column order.
+
+Kept apart from `workflowprediction` (extraction and xgboost inference) so
+that readers of stored features and contributions, like the web dashboard,
+do not import the prediction stack.
+"""
+
+FEATURE_NAMES = [
+    "failureRate",
+    "totalError",
+    "sites_siteCounts",
+    "type",
+    "sites_errorPerSite_max",
+    "sites_errorPerSite_min",
+    "sites_errorPerSite_median",
+    "sites_errorPerSite_mean",
+    "sites_errorPerSite_stdDev",
+    "errorCode_primary_multiplicity",
+    "errorCode_primary_leadingCode",
+    "errorCode_primary_leadingRatio",
+    "errorCode_secondary_multiplicity",
+    "errorCode_secondary_leadingCode",
+    "errorCode_secondary_leadingRatio",
+    "errorKeywords_multiplicity",
+    "errorKeywords_leading",
+    "errorKeywords_leadingRatio",
+    "time_sinceOpenInHour",
+]
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+"""Append-only columnar store of extracted feature matrices, partitioned by day.
+
+Layout under the store root::
+
+    columns.json                       # feature column names, fixed per store
+    YYYYMMDD/
+        <unixtime>-<seq>.features.npy  # float32 (nrows, ncolumns)
+        <unixtime>-<seq>.names.json    # workflow names, one per row
+
+Each :py:meth:`FeatureStore.append` writes one chunk; chunks are never
+modified afterwards. Feature files are plain ``.npy`` so they can be
+memory-mapped for training and backtesting.
+"""
+
+import json
+import logging
+import os
+import shutil
+import time
+from datetime import date, datetime, timedelta
+from os.path import abspath, dirname, isdir, isfile, join
+
+import numpy as np
+
+FEATURE_STORE_PATH = join(dirname(abspath(__file__)), 'featurestore')
+
+logger = logging.getLogger("workflowmonitLogger")
+
+
+class FeatureStore:
+    """
+    :param str root: store root directory, created if not existing
+    :param list columns: feature column names, checked against an existing store
+    """
+
+    def __init__(self, root=FEATURE_STORE_PATH, columns=None):
+        self._root = root
+        os.makedirs(root, exist_ok=True)
+
+        colfn = join(root, 'columns.json')
+        if isfile(colfn):
+            with open(colfn) as f:
+                self._columns = json.load(f)
+            if columns is not None and list(columns) != self._columns:
+                raise ValueError("Feature columns do not match those of store {}".format(root))
+        else:
+            if columns is None:
+                raise ValueError("columns needed to initialize store {}".format(root))
+            self._columns = list(columns)
+            with open(colfn, 'w') as f:
+                json.dump(self._columns, f)
+
+    @property
+    def root(self):
+        return self._root
+
+    @property
+    def columns(self):
+        return list(self._columns)
+
+    def append(self, names, X, timestamp=None):
+        """persist one feature matrix as a new chunk
+
+        :param list names: workflow names, one per row of ``X``
+        :param numpy.ndarray X: feature matrix, columns as :py:attr:`columns`
+        :param float timestamp: unix time of the cycle, default now
+        :returns: path of the feature file written
+        :rtype: str
+        """
+
+        if X.shape != (len(names), len(self._columns)):
+            raise ValueError("Feature matrix shape {} does not match {} names x {} columns".format(
+                X.shape, len(names), len(self._columns)))
+
+        timestamp = int(timestamp if timestamp is not None else time.time())
+        partition = join(self._root, datetime.fromtimestamp(timestamp).strftime('%Y%m%d'))
+        os.makedirs(partition, exist_ok=True)
+
+        seq = 0
+        while isfile(join(partition, '{}-{}.features.npy'.format(timestamp, seq))):
+            seq += 1
+        base = join(partition, '{}-{}'.format(timestamp, seq))
+
+        # names first, a chunk is visible once its feature file exists
+        with open(base + '.names.json.tmp', 'w') as f:
+            json.dump(list(names), f)
+        os.replace(base + '.names.json.tmp', base + '.names.json')
+        with open(base + '.features.npy.tmp', 'wb') as f:
+            np.save(f, np.ascontiguousarray(X, dtype=np.float32))
+        os.replace(base + '.features.npy.tmp', base + '.features.npy')
+
+        return base + '.features.npy'
+
+    def partitions(self, start=None, end=None):
+        """day partitions within [start, end]
+
+        :param datetime.date start: first day, default earliest
+        :param datetime.date end: last day, default latest
+        :returns: sorted partition names (YYYYMMDD)
+        :rtype: list
+        """
+
+        lo = start.strftime('%Y%m%d') if start else '00000000'
+        hi = end.strftime('%Y%m%d') if end else '99999999'
+        return sorted(p for p in os.listdir(self._root)
+                      if isdir(join(self._root, p)) and lo <= p <= hi)
+
+    def iter_chunks(self, start=None, end=None, mmap=True):
+        """iterate over chunks in time order
+
+        :param datetime.date start: first day, default earliest
+        :param datetime.date end: last day, default latest
+        :param bool mmap: memory-map feature files instead of reading them
+        :returns: generator of (unixtime, names, X)
+        """
+
+        for partition in self.partitions(start, end):
+            pdir = join(self._root, partition)
+            chunks = []
+            for fn in os.listdir(pdir):
+                if not fn.endswith('.features.npy'):
+                    continue
+                ts, seq = fn[:-len('.features.npy')].split('-')
+                chunks.append((int(ts), int(seq), fn[:-len('.features.npy')]))
+
+            for ts, _, base in sorted(chunks):
+                with open(join(pdir, base + '.names.json')) as f:
+                    names = json.load(f)
+                X = np.load(join(pdir, base + '.features.npy'), mmap_mode='r' if mmap else None)
+                yield ts, names, X
+
+    def load(self, start=None, end=None):
+        """concatenate all chunks within [start, end]
+
+        :param datetime.date start: first day, default earliest
+        :param datetime.date end: last day, default latest
+        :returns: (names, unixtimes, X) with one entry/row per stored row
+        :rtype: tuple
+        """
+
+        names, timestamps, blocks = [], [], []
+        for ts, _names, X in self.iter_chunks(start, end, mmap=True):
+            names.extend(_names)
+            timestamps.append(np.full(len(_names), ts, dtype=np.int64))
+            blocks.append(X)
+
+        if not blocks:
+            return [], np.empty(0, dtype=np.int64), np.empty((0, len(self._columns)), dtype=np.float32)
+        return names, np.concatenate(timestamps), np.concatenate(blocks)
+
+
+def prune_feature_store(root=FEATURE_STORE_PATH, retentiondays=30):
+    """remove day partitions older than ``retentiondays``
+
+    :param str root: store root directory
+    :param int retentiondays: days of partitions kept, today included
+    :returns: partition names removed
+    :rtype: list
+    """
+
+    if not isdir(root):
+        return []
+
+    oldest = (date.today() - timedelta(days=retentiondays - 1)).strftime('%Y%m%d')
+    removed = []
+    for partition in sorted(os.listdir(root)):
+        if len(partition) != 8 or not partition.isdigit() or partition >= oldest:
+            continue
+        shutil.rmtree(join(root, partition), ignore_errors=True)
+        removed.append(partition)
+    if removed:
+        logger.info("Feature store: removed partitions {}".format(removed))
+    return removed
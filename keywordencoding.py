@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+"""Numeric encoding of error keywords, shared by inference and offline training.
+
+Encoded weights are kept in a persistent table (json, next to the model) that
+is filled lazily with :py:func:`encode_errorKeyword` whenever an unseen keyword
+shows up. Both `workflowprediction` and training code look keywords up through
+the table, so they always agree on the encoding.
+"""
+
+import json
+import os
+import threading
+from os.path import abspath, dirname, isfile, join
+
+ENCODING_TABLE_PATH = join(dirname(abspath(__file__)), 'models/keyword_encoding.json')
+
+SIGNATURE_KEYWORDS = [
+    "step", "submit", "report", "job",
+    "log", "rss", "assert", "performance",
+    "fileopen", "hlt", "reco", "script", "event",
+]
+
+# -----------------------------------------------------------------------------
+
+def encode_errorKeyword(kwrd):
+    """
+    error keywords are strings, to pipe into ML training and inference,
+    they need to be transformed as numbers.
+    LabelEncoder works for training, but not able to group similar
+    errorkeywords together. And does not work during inference. For now
+    a rule-based approach is taken. Describled below:
+    ---
+    These errorkeywords are extracted from logs if they contain some
+    *buzzword*, like error(s), failure(s), failed. So we first get rid
+    of those, and also sep char like -_, and group by other keywords:
+
+        step, submit, report, job, log, rss, assert, performance,
+        fileopen, hlt, reco, script, event
+
+    , each stratified by 1000, added by the length of the rest chars.
+    If an errorkeyword does not have any above keyword, then it's just
+     encoded as the length of the rest chars, should fall into range
+    [0, 1000). Here we assume the length of an errorkeyword should be
+    no more than 1000.
+    """
+
+    ekwrd = (
+        kwrd.lower()
+        .replace("-", "")
+        .replace("_", "")
+        .replace("errors", "")
+        .replace("error", "")
+        .replace("failures", "")
+        .replace("failure", "")
+        .replace("failed", "")
+        .replace("fail", "")
+    )
+
+    totalweight = 0
+    for w, sk in enumerate(SIGNATURE_KEYWORDS, 1):
+        if sk in ekwrd:
+            totalweight += 1000 * w
+            ekwrd = ekwrd.replace(sk, "")
+    if ekwrd:
+        totalweight += len(ekwrd)
+
+    return totalweight
+
+# -----------------------------------------------------------------------------
+
+class KeywordEncodingTable:
+    """keyword -> encoded weight, persisted as json.
+
+    :param str path: location of the table file, loaded if it exists
+    """
+
+    def __init__(self, path=ENCODING_TABLE_PATH):
+        self._path = path
+        self._lock = threading.Lock()
+        self._table = {}
+        self._dirty = False
+
+        if isfile(path):
+            with open(path) as f:
+                self._table = json.load(f)
+
+    @property
+    def path(self):
+        return self._path
+
+    def __len__(self):
+        return len(self._table)
+
+    def __contains__(self, kwrd):
+        return kwrd in self._table
+
+    def encode(self, kwrd):
+        """encoded weight of ``kwrd``, computed and recorded if not seen before
+
+        :param str kwrd: error keyword
+        :returns: encoded weight
+        :rtype: int
+        """
+
+        try:
+            return self._table[kwrd]
+        except KeyError:
+            weight = encode_errorKeyword(kwrd)
+            with self._lock:
+                weight = self._table.setdefault(kwrd, weight)
+                self._dirty = True
+            return weight
+
+    def update(self, entries):
+        """merge entries recorded elsewhere (e.g. another process) into the table
+
+        :param dict entries: {keyword: weight}
+        """
+
+        with self._lock:
+            for kwrd, weight in entries.items():
+                if kwrd not in self._table:
+                    self._table[kwrd] = weight
+                    self._dirty = True
+
+    def save(self):
+        """write the table back if new keywords were recorded since load/last save"""
+
+        with self._lock:
+            if not self._dirty:
+                return
+            tmpfn = self._path + '.tmp'
+            with open(tmpfn, 'w') as f:
+                json.dump(self._table, f, sort_keys=True, indent=0)
+            os.replace(tmpfn, self._path)
+            self._dirty = False
+
+    def to_dict(self):
+        with self._lock:
+            return dict(self._table)
+
+# -----------------------------------------------------------------------------
+
+_TABLES = {}
+_TABLES_LOCK = threading.Lock()
+
+
+def get_encoding_table(path=ENCODING_TABLE_PATH):
+    """process-wide :py:class:`KeywordEncodingTable` for ``path``
+
+    :param str path: location of the table file
+    :rtype: KeywordEncodingTable
+    """
+
+    path = abspath(path)
+    with _TABLES_LOCK:
+        if path not in _TABLES:
+            _TABLES[path] = KeywordEncodingTable(path)
+        return _TABLES[path]
+
+
+def encode_keyword(kwrd, path=ENCODING_TABLE_PATH):
+    """encode ``kwrd`` through the persistent table at ``path``
+
+    :param str kwrd: error keyword
+    :param str path: location of the table file
+    :rtype: int
+    """
+
+    return get_encoding_table(path).encode(kwrd)
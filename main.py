@@ -1,6 +1,5 @@
 #!/usr/bin/env python
 
-import json
 import logging
 import logging.config
 import os
@@ -8,14 +7,15 @@ import time
 import traceback
 from os.path import abspath, dirname, join
 
-import yaml
-from monitutils import (get_workflow_from_db, get_yamlconfig, save_json,
-                        update_doc_archive_db)
+import dbpool
+import workflowwrapper
+from featurestore import FEATURE_STORE_PATH
+from monitutils import get_workflow_from_db, get_yamlconfig, repo_path, save_json
+from storage import WriteBehind, get_storage
 from workflowalerts import alertWithEmail, errorEmailShooter
 from workflowlabelmaker import updateLabelArchives
-from workflowmonitexporter import (buildDoc, prepareWorkflows, sendDoc,
-                                   updateWorkflowStatusToDb)
-from workflowprediction import makingPredictionsWithML
+from workflowmonitexporter import buildDoc, prepareWorkflows, sendDoc
+from workflowprediction import makingPredictionsWithML, store_cycle_features
 
 LOGDIR = join(dirname(abspath(__file__)), 'Logs')
 CRED_FILE_PATH = join(dirname(abspath(__file__)), 'config/credential.yml')
@@ -43,16 +43,55 @@ def main():
 
     recipients = localconfig.get('alert_recipients', [])
 
+    cmswebconfig = localconfig.get('cmsweb', {})
+    workflowwrapper.RETRIES = cmswebconfig.get('retries', 0)
+    workflowwrapper.RETRY_WAIT = cmswebconfig.get('retrywait', 1.)
+    tracer = workflowwrapper.enable_tracing() if cmswebconfig.get('trace', False) else None
+
+    writer = None
     try:
+        storage = get_storage(localconfig)
+        sinkconfig = localconfig.get('cyclesink', None) or {}
+        # commits of the cycle are written by a background thread, so that
+        # building the next batch does not wait on the database
+        if sinkconfig.get('writebehind', True):
+            writer = WriteBehind(storage,
+                                 queuesize=sinkconfig.get('queuesize', 4),
+                                 retries=sinkconfig.get('retries', 3),
+                                 retrywait=sinkconfig.get('retrywait', 2.))
+
+        # writes below need the tables of the latest migrations
+        storage.check_schema()
+
+        # all batches of this cycle are stamped with the same time; predictions show
+        # up as batches arrive, the dashboard switches to the cycle once it completes
+        cycletime = time.time()
+        # all writes of a batch (or of the cycle) are committed together
+        sink = storage.sink(cycletime, streaming=sinkconfig.get('streaming', True), writer=writer)
         wfpacks = prepareWorkflows(CONFIG_FILE_PATH, test=False)
-        totaldocs = []
+        ndocs = 0
+        # feature matrices of the batches, persisted once for the cycle
+        cyclefeatures = []
         for pack in wfpacks:
             try:
-                docs = buildDoc(pack, doconcurrent=True)
-                totaldocs.extend(docs)
-
-                # update status in local db
-                updateWorkflowStatusToDb(CONFIG_FILE_PATH, docs)
+                docs, statuses = buildDoc(pack, doconcurrent=True, withstatuses=True)
+                ndocs += len(docs)
+
+                try:
+                    # predictions
+                    logger.info("Making predicions for {} workflows..".format(len(docs)))
+                    cyclefeatures.append(
+                        makingPredictionsWithML(docs, timestamp=cycletime, sink=sink, storefeatures=False))
+
+                    # archive docs, and their error counts
+                    sink.archive_docs(docs)
+                except Exception:
+                    logger.exception(f"Exception encountered, sending emails to {str(recipients)}")
+                    errorEmailShooter(traceback.format_exc(), recipients)
+
+                # statuses of all workflows of the batch, committed with its rows
+                sink.update_statuses(statuses)
+                sink.end_batch()
                 # send to CERN MONIT
                 failures = sendDoc(cred, docs)
                 # alerts
@@ -74,25 +113,54 @@ def main():
                 logger.exception(f"Exception encountered, sending emails to {str(recipients)}")
                 errorEmailShooter(traceback.format_exc(), recipients)
 
-        # predictions
-        logger.info("Making predicions for {} workflows..".format(len(totaldocs)))
-        makingPredictionsWithML(totaldocs)
+        logger.info("Predictions made for {} workflows in this cycle.".format(ndocs))
+        store_cycle_features(cyclefeatures, cycletime)
 
         # labeling
         qcmd = "SELECT NAME FROM CMS_UNIFIED_ADMIN.WORKFLOW WHERE WM_STATUS LIKE '%archived'"
         archivedwfs = get_workflow_from_db(CONFIG_FILE_PATH, qcmd)
         _wfnames = [w.name for w in archivedwfs]
         logger.info("Passing {} workflows for label making..".format(len(_wfnames)))
-        updateLabelArchives(_wfnames)
-
-        # archive docs:
-        docs_to_insert = [(doc['name'], json.dumps(doc)) for doc in totaldocs]
-        update_doc_archive_db(localconfig, docs_to_insert)
+        updateLabelArchives(_wfnames, sink=sink)
+        # readers switch to this cycle once everything before is written
+        sink.complete()
+        if writer is not None:
+            # maintenance must see all writes of the cycle
+            writer.flush()
+
+        # doc archive (and error counts) retention, prediction history rollup and retention,
+        # contributions and feature store retention
+        archiveconfig = localconfig.get('doc_archive', {})
+        historyconfig = localconfig.get('prediction_history', {})
+        storeconfig = localconfig.get('feature_store', {})
+        predconfig = localconfig.get('prediction', {})
+        done = storage.maintain(
+            retentiondays=archiveconfig.get('retentiondays', 30),
+            futuredays=archiveconfig.get('futuredays', 3),
+            rawdays=historyconfig.get('rawdays', None),
+            hourlydays=historyconfig.get('hourlydays', None),
+            contribsdays=predconfig.get('contributionsdays', None),
+            featuredays=storeconfig.get('retentiondays', None),
+            featurepath=repo_path(storeconfig.get('path', FEATURE_STORE_PATH)))
+        logger.info("Storage maintenance: {}".format(done))
 
     except Exception:
         logger.exception(f"Exception encountered, sending emails to {str(recipients)}")
         errorEmailShooter(traceback.format_exc(), recipients)
 
+    finally:
+        if writer is not None:
+            writer.close()
+            stats = writer.stats()
+            logger.info("Write-behind: {}".format(stats))
+            if stats['failed']:
+                errorEmailShooter("{} cycle writes ({} rows) failed to be written behind: {}".format(
+                    stats['failed'], stats['failedrows'], stats), recipients)
+        if tracer is not None:
+            tracefn, reportfn = tracer.dump(LOGDIR, topn=cmswebconfig.get('slowcalls', 20))
+            logger.info('cmsweb call trace saved at: {}, slowest calls at: {}'.format(tracefn, reportfn))
+        dbpool.close_all()
+
 
 def test():
     logging.config.dictConfig(get_yamlconfig(LOGGING_CONFIG))
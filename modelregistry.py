@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+"""Keep xgboost boosters warm in the process, reloading a model only when its
+file is replaced (mtime changed AND content hash changed).
+"""
+
+import hashlib
+import logging
+import os
+import threading
+
+import xgboost as xgb
+
+logger = logging.getLogger("workflowmonitLogger")
+
+DEFAULT_NTHREAD = 4
+
+
+# -----------------------------------------------------------------------------
+
+def read_model(path):
+    """read a model file once, so that the booster and its digest come from
+    the same content even if the file is replaced meanwhile
+
+    :param str path: model file path
+    :returns: (raw model, sha256 hex digest of it)
+    :rtype: tuple
+    """
+
+    with open(path, 'rb') as f:
+        raw = bytearray(f.read())
+    return raw, hashlib.sha256(raw).hexdigest()
+
+# -----------------------------------------------------------------------------
+
+def load_booster(model, nthread=DEFAULT_NTHREAD):
+    """load a booster, dropping a saved ``gpu_predictor`` setting
+    so that it can run on CPU-only hosts.
+
+    :param model: model file path, or raw model as read by :py:func:`read_model`
+    :type model: str or bytearray
+    :param int nthread: number of threads used for prediction
+    :returns: booster
+    :rtype: xgboost.Booster
+    """
+
+    bst = xgb.Booster({"nthread": nthread})
+    bst.load_model(model)
+
+    if bst.attributes().get('SAVED_PARAM_predictor', None) == 'gpu_predictor':
+        bst.set_attr(SAVED_PARAM_predictor=None)
+
+    return bst
+
+# -----------------------------------------------------------------------------
+
+class ModelRegistry:
+    """process-wide cache of boosters keyed by model file path.
+
+    :py:meth:`get` only stats the file in the common case; the file is hashed
+    when its mtime moves, and reloaded when the hash differs too.
+    """
+
+    def __init__(self, nthread=DEFAULT_NTHREAD):
+        self._nthread = nthread
+        self._lock = threading.Lock()
+        self._entries = {}  # path -> dict(booster, mtime, digest, nthread)
+
+    def get(self, path, nthread=None):
+        """return the warm booster for ``path``, (re)loading it if needed
+
+        :param str path: model file path
+        :param int nthread: number of threads used for prediction, default the registry's
+        :returns: booster
+        :rtype: xgboost.Booster
+        """
+
+        path = os.path.abspath(path)
+        nthread = nthread or self._nthread
+        mtime = os.stat(path).st_mtime_ns
+
+        with self._lock:
+            entry = self._entries.get(path, None)
+
+            raw = None
+            if entry is not None and entry['mtime'] != mtime:
+                raw, digest = read_model(path)
+                if digest == entry['digest']:
+                    entry['mtime'] = mtime
+                else:
+                    logger.info("Model file {} changed, reloading.".format(path))
+                    entry = None
+
+            if entry is None:
+                if raw is None:
+                    raw, digest = read_model(path)
+                entry = dict(
+                    booster=load_booster(raw, nthread),
+                    mtime=mtime,
+                    digest=digest,
+                    nthread=nthread,
+                )
+                self._entries[path] = entry
+
+            if entry['nthread'] != nthread:
+                entry['booster'].set_param('nthread', nthread)
+                entry['nthread'] = nthread
+
+            return entry['booster']
+
+    def digest(self, path):
+        """content hash of the model currently served for ``path``
+
+        :param str path: model file path
+        :returns: hex digest, ``None`` if never loaded
+        :rtype: str
+        """
+
+        with self._lock:
+            entry = self._entries.get(os.path.abspath(path), None)
+            return entry['digest'] if entry else None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+# -----------------------------------------------------------------------------
+
+REGISTRY = ModelRegistry()
+
+
+def get_model(path, nthread=None):
+    """fetch a warm booster from the process-wide :py:data:`REGISTRY`
+
+    :param str path: model file path
+    :param int nthread: number of threads used for prediction
+    :returns: booster
+    :rtype: xgboost.Booster
+    """
+
+    return REGISTRY.get(path, nthread=nthread)
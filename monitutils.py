@@ -2,14 +2,20 @@
 
 import gzip
 import json
+import logging
 import os
-from datetime import datetime
+from datetime import date, datetime, timedelta
 
-import pymysql
 import cx_Oracle
 import yaml
+from bulkwriter import bulk_insert
+from dbpool import checkout, get_pool_from_config
+from doccodec import encode_doc
+from errorcounts import error_count_rows
 from workflowwrapper import Workflow
 
+logger = logging.getLogger("workflowmonitLogger")
+
 # -----------------------------------------------------------------------------
 
 def save_json(json_obj, filename='tmp', gzipped=False):
@@ -58,6 +64,38 @@ def get_yamlconfig(configPath):
     except:
         return {}
 
+# -----------------------------------------------------------------------------
+
+def repo_path(path):
+    '''
+    path from config, relative ones being taken from the repo directory
+    rather than the current working directory (cron runs from elsewhere).
+
+    :param str path: absolute or relative path
+    :returns: absolute path
+
+    :rtype: str
+    '''
+
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), os.path.expanduser(path))
+
+# -----------------------------------------------------------------------------
+
+def get_workflow_status_db(config):
+    '''
+    path of the local sqlite db for workflow statuses and other per-cycle bookkeeping.
+
+    :param dict config: config dictionary
+    :returns: path of sqlite db file
+
+    :rtype: str
+    '''
+
+    return config.get(
+        'workflow_status_db',
+        os.path.join(
+            os.path.dirname(os.path.abspath(__file__)),
+            'workflow_status.sqlite'))
 
 # -----------------------------------------------------------------------------
 
@@ -113,12 +151,7 @@ def get_workflow_from_db(configPath, queryCmd):
 
 def create_prediction_history_db(config):
 
-    username_, password_, dbname_ = config['mysql']
-    conn = pymysql.connect(host='localhost',
-                           user=username_,
-                           password=password_,
-                           db=dbname_)
-    try:
+    with get_pool_from_config(config).connection() as conn:
         with conn.cursor() as cursor:
             sql = """\
                 create table if not exists OSDroidDB.PredictionHistory (
@@ -131,146 +164,386 @@ def create_prediction_history_db(config):
                 ); """
             cursor.execute(sql)
 
-        conn.commit()
-    finally:
-        conn.close()
+# -----------------------------------------------------------------------------
+
+def create_shadow_prediction_history_db(config):
+
+    with get_pool_from_config(config).connection() as conn:
+        with conn.cursor() as cursor:
+            sql = """\
+                create table if not exists OSDroidDB.ShadowPredictionHistory (
+                    hid BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+                    model VARCHAR(64) NOT NULL,
+                    name VARCHAR(255) NOT NULL,
+                    good FLOAT,
+                    acdc FLOAT,
+                    resubmit FLOAT,
+                    timestamp TIMESTAMP
+                ); """
+            cursor.execute(sql)
+
+# -----------------------------------------------------------------------------
+
+def create_prediction_contribs_db(config):
+
+    with get_pool_from_config(config).connection() as conn:
+        with conn.cursor() as cursor:
+            sql = """\
+                create table if not exists OSDroidDB.PredictionContribs (
+                    name VARCHAR(255) NOT NULL,
+                    contribs BLOB,
+                    timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (name, timestamp)
+                ); """
+            cursor.execute(sql)
 
 # -----------------------------------------------------------------------------
 
 def create_label_archive_db(config):
 
-    username_, password_, dbname_ = config['mysql']
-    conn = pymysql.connect(host='localhost',
-                           user=username_,
-                           password=password_,
-                           db=dbname_)
-    try:
+    with get_pool_from_config(config).connection() as conn:
         with conn.cursor() as cursor:
             sql = """\
                 create table if not exists OSDroidDB.LabelArchive (
                     name VARCHAR(255) NOT NULL PRIMARY KEY,
-                    lable INT
+                    label INT
                 ); """
             cursor.execute(sql)
 
-        conn.commit()
-    finally:
-        conn.close()
-
 # -----------------------------------------------------------------------------
 
 def create_doc_archive_db(config):
+    '''
+    create the document archive, range-partitioned by day. Retention is applied
+    by :py:func:`maintain_doc_archive_partitions` dropping expired partitions.
+    '''
 
-    username_, password_, dbname_ = config['mysql']
-    conn = pymysql.connect(host='localhost',
-                           user=username_,
-                           password=password_,
-                           db=dbname_)
-    try:
+    with get_pool_from_config(config).connection() as conn:
         with conn.cursor() as cursor:
             sql = """\
                 create table if not exists OSDroidDB.DocsOneMonthArchive (
-                    id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+                    id INT NOT NULL AUTO_INCREMENT,
                     name VARCHAR(255),
-                    document LONGTEXT,
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    document LONGBLOB,
+                    format TINYINT NOT NULL DEFAULT 0,
+                    timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (id, timestamp)
+                )
+                PARTITION BY RANGE (UNIX_TIMESTAMP(timestamp)) (
+                    PARTITION pfuture VALUES LESS THAN MAXVALUE
                 );"""
             cursor.execute(sql)
 
         conn.commit()
         print("Successfully created table OSDroidDB.DocsOneMonthArchive !")
 
+    maintain_doc_archive_partitions(config)
+
+# -----------------------------------------------------------------------------
+
+def create_error_counts_table(cursor, pastdays=30, futuredays=3):
+    '''
+    create the error counts of archived documents (see `errorcounts.py`),
+    range-partitioned by day like the document archive, with partitions from
+    ``pastdays`` ago (for a backfill) to ``futuredays`` ahead.
+
+    :param cursor: MySQL cursor
+    :param int pastdays: number of days back to create partitions for
+    :param int futuredays: number of days ahead to create partitions for
+    '''
+
+    first = date.today() - timedelta(days=pastdays)
+    partitions = [_day_partition(first + timedelta(days=i)) for i in range(pastdays + futuredays + 1)]
+    partitions.append("PARTITION pfuture VALUES LESS THAN MAXVALUE")
+    sql = """\
+        create table if not exists OSDroidDB.CycleErrorCounts (
+            timestamp TIMESTAMP NOT NULL,
+            name VARCHAR(255) NOT NULL,
+            task VARCHAR(255) NOT NULL,
+            site VARCHAR(64) NOT NULL,
+            errorCode INT NOT NULL,
+            counts INT NOT NULL,
+            PRIMARY KEY (timestamp, name, task, site, errorCode),
+            INDEX idx_name_timestamp (name, timestamp),
+            INDEX idx_site_timestamp (site, timestamp)
+        )
+        PARTITION BY RANGE (UNIX_TIMESTAMP(timestamp)) ({});""".format(', '.join(partitions))
+    cursor.execute(sql)
+
+
+def create_error_counts_db(config):
+
+    with get_pool_from_config(config).connection() as conn:
         with conn.cursor() as cursor:
-            sql = """\
-                CREATE EVENT OSDroidDB.DocsCleanOneMonth
-                ON SCHEDULE EVERY 24 HOUR
-                DO
-                DELETE FROM OSDroidDB.DocsOneMonthArchive
-                WHERE TIMESTAMPDIFF(DAY, timestamp, NOW()) > 30;"""
-            cursor.execute(sql)
+            create_error_counts_table(cursor)
+        print("Successfully created table OSDroidDB.CycleErrorCounts !")
 
-        conn.commit()
-        print("Successfully created event OSDroidDB.DocsCleanOneMonth !")
+# -----------------------------------------------------------------------------
+
+def _day_partition(day):
+    """partition definition holding rows of ``day``"""
+    return "PARTITION p{} VALUES LESS THAN (UNIX_TIMESTAMP('{} 00:00:00'))".format(
+        day.strftime('%Y%m%d'), (day + timedelta(days=1)).isoformat())
+
+
+def partition_doc_archive(cursor, futuredays=3):
+    '''
+    convert the (unpartitioned) document archive into daily range partitions,
+    from its oldest row to ``futuredays`` ahead, and drop the row-deleting
+    retention event. Copies the table once; meant to run as a migration.
+
+    :param cursor: MySQL cursor
+    :param int futuredays: number of days ahead to create partitions for
+    '''
 
-    finally:
-        conn.close()
+    cursor.execute("""\
+        SELECT COUNT(*) FROM information_schema.partitions
+        WHERE table_schema=DATABASE() AND table_name='DocsOneMonthArchive'
+            AND partition_name='pfuture'""")
+    if cursor.fetchone()[0]:
+        return
+
+    cursor.execute("SELECT DATE(MIN(timestamp)) FROM DocsOneMonthArchive")
+    first = cursor.fetchone()[0] or date.today()
+    ndays = (date.today() - first).days + futuredays + 1
+    partitions = [_day_partition(first + timedelta(days=i)) for i in range(ndays)]
+    partitions.append("PARTITION pfuture VALUES LESS THAN MAXVALUE")
+
+    cursor.execute("DROP EVENT IF EXISTS DocsCleanOneMonth")
+    # the partitioning column has to be part of every unique key
+    cursor.execute("""\
+        ALTER TABLE DocsOneMonthArchive
+            MODIFY timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            DROP PRIMARY KEY,
+            ADD PRIMARY KEY (id, timestamp)""")
+    cursor.execute("ALTER TABLE DocsOneMonthArchive PARTITION BY RANGE (UNIX_TIMESTAMP(timestamp)) ({})".format(
+        ', '.join(partitions)))
+
+
+def maintain_doc_archive_partitions(config, retentiondays=30, futuredays=3, table='DocsOneMonthArchive'):
+    '''
+    keep daily partitions of the document archive (or of ``table``, partitioned
+    the same way) ahead of time, and drop those entirely older than
+    ``retentiondays``. Both are metadata operations, cheap enough to run every cycle.
+
+    :param dict config: config dictionary
+    :param int retentiondays: number of days documents are kept
+    :param int futuredays: number of days ahead to create partitions for
+    :param str table: daily partitioned table
+    :returns: (names of partitions added, names of partitions dropped), both
+        empty when ``table`` is not partitioned yet
+    :rtype: tuple
+    '''
+
+    today = date.today()
+    with get_pool_from_config(config).connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""\
+                SELECT partition_name FROM information_schema.partitions
+                WHERE table_schema=DATABASE() AND table_name=%s
+                    AND partition_name IS NOT NULL
+                ORDER BY partition_ordinal_position""", (table,))
+            names = [row[0] for row in cursor.fetchall()]
+            if 'pfuture' not in names:
+                # not migrated yet, retention resumes once dbmigrations.py partitions it
+                logger.warning("%s is not partitioned, skipping partition maintenance: run dbmigrations.py.", table)
+                return [], []
+
+            days = [datetime.strptime(n[1:], '%Y%m%d').date() for n in names if n != 'pfuture']
+            start = max(days) + timedelta(days=1) if days else today
+            toadd = [start + timedelta(days=i) for i in range((today + timedelta(days=futuredays) - start).days + 1)]
+            if toadd:
+                # pfuture is empty as long as partitions are kept ahead, reorganizing it is instant
+                cursor.execute("ALTER TABLE {} REORGANIZE PARTITION pfuture INTO ({})".format(
+                    table, ', '.join([_day_partition(d) for d in toadd]
+                              + ["PARTITION pfuture VALUES LESS THAN MAXVALUE"])))
+
+            todrop = [d for d in days if d < today - timedelta(days=retentiondays)]
+            if todrop:
+                cursor.execute("ALTER TABLE {} DROP PARTITION {}".format(
+                    table, ', '.join('p' + d.strftime('%Y%m%d') for d in todrop)))
+
+    return (['p' + d.strftime('%Y%m%d') for d in toadd],
+            ['p' + d.strftime('%Y%m%d') for d in todrop])
 
 # -----------------------------------------------------------------------------
 
-def update_prediction_history_db(config, values):
+def update_prediction_history_db(config, values, latest=True, history=True, conn=None):
+    '''
+    append predictions to history, then keep the `PredictionLatest` snapshot
+    (one row per workflow) up to date. Rows are bulk written, committed chunk by
+    chunk (see `bulkwrite` config). The `PredictionCycle` marker is moved
+    separately, once the whole cycle is in (see `update_prediction_cycle_db`).
+
+    :param dict config: config dictionary
+    :param list values: list of (name, good, acdc, resubmit, formatted timestamp)
+    :param bool latest: maintain snapshot
+    :param bool history: append to history; predictions carried forward unchanged
+        only refresh the snapshot
+    :param conn: connection of the caller's transaction (see `storage.CycleSink`), default one of the pool
+    '''
 
-    username_, password_, dbname_ = config['mysql']
-    conn = pymysql.connect(host='localhost',
-                           user=username_,
-                           password=password_,
-                           db=dbname_)
     if not isinstance(values, list):
         values = [values,]
-    try:
+    bulkconfig = config.get('bulkwrite', None) or {}
+    if history:
+        bulk_insert(config, 'PredictionHistory', ('name', 'good', 'acdc', 'resubmit', 'timestamp'),
+                    values, conn=conn, **bulkconfig)
+
+    if latest and values:
+        # a replayed older batch never overwrites newer rows; timestamp assigned last
+        ondup = """\
+            good=IF(VALUES(timestamp)>=timestamp, VALUES(good), good),
+            acdc=IF(VALUES(timestamp)>=timestamp, VALUES(acdc), acdc),
+            resubmit=IF(VALUES(timestamp)>=timestamp, VALUES(resubmit), resubmit),
+            timestamp=GREATEST(timestamp, VALUES(timestamp))"""
+        bulk_insert(config, 'PredictionLatest', ('name', 'good', 'acdc', 'resubmit', 'firstseen', 'timestamp'),
+                    ((*v[:4], v[4], v[4]) for v in values), ondup=ondup, conn=conn, **bulkconfig)
+
+# -----------------------------------------------------------------------------
+
+def update_prediction_cycle_db(config, timestamp, conn=None):
+    '''
+    move the `PredictionCycle` marker to the cycle stamped ``timestamp``, once
+    all rows of the cycle are written. Readers take the marked cycle as the
+    current, complete one; rows of a cycle in progress are stamped later than
+    the marker. The marker never goes back.
+
+    :param dict config: config dictionary
+    :param str timestamp: formatted timestamp of the cycle
+    :param conn: connection of the caller's transaction (see `storage.CycleSink`), default one of the pool
+    '''
+
+    with checkout(config, conn) as conn:
         with conn.cursor() as cursor:
-            sql = "INSERT INTO PredictionHistory (name, good, acdc, resubmit, timestamp) VALUES (%s, %s, %s, %s, %s);"
-            cursor.executemany(sql, values)
+            sql = """\
+                INSERT INTO PredictionCycle (id, timestamp) VALUES (1, %s)
+                ON DUPLICATE KEY UPDATE timestamp=GREATEST(COALESCE(timestamp, 0), VALUES(timestamp));"""
+            cursor.execute(sql, (timestamp,))
 
-        conn.commit()
-    finally:
-        conn.close()
+# -----------------------------------------------------------------------------
+
+def update_shadow_prediction_history_db(config, values, conn=None):
+
+    if not isinstance(values, list):
+        values = [values,]
+    bulk_insert(config, 'ShadowPredictionHistory', ('model', 'name', 'good', 'acdc', 'resubmit', 'timestamp'),
+                values, conn=conn, **(config.get('bulkwrite', None) or {}))
 
 # -----------------------------------------------------------------------------
 
-def update_label_archive_db(config, values):
+def update_prediction_contribs_db(config, values, conn=None):
 
-    username_, password_, dbname_ = config['mysql']
-    conn = pymysql.connect(host='localhost',
-                           user=username_,
-                           password=password_,
-                           db=dbname_)
     if not isinstance(values, list):
         values = [values,]
-    try:
+    bulk_insert(config, 'PredictionContribs', ('name', 'contribs', 'timestamp'),
+                values, verb='REPLACE', conn=conn, **(config.get('bulkwrite', None) or {}))
+
+# -----------------------------------------------------------------------------
+
+def prune_prediction_contribs_db(config, retentiondays, batchsize=10000):
+    '''
+    delete prediction contributions older than ``retentiondays``, batch by batch.
+
+    :param dict config: config dictionary
+    :param int retentiondays: days contributions are kept
+    :param int batchsize: rows deleted per transaction
+    :returns: rows deleted
+    :rtype: int
+    '''
+
+    cutoff = datetime.now() - timedelta(days=retentiondays)
+    pool = get_pool_from_config(config)
+    deleted = 0
+    while True:
+        with pool.connection() as conn:
+            with conn.cursor() as cursor:
+                n = cursor.execute("DELETE FROM PredictionContribs WHERE timestamp<%s LIMIT %s",
+                                   (cutoff, batchsize))
+        deleted += n
+        if n < batchsize:
+            return deleted
+
+# -----------------------------------------------------------------------------
+
+def update_label_archive_db(config, values, conn=None):
+    '''
+    archive labels, and copy them onto the workflows' `PredictionLatest` rows.
+
+    :param dict config: config dictionary
+    :param list values: list of (name, label)
+    :param conn: connection of the caller's transaction (see `storage.CycleSink`), default one of the pool
+    '''
+
+    if not isinstance(values, list):
+        values = [values,]
+    with checkout(config, conn) as conn:
         with conn.cursor() as cursor:
             sql = "REPLACE INTO LabelArchive (name, label) VALUES (%s, %s);"
             cursor.executemany(sql, values)
 
-        conn.commit()
-    finally:
-        conn.close()
+            if values:
+                sql = "UPDATE PredictionLatest SET label=%s WHERE name=%s;"
+                cursor.executemany(sql, [(label, name) for name, label in values])
 
 # -----------------------------------------------------------------------------
 
-def update_doc_archive_db(config, values):
+def update_doc_archive_db(config, values, timestamp=None, conn=None):
+    '''
+    archive documents, encoded with :py:func:`doccodec.encode_doc` as they are
+    streamed into the bulk writer (see `bulkwrite` config).
+
+    :param dict config: config dictionary
+    :param list values: list of (name, document as dict or json string)
+    :param str timestamp: formatted timestamp stamped on all rows, default current time (by db)
+    :param conn: connection of the caller's transaction (see `storage.CycleSink`), default one of the pool
+    :returns: bulk write stats
+    :rtype: bulkwriter.BulkStats
+    '''
 
-    username_, password_, dbname_ = config['mysql']
-    conn = pymysql.connect(host='localhost',
-                           user=username_,
-                           password=password_,
-                           db=dbname_)
     if not isinstance(values, list):
         values = [values,]
-    try:
-        with conn.cursor() as cursor:
-            sql = """INSERT INTO OSDroidDB.DocsOneMonthArchive (name, document) VALUES (%s, %s);"""
-            cursor.executemany(sql, values)
-        conn.commit()
-    finally:
-        conn.close()
+    columns = ('name', 'document', 'format')
+    rows = ((name, *reversed(encode_doc(doc))) for name, doc in values)
+    if timestamp is not None:
+        columns += ('timestamp',)
+        rows = ((*row, timestamp) for row in rows)
+
+    return bulk_insert(config, 'DocsOneMonthArchive', columns, rows,
+                       conn=conn, **(config.get('bulkwrite', None) or {}))
+
+# -----------------------------------------------------------------------------
+
+def update_error_counts_db(config, docs, timestamp, conn=None):
+    '''
+    write the error counts of documents archived at ``timestamp``, one row per
+    (workflow, task, site, errorCode), see :py:func:`errorcounts.error_count_rows`.
+
+    :param dict config: config dictionary
+    :param list docs: list of documents
+    :param str timestamp: formatted archive timestamp of the documents
+    :param conn: connection of the caller's transaction (see `storage.CycleSink`), default one of the pool
+    :returns: bulk write stats
+    :rtype: bulkwriter.BulkStats
+    '''
+
+    if not isinstance(docs, list):
+        docs = [docs,]
+    rows = ((timestamp, *row) for doc in docs for row in error_count_rows(doc))
+
+    return bulk_insert(config, 'CycleErrorCounts', ('timestamp', 'name', 'task', 'site', 'errorCode', 'counts'),
+                       rows, verb='REPLACE', conn=conn, **(config.get('bulkwrite', None) or {}))
 
 # -----------------------------------------------------------------------------
 
 def get_labeled_workflows(config):
 
-    username_, password_, dbname_ = config['mysql']
-    conn = pymysql.connect(host='localhost',
-                           user=username_,
-                           password=password_,
-                           db=dbname_)
     result = []
-    try:
+    with get_pool_from_config(config).connection() as conn:
         with conn.cursor() as cursor:
             sql = "SELECT name FROM LabelArchive;"
             cursor.execute(sql)
             result = [x[0] for x in cursor.fetchall()]
-    finally:
-        conn.close()
 
     return result
 
@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+"""Tiered rollup of `PredictionHistory`, and tier-aware history reads.
+
+Raw predictions (one row per workflow per cycle) are aggregated into hourly
+(`PredictionHourly`) and those into daily (`PredictionDaily`) buckets, with
+mean/max probabilities and argmax counts per bucket. Rollups are incremental:
+each tier keeps a watermark in `RollupState`, only complete buckets past it are
+aggregated. Once rolled up, raw rows older than ``rawdays`` and hourly rows
+older than ``hourlydays`` can be pruned; pruning cutoffs are aligned to bucket
+boundaries so a bucket is always entirely in one tier.
+
+Bucket times are unix times aligned on UTC hours/days.
+"""
+
+import logging
+import time
+
+from dbpool import get_pool_from_config
+
+logger = logging.getLogger("workflowmonitLogger")
+
+HOUR = 3600
+DAY = 86400
+
+# argmax of (good, acdc, resubmit), ties to the first as numpy.argmax does
+_ARGMAX_COUNTS = """\
+    SUM(good>=acdc AND good>=resubmit),
+    SUM(acdc>good AND acdc>=resubmit),
+    SUM(resubmit>good AND resubmit>acdc)"""
+
+_HOURLY_ROLLUP = """\
+    REPLACE INTO PredictionHourly (name, bucket, n, good_mean, acdc_mean, resubmit_mean,
+        good_max, acdc_max, resubmit_max, ngood, nacdc, nresubmit)
+    SELECT name, UNIX_TIMESTAMP(timestamp) DIV 3600 * 3600 AS hourbucket, COUNT(*),
+        AVG(good), AVG(acdc), AVG(resubmit), MAX(good), MAX(acdc), MAX(resubmit),
+    {}
+    FROM PredictionHistory
+    WHERE timestamp>=FROM_UNIXTIME(%s) AND timestamp<FROM_UNIXTIME(%s)
+    GROUP BY name, hourbucket""".format(_ARGMAX_COUNTS)
+
+_DAILY_ROLLUP = """\
+    REPLACE INTO PredictionDaily (name, bucket, n, good_mean, acdc_mean, resubmit_mean,
+        good_max, acdc_max, resubmit_max, ngood, nacdc, nresubmit)
+    SELECT name, bucket DIV 86400 * 86400 AS daybucket, SUM(n),
+        SUM(good_mean*n)/SUM(n), SUM(acdc_mean*n)/SUM(n), SUM(resubmit_mean*n)/SUM(n),
+        MAX(good_max), MAX(acdc_max), MAX(resubmit_max),
+        SUM(ngood), SUM(nacdc), SUM(nresubmit)
+    FROM PredictionHourly
+    WHERE bucket>=%s AND bucket<%s
+    GROUP BY name, daybucket"""
+
+# tier: (rollup query, bucket width, query of the oldest source time)
+TIERS = [
+    ('hourly', _HOURLY_ROLLUP, HOUR, "SELECT MIN(UNIX_TIMESTAMP(timestamp)) FROM PredictionHistory"),
+    ('daily', _DAILY_ROLLUP, DAY, "SELECT MIN(bucket) FROM PredictionHourly"),
+]
+
+
+# -----------------------------------------------------------------------------
+
+def _get_watermark(cursor, tier):
+    cursor.execute("SELECT watermark FROM RollupState WHERE tier=%s", (tier,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def _set_watermark(cursor, tier, watermark):
+    cursor.execute("REPLACE INTO RollupState (tier, watermark) VALUES (%s, %s)", (tier, watermark))
+
+
+def _get_cycle_mark(cursor):
+    cursor.execute("SELECT UNIX_TIMESTAMP(timestamp) FROM PredictionCycle WHERE id=1")
+    row = cursor.fetchone()
+    return int(row[0]) if row and row[0] is not None else None
+
+
+def rollup_prediction_history(config, now=None, chunk=DAY):
+    """aggregate complete buckets past each tier's watermark, tier after tier,
+    committing every ``chunk`` seconds of source so a catch-up can be interrupted.
+    A tier never goes past the one it is aggregated from, and raw rows are only
+    aggregated up to the last completed cycle: batches of a running cycle are
+    stamped with its start time, however long it takes.
+
+    :param dict config: config dictionary
+    :param float now: unix time, default current time
+    :param int chunk: seconds of source aggregated per transaction
+    :returns: {tier: watermark reached}
+    :rtype: dict
+    """
+
+    now = int(now if now is not None else time.time())
+    pool = get_pool_from_config(config)
+    reached = {}
+
+    with pool.connection() as conn:
+        with conn.cursor() as cursor:
+            cyclemark = _get_cycle_mark(cursor)
+    if cyclemark is None:
+        # no cycle completed yet, none of the raw rows are final
+        return reached
+
+    sourcemark = min(now, cyclemark)
+    for tier, sql, width, oldestsql in TIERS:
+        end = sourcemark // width * width  # only complete buckets
+        with pool.connection() as conn:
+            with conn.cursor() as cursor:
+                start = _get_watermark(cursor, tier)
+                if start is None:
+                    cursor.execute(oldestsql)
+                    oldest = cursor.fetchone()[0]
+                    start = int(oldest) // width * width if oldest is not None else end
+
+        step = max(chunk // width, 1) * width
+        while start < end:
+            stop = min(start + step, end)
+            with pool.connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(sql, (start, stop))
+                    _set_watermark(cursor, tier, stop)
+            start = stop
+        reached[tier] = sourcemark = max(start, end)
+
+    return reached
+
+
+def prune_prediction_history(config, rawdays=None, hourlydays=None, now=None, batchsize=10000):
+    """delete raw rows older than ``rawdays`` and hourly rows older than
+    ``hourlydays``, never past what has been rolled up. ``None`` keeps a tier forever.
+
+    :param dict config: config dictionary
+    :param int rawdays: days raw predictions are kept
+    :param int hourlydays: days hourly aggregates are kept
+    :param float now: unix time, default current time
+    :param int batchsize: rows deleted per transaction
+    :returns: {tier: rows deleted}
+    :rtype: dict
+    """
+
+    now = int(now if now is not None else time.time())
+    pool = get_pool_from_config(config)
+    deleted = {'raw': 0, 'hourly': 0}
+
+    with pool.connection() as conn:
+        with conn.cursor() as cursor:
+            hourlymark = _get_watermark(cursor, 'hourly') or 0
+            dailymark = _get_watermark(cursor, 'daily') or 0
+
+    plans = []
+    if rawdays is not None:
+        cutoff = min(hourlymark, (now - rawdays * DAY) // HOUR * HOUR)
+        plans.append(('raw', "DELETE FROM PredictionHistory WHERE timestamp<FROM_UNIXTIME(%s) "
+                              "ORDER BY timestamp LIMIT %s", cutoff))
+    if hourlydays is not None:
+        cutoff = min(dailymark, (now - hourlydays * DAY) // DAY * DAY)
+        plans.append(('hourly', "DELETE FROM PredictionHourly WHERE bucket<%s LIMIT %s", cutoff))
+
+    for tier, sql, cutoff in plans:
+        while True:
+            with pool.connection() as conn:
+                with conn.cursor() as cursor:
+                    n = cursor.execute(sql, (cutoff, batchsize))
+            deleted[tier] += n
+            if n < batchsize:
+                break
+
+    return deleted
+
+# -----------------------------------------------------------------------------
+
+def workflow_history(db, name, since=None):
+    """prediction history of a workflow across tiers, in time order: daily
+    buckets before hourly coverage, hourly buckets before raw coverage, then raw rows.
+
+    Predictions carried forward unchanged (see `workflowprediction.predict_matrix_changed`)
+    have no raw row: a row holds until the next one, and the latest prediction
+    (`PredictionLatest`) closes the history, as tier ``carried``, when it was
+    last seen after the last row.
+
+    Each row has ``good``, ``acdc``, ``resubmit`` (means for buckets), ``timestamp``
+    (bucket start for buckets), ``n`` (predictions in the row), argmax counts
+    ``ngood``, ``nacdc``, ``nresubmit`` and ``tier``.
+
+    :param db: `web.database.Database` with dict cursor
+    :param str name: workflow name
+    :param datetime.datetime since: only rows at/after this time (buckets starting at/after it)
+    :rtype: list
+    """
+
+    sincets = int(time.mktime(since.timetuple())) if since is not None else 0
+
+    raw = db.query("""\
+        SELECT good, acdc, resubmit, timestamp, 1 AS n,
+            good>=acdc AND good>=resubmit AS ngood,
+            acdc>good AND acdc>=resubmit AS nacdc,
+            resubmit>good AND resubmit>acdc AS nresubmit
+        FROM PredictionHistory
+        WHERE name=%s AND timestamp>=FROM_UNIXTIME(%s)
+        ORDER BY timestamp ASC""", (name, sincets))
+    db.execute("SELECT MIN(UNIX_TIMESTAMP(timestamp)) AS first FROM PredictionHistory WHERE name=%s", (name,))
+    rawfirst = db.fetchone()['first']
+    rawstart = int(rawfirst) // HOUR * HOUR if rawfirst is not None else None
+
+    bucketsql = """\
+        SELECT good_mean AS good, acdc_mean AS acdc, resubmit_mean AS resubmit,
+            FROM_UNIXTIME(bucket) AS timestamp, n, ngood, nacdc, nresubmit
+        FROM {} WHERE name=%s AND bucket>=%s AND bucket<%s ORDER BY bucket ASC"""
+    nolimit = 1 << 62
+
+    hourly = db.query(bucketsql.format('PredictionHourly'),
+                      (name, sincets, rawstart if rawstart is not None else nolimit))
+    db.execute("SELECT MIN(bucket) AS first FROM PredictionHourly WHERE name=%s", (name,))
+    hourlyfirst = db.fetchone()['first']
+    starts = [int(t) for t in (hourlyfirst, rawstart) if t is not None]
+    dailyend = min(starts) // DAY * DAY if starts else nolimit
+
+    daily = db.query(bucketsql.format('PredictionDaily'), (name, sincets, dailyend))
+
+    carried = db.query("""\
+        SELECT good, acdc, resubmit, timestamp, 1 AS n,
+            good>=acdc AND good>=resubmit AS ngood,
+            acdc>good AND acdc>=resubmit AS nacdc,
+            resubmit>good AND resubmit>acdc AS nresubmit
+        FROM PredictionLatest
+        WHERE name=%s AND timestamp>=FROM_UNIXTIME(%s)""", (name, sincets))
+    last = (raw or hourly or daily or [None])[-1]
+    if last is not None and carried and carried[0]['timestamp'] <= last['timestamp']:
+        carried = []
+
+    rows = []
+    for tier, tierrows in (('daily', daily), ('hourly', hourly), ('raw', raw), ('carried', carried)):
+        for row in tierrows:
+            row['tier'] = tier
+            for k in ('n', 'ngood', 'nacdc', 'nresubmit'):
+                row[k] = int(row[k])
+            rows.append(row)
+    return rows
+
+
+def argmax_fraction(rows, pred):
+    """fraction of the time covered by ``rows`` (from :py:func:`workflow_history`)
+    during which ``pred`` ranked first. A row holds until the next one, as
+    predictions are carried forward in between; with no time span (a single
+    row), the fraction of predictions in ``rows``.
+
+    :param list rows: history rows
+    :param int pred: 0: good, 1: acdc, 2: resubmit
+    :rtype: float
+    """
+
+    key = ('ngood', 'nacdc', 'nresubmit')[pred]
+    total, ranked = 0., 0.
+    for row, following in zip(rows, rows[1:]):
+        span = (following['timestamp'] - row['timestamp']).total_seconds()
+        total += span
+        ranked += span * row[key] / row['n']
+    if total > 0:
+        return ranked / total
+
+    total = sum(r['n'] for r in rows)
+    return sum(r[key] for r in rows) / total if total else 0.
@@ -0,0 +1,1224 @@
+#!/usr/bin/env python
+"""Storage backends of the monitoring pipeline.
+
+:py:class:`Storage` is what the pipeline persists and reads back: prediction
+history (with the latest-prediction snapshot and cycle marker), labels, the
+document archive (with its error counts) and workflow statuses. Two
+implementations pass the same :py:func:`check_storage` conformance check:
+
+- :py:class:`MySQLStorage` (default), the production tables of OSDroidDB,
+  through the helpers of `monitutils`; statuses stay in the local sqlite file
+  given by ``workflow_status_db``.
+- :py:class:`SQLiteStorage`, everything in one local sqlite file, for running
+  the pipeline, benchmarks or load tests without a MySQL server.
+
+The backend is picked by the optional ``storage`` config section, see
+:py:func:`get_storage`. The web dashboard reads MySQL only.
+
+usage: python storage.py --check [--backend sqlite|mysql] [--path FILE]
+"""
+
+import argparse
+import logging
+import queue
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime
+from os.path import abspath, dirname, join
+
+import monitutils
+import pymysql
+from dbpool import PoolTimeout, connect_from_config, get_pool_from_config
+from doccodec import decode_doc, encode_doc
+from errorcounts import error_count_rows
+from featurestore import FEATURE_STORE_PATH, prune_feature_store
+
+CONFIG_FILE_PATH = join(dirname(abspath(__file__)), 'config/config.yml')
+DEFAULT_SQLITE_PATH = join(dirname(abspath(__file__)), 'osdroid.sqlite')
+
+TIMEFMT = '%Y-%m-%d %H:%M:%S'
+
+# lock wait timeout, deadlock, cannot connect, server gone away, connection lost
+TRANSIENT_MYSQL_ERRORS = (1205, 1213, 2003, 2006, 2013)
+
+# kinds of rows staged by a cycle sink
+_STAGED_KINDS = ('predictions', 'carried', 'shadows', 'contributions', 'docs', 'labels', 'statuses')
+
+logger = logging.getLogger("workflowmonitLogger")
+
+
+class IncompleteCycle(Exception):
+    pass
+
+
+def _fmt(ts):
+    """timestamp as stored: formatted string"""
+    return ts.strftime(TIMEFMT) if isinstance(ts, datetime) else ts
+
+
+def _parse(ts):
+    """timestamp as read: datetime"""
+    return datetime.strptime(ts, TIMEFMT) if isinstance(ts, str) else ts
+
+
+def _labeled_docs_query(since=None, until=None, latest_only=False, param='%s'):
+    """query of (name, document, format, timestamp, label) of archived docs
+    having a known label, and its parameters"""
+
+    bounds = [(op, value) for op, value in ((">=", since), ("<", until)) if value]
+    params = [value for _, value in bounds]
+
+    def timerange(column):
+        return ''.join(" AND {} {} {}".format(column, op, param) for op, _ in bounds)
+
+    if latest_only:
+        # pick the latest doc of each workflow on the index first, only those are read
+        return """\
+            SELECT D.name, D.document, D.format, D.timestamp, L.label
+            FROM (
+                SELECT MAX(id) AS id FROM DocsOneMonthArchive
+                WHERE 1=1{} GROUP BY name
+            ) AS T
+                JOIN DocsOneMonthArchive AS D ON D.id = T.id
+                JOIN LabelArchive AS L ON D.name = L.name
+            WHERE L.label != -1""".format(timerange('timestamp')), params
+    return """\
+        SELECT D.name, D.document, D.format, D.timestamp, L.label
+        FROM DocsOneMonthArchive AS D
+            JOIN LabelArchive AS L ON D.name = L.name
+        WHERE L.label != -1{}""".format(timerange('D.timestamp')), params
+
+
+def _stream_rows(cursor, fetchsize):
+    """rows of an executed query, ``fetchsize`` at a time"""
+
+    while True:
+        rows = cursor.fetchmany(fetchsize)
+        if not rows:
+            break
+        yield from rows
+
+
+_STATUS_SCHEMA = """\
+CREATE TABLE IF NOT EXISTS workflowStatuses (
+    name TEXT PRIMARY KEY,
+    status TEXT,
+    failurerate REAL
+)"""
+
+# change detection cache of `workflowprediction.predict_matrix_changed`, in the
+# same sqlite file as statuses: last scored features hash and prediction per workflow
+PREDICTION_CACHE_SCHEMA = """\
+CREATE TABLE IF NOT EXISTS predictionCache (
+    name TEXT PRIMARY KEY,
+    fhash TEXT,
+    sinceopen REAL,
+    good REAL,
+    acdc REAL,
+    resubmit REAL,
+    updated REAL
+)"""
+PREDICTION_CACHE_UPDATE = "INSERT OR REPLACE INTO predictionCache VALUES (?,?,?,?,?,?,?)"
+PREDICTION_CACHE_PRUNE = "DELETE FROM predictionCache WHERE updated < ?"
+
+# -----------------------------------------------------------------------------
+
+class Storage:
+    """persistence of the monitoring pipeline. Timestamps are written as
+    formatted strings (see `monitutils.fmttime`) or datetimes, and read back
+    as datetimes.
+
+    Workflow statuses are kept in a sqlite file by every backend.
+
+    :param str statuspath: sqlite file of workflow statuses
+    """
+
+    def __init__(self, statuspath):
+        self._statuspath = statuspath
+
+    def create(self):
+        """create missing tables"""
+        raise NotImplementedError
+
+    def check_schema(self):
+        """fail early when tables are not up to date with the code, before a
+        cycle writes to them; nothing to check when created on first use"""
+
+    # prediction history ------------------------------------------------------
+
+    def add_predictions(self, values, latest=True, history=True):
+        """append predictions, and keep the latest-prediction snapshot up to
+        date (a replayed older row never overwrites a newer one)
+
+        :param list values: list of (name, good, acdc, resubmit, timestamp)
+        :param bool latest: update the snapshot
+        :param bool history: append to the history; predictions carried forward
+            unchanged (see `workflowprediction.predict_matrix_changed`) only
+            refresh the snapshot
+        """
+        raise NotImplementedError
+
+    def complete_cycle(self, timestamp):
+        """move the cycle marker to the cycle stamped ``timestamp``, once all
+        its rows are written; never moves it back
+
+        :param timestamp: timestamp of the cycle
+        """
+        raise NotImplementedError
+
+    def add_shadow_predictions(self, values):
+        """:param list values: list of (model, name, good, acdc, resubmit, timestamp)"""
+        raise NotImplementedError
+
+    def add_contributions(self, values):
+        """:param list values: list of (name, encoded contributions, timestamp)"""
+        raise NotImplementedError
+
+    def prediction_history(self, name):
+        """raw predictions of a workflow, in time order
+
+        :param str name: workflow name
+        :returns: list of (good, acdc, resubmit, timestamp)
+        :rtype: list
+        """
+        raise NotImplementedError
+
+    def latest_prediction(self, name):
+        """:param str name: workflow name
+        :returns: (good, acdc, resubmit, firstseen, timestamp, label), ``None`` if never predicted
+        :rtype: tuple
+        """
+        raise NotImplementedError
+
+    def cycle_time(self):
+        """:returns: timestamp of the last complete cycle, ``None`` before the first one
+        :rtype: datetime.datetime
+        """
+        raise NotImplementedError
+
+    # labels ------------------------------------------------------------------
+
+    def add_labels(self, values):
+        """archive labels, and copy them onto the latest-prediction snapshot
+
+        :param list values: list of (name, label)
+        """
+        raise NotImplementedError
+
+    def labeled_workflows(self):
+        """:rtype: list"""
+        raise NotImplementedError
+
+    # document archive --------------------------------------------------------
+
+    def archive_docs(self, docs, timestamp):
+        """archive documents and their error counts
+
+        :param list docs: list of documents (dicts with a ``name``)
+        :param timestamp: archive time of the documents
+        """
+        raise NotImplementedError
+
+    def archived_doc(self, name, timestamp=None):
+        """:param str name: workflow name
+        :param timestamp: archive time, default most recent
+        :returns: document, ``None`` if not archived
+        :rtype: dict
+        """
+        raise NotImplementedError
+
+    def error_counts(self, name, timestamp):
+        """:param str name: workflow name
+        :param timestamp: archive time of the document
+        :returns: sorted list of (task, site, errorCode, counts), see `errorcounts.py`
+        :rtype: list
+        """
+        raise NotImplementedError
+
+    def labeled_docs(self, since=None, until=None, latest_only=False, fetchsize=200):
+        """stream archived documents having a known label, with bounded memory
+
+        :param str since: only docs archived at or after this date
+        :param str until: only docs archived before this date
+        :param bool latest_only: only the most recent doc of each workflow
+        :param int fetchsize: rows fetched per round trip
+        :returns: generator of (name, document, format, unix time, label), documents
+            encoded as archived (see `doccodec.py`)
+        """
+        raise NotImplementedError
+
+    def maintain(self, retentiondays=30, futuredays=3, rawdays=None, hourlydays=None,
+                 contribsdays=None, featuredays=None, featurepath=FEATURE_STORE_PATH):
+        """per-cycle retention of the archive, the prediction history and
+        contributions, and the feature store (local files, whatever the backend)
+
+        :param int retentiondays: days documents (and error counts) are kept
+        :param int futuredays: days ahead prepared for the archive
+        :param int rawdays: days raw predictions are kept, once aggregated
+        :param int hourlydays: days hourly aggregates are kept
+        :param int contribsdays: days prediction contributions are kept, ``None`` keeps all
+        :param int featuredays: days of feature store partitions kept, ``None`` keeps all
+        :param str featurepath: feature store root
+        :returns: what was done, for logging
+        :rtype: dict
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def _maintain_features(done, featuredays, featurepath):
+        if featuredays is not None:
+            done['features'] = prune_feature_store(featurepath, featuredays)
+        return done
+
+    # workflow statuses -------------------------------------------------------
+
+    def _status_connection(self):
+        conn = sqlite3.connect(self._statuspath, timeout=30)
+        conn.execute(_STATUS_SCHEMA)
+        return conn
+
+    @staticmethod
+    def _insert_statuses(conn, values):
+        conn.executemany("INSERT OR REPLACE INTO workflowStatuses VALUES (?,?,?)", values)
+
+    def update_statuses(self, values):
+        """:param list values: list of (name, status, failurerate)"""
+
+        conn = self._status_connection()
+        with conn:
+            self._insert_statuses(conn, values)
+        conn.close()
+
+    def completed_workflows(self):
+        """:returns: names of workflows whose status ends with *archived*
+        :rtype: list
+        """
+
+        conn = self._status_connection()
+        with conn:
+            res = [row[0] for row in conn.execute(
+                "SELECT name FROM workflowStatuses WHERE status LIKE '%archived'")]
+        conn.close()
+        return res
+
+    # cycle writes ------------------------------------------------------------
+
+    def write_staged(self, staged):
+        """write the rows staged by a :py:class:`CycleSink` in one transaction
+        (statuses excepted, when not kept in the same database)
+
+        :param dict staged: {'timestamp': cycle timestamp, 'predictions': [..],
+            'carried': [..] (predictions carried forward, snapshot only), 'shadows': [..], 'contributions': [..], 'docs': [..], 'labels': [..], 'statuses': [..],
+            'complete': whether to move the cycle marker (last, see :py:meth:`complete_cycle`)}
+        """
+        raise NotImplementedError
+
+    def sink(self, cycletime, streaming=True, writer=None):
+        """:py:class:`CycleSink` staging the writes of the cycle started at ``cycletime``
+
+        :rtype: CycleSink
+        """
+        return CycleSink(self, cycletime, streaming=streaming, writer=writer)
+
+# -----------------------------------------------------------------------------
+
+class MySQLStorage(Storage):
+    """OSDroidDB tables, as documented in the README
+
+    :param dict config: config dictionary
+    """
+
+    def __init__(self, config):
+        super().__init__(monitutils.get_workflow_status_db(config))
+        self._config = config
+
+    def _query(self, sql, params=()):
+        with get_pool_from_config(self._config).connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(sql, params)
+                return cursor.fetchall()
+
+    def create(self):
+        from dbmigrations import migrate
+
+        for create in (monitutils.create_prediction_history_db, monitutils.create_shadow_prediction_history_db,
+                       monitutils.create_prediction_contribs_db, monitutils.create_label_archive_db,
+                       monitutils.create_doc_archive_db):
+            create(self._config)
+        migrate(self._config)
+
+    def check_schema(self):
+        from dbmigrations import check_schema
+
+        check_schema(self._config)
+
+    def add_predictions(self, values, latest=True, history=True):
+        monitutils.update_prediction_history_db(self._config, values, latest=latest, history=history)
+
+    def complete_cycle(self, timestamp):
+        monitutils.update_prediction_cycle_db(self._config, _fmt(timestamp))
+
+    def add_shadow_predictions(self, values):
+        monitutils.update_shadow_prediction_history_db(self._config, values)
+
+    def add_contributions(self, values):
+        monitutils.update_prediction_contribs_db(self._config, values)
+
+    def prediction_history(self, name):
+        return [tuple(row) for row in self._query(
+            "SELECT good, acdc, resubmit, timestamp FROM PredictionHistory WHERE name=%s ORDER BY timestamp",
+            (name,))]
+
+    def latest_prediction(self, name):
+        rows = self._query(
+            "SELECT good, acdc, resubmit, firstseen, timestamp, label FROM PredictionLatest WHERE name=%s",
+            (name,))
+        return tuple(rows[0]) if rows else None
+
+    def cycle_time(self):
+        rows = self._query("SELECT timestamp FROM PredictionCycle WHERE id=1")
+        return rows[0][0] if rows else None
+
+    def add_labels(self, values):
+        monitutils.update_label_archive_db(self._config, values)
+
+    def labeled_workflows(self):
+        return monitutils.get_labeled_workflows(self._config)
+
+    def archive_docs(self, docs, timestamp):
+        timestamp = _fmt(timestamp)
+        monitutils.update_doc_archive_db(self._config, [(doc['name'], doc) for doc in docs], timestamp=timestamp)
+        monitutils.update_error_counts_db(self._config, docs, timestamp)
+
+    def archived_doc(self, name, timestamp=None):
+        if timestamp is None:
+            rows = self._query("SELECT document, format FROM DocsOneMonthArchive "
+                               "WHERE name=%s ORDER BY timestamp DESC LIMIT 1", (name,))
+        else:
+            rows = self._query("SELECT document, format FROM DocsOneMonthArchive "
+                               "WHERE name=%s AND timestamp=%s LIMIT 1", (name, _fmt(timestamp)))
+        return decode_doc(*rows[0]) if rows else None
+
+    def error_counts(self, name, timestamp):
+        return [tuple(row) for row in self._query(
+            "SELECT task, site, errorCode, counts FROM CycleErrorCounts "
+            "WHERE name=%s AND timestamp=%s ORDER BY task, site, errorCode", (name, _fmt(timestamp)))]
+
+    def labeled_docs(self, since=None, until=None, latest_only=False, fetchsize=200):
+        sql, params = _labeled_docs_query(since, until, latest_only)
+        # server-side cursor on a connection of its own, not holding a pool slot for the whole read
+        conn = connect_from_config(self._config, cursorclass=pymysql.cursors.SSCursor)
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(sql, params)
+                for name, document, fmt, timestamp, label in _stream_rows(cursor, fetchsize):
+                    yield name, document, fmt, int(timestamp.timestamp()), label
+        finally:
+            conn.close()
+
+    def write_staged(self, staged):
+        config = self._config
+        with get_pool_from_config(config).connection() as conn:
+            if staged['predictions']:
+                monitutils.update_prediction_history_db(config, staged['predictions'], conn=conn)
+            if staged['carried']:
+                monitutils.update_prediction_history_db(config, staged['carried'], history=False, conn=conn)
+            if staged['shadows']:
+                monitutils.update_shadow_prediction_history_db(config, staged['shadows'], conn=conn)
+            if staged['contributions']:
+                monitutils.update_prediction_contribs_db(config, staged['contributions'], conn=conn)
+            if staged['docs']:
+                docs, timestamp = staged['docs'], _fmt(staged['timestamp'])
+                monitutils.update_doc_archive_db(config, [(doc['name'], doc) for doc in docs],
+                                                 timestamp=timestamp, conn=conn)
+                monitutils.update_error_counts_db(config, docs, timestamp, conn=conn)
+            if staged['labels']:
+                monitutils.update_label_archive_db(config, staged['labels'], conn=conn)
+            if staged['complete']:
+                monitutils.update_prediction_cycle_db(config, _fmt(staged['timestamp']), conn=conn)
+        # statuses only decide what is queried next cycle, written once the rows are in
+        if staged['statuses']:
+            self.update_statuses(staged['statuses'])
+
+    def maintain(self, retentiondays=30, futuredays=3, rawdays=None, hourlydays=None,
+                 contribsdays=None, featuredays=None, featurepath=FEATURE_STORE_PATH):
+        from predictionrollup import prune_prediction_history, rollup_prediction_history
+
+        done = {}
+        for table in ('DocsOneMonthArchive', 'CycleErrorCounts'):
+            done[table] = monitutils.maintain_doc_archive_partitions(
+                self._config, retentiondays=retentiondays, futuredays=futuredays, table=table)
+        done['rollup'] = rollup_prediction_history(self._config)
+        done['pruned'] = prune_prediction_history(self._config, rawdays=rawdays, hourlydays=hourlydays)
+        if contribsdays is not None:
+            done['contribs'] = monitutils.prune_prediction_contribs_db(self._config, contribsdays)
+        return self._maintain_features(done, featuredays, featurepath)
+
+# -----------------------------------------------------------------------------
+
+_SQLITE_SCHEMA = """\
+CREATE TABLE IF NOT EXISTS PredictionHistory (
+    hid INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    good REAL,
+    acdc REAL,
+    resubmit REAL,
+    timestamp TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_history_name_timestamp ON PredictionHistory (name, timestamp);
+CREATE INDEX IF NOT EXISTS idx_history_timestamp ON PredictionHistory (timestamp);
+CREATE TABLE IF NOT EXISTS PredictionLatest (
+    name TEXT NOT NULL PRIMARY KEY,
+    good REAL,
+    acdc REAL,
+    resubmit REAL,
+    firstseen TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    label INTEGER NOT NULL DEFAULT -1
+);
+CREATE INDEX IF NOT EXISTS idx_latest_timestamp ON PredictionLatest (timestamp);
+CREATE TABLE IF NOT EXISTS PredictionCycle (
+    id INTEGER NOT NULL PRIMARY KEY,
+    timestamp TEXT
+);
+CREATE TABLE IF NOT EXISTS ShadowPredictionHistory (
+    hid INTEGER PRIMARY KEY AUTOINCREMENT,
+    model TEXT NOT NULL,
+    name TEXT NOT NULL,
+    good REAL,
+    acdc REAL,
+    resubmit REAL,
+    timestamp TEXT
+);
+CREATE TABLE IF NOT EXISTS PredictionContribs (
+    name TEXT NOT NULL,
+    contribs BLOB,
+    timestamp TEXT NOT NULL,
+    PRIMARY KEY (name, timestamp)
+);
+CREATE TABLE IF NOT EXISTS LabelArchive (
+    name TEXT NOT NULL PRIMARY KEY,
+    label INTEGER
+);
+CREATE TABLE IF NOT EXISTS DocsOneMonthArchive (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT,
+    document BLOB,
+    format INTEGER NOT NULL DEFAULT 0,
+    timestamp TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_docs_name_timestamp ON DocsOneMonthArchive (name, timestamp);
+CREATE INDEX IF NOT EXISTS idx_docs_timestamp ON DocsOneMonthArchive (timestamp);
+CREATE TABLE IF NOT EXISTS CycleErrorCounts (
+    timestamp TEXT NOT NULL,
+    name TEXT NOT NULL,
+    task TEXT NOT NULL,
+    site TEXT NOT NULL,
+    errorCode INTEGER NOT NULL,
+    counts INTEGER NOT NULL,
+    PRIMARY KEY (timestamp, name, task, site, errorCode)
+);
+CREATE INDEX IF NOT EXISTS idx_errors_name_timestamp ON CycleErrorCounts (name, timestamp);
+CREATE INDEX IF NOT EXISTS idx_errors_site_timestamp ON CycleErrorCounts (site, timestamp);
+{};
+""".format(_STATUS_SCHEMA)
+
+_SQLITE_CREATED = set()
+_SQLITE_LOCK = threading.Lock()
+
+
+class SQLiteStorage(Storage):
+    """the same tables in a single sqlite file, statuses included. Tables are
+    created on first use. The prediction history is kept raw, without
+    hourly/daily rollups.
+
+    :param str path: sqlite file
+    """
+
+    def __init__(self, path=DEFAULT_SQLITE_PATH):
+        super().__init__(path)
+        self._path = path
+        with _SQLITE_LOCK:
+            if path not in _SQLITE_CREATED:
+                self.create()
+                _SQLITE_CREATED.add(path)
+
+    def _connection(self):
+        # one connection per call: safe across the collection threads of a cycle
+        conn = sqlite3.connect(self._path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _transaction(self, *writes):
+        """run ``(write, *args)`` as ``write(conn, *args)``, all in one transaction"""
+
+        conn = self._connection()
+        with conn:
+            for write, *args in writes:
+                write(conn, *args)
+        conn.close()
+
+    def _query(self, sql, params=()):
+        conn = self._connection()
+        with conn:
+            rows = conn.execute(sql, params).fetchall()
+        conn.close()
+        return rows
+
+    def create(self):
+        conn = self._connection()
+        with conn:
+            conn.executescript(_SQLITE_SCHEMA)
+        conn.close()
+
+    @staticmethod
+    def _insert_predictions(conn, values, latest=True, history=True):
+        if not isinstance(values, list):
+            values = [values,]
+        values = [(*v[:4], _fmt(v[4])) for v in values]
+
+        if history:
+            conn.executemany(
+                "INSERT INTO PredictionHistory (name, good, acdc, resubmit, timestamp) VALUES (?,?,?,?,?)",
+                values)
+        if latest and values:
+            conn.executemany("""\
+                INSERT INTO PredictionLatest (name, good, acdc, resubmit, firstseen, timestamp)
+                VALUES (?,?,?,?,?,?)
+                ON CONFLICT (name) DO UPDATE SET
+                    good=CASE WHEN excluded.timestamp>=timestamp THEN excluded.good ELSE good END,
+                    acdc=CASE WHEN excluded.timestamp>=timestamp THEN excluded.acdc ELSE acdc END,
+                    resubmit=CASE WHEN excluded.timestamp>=timestamp THEN excluded.resubmit ELSE resubmit END,
+                    timestamp=MAX(timestamp, excluded.timestamp)""",
+                [(*v[:4], v[4], v[4]) for v in values])
+
+    @staticmethod
+    def _mark_cycle(conn, timestamp, complete=True):
+        if complete:
+            conn.execute("""\
+                INSERT INTO PredictionCycle (id, timestamp) VALUES (1, ?)
+                ON CONFLICT (id) DO UPDATE SET timestamp=MAX(COALESCE(timestamp, ''), excluded.timestamp)""",
+                (_fmt(timestamp),))
+
+    @staticmethod
+    def _insert_shadow_predictions(conn, values):
+        conn.executemany("INSERT INTO ShadowPredictionHistory (model, name, good, acdc, resubmit, timestamp) "
+                         "VALUES (?,?,?,?,?,?)", [(*v[:5], _fmt(v[5])) for v in values])
+
+    @staticmethod
+    def _insert_contributions(conn, values):
+        conn.executemany("REPLACE INTO PredictionContribs (name, contribs, timestamp) VALUES (?,?,?)",
+                         [(name, contribs, _fmt(ts)) for name, contribs, ts in values])
+
+    @staticmethod
+    def _insert_labels(conn, values):
+        if not isinstance(values, list):
+            values = [values,]
+        conn.executemany("REPLACE INTO LabelArchive (name, label) VALUES (?,?)", values)
+        conn.executemany("UPDATE PredictionLatest SET label=? WHERE name=?",
+                         [(label, name) for name, label in values])
+
+    @staticmethod
+    def _insert_docs(conn, docs, timestamp):
+        timestamp = _fmt(timestamp)
+        conn.executemany(
+            "INSERT INTO DocsOneMonthArchive (name, document, format, timestamp) VALUES (?,?,?,?)",
+            ((doc['name'], *reversed(encode_doc(doc)), timestamp) for doc in docs))
+        conn.executemany(
+            "REPLACE INTO CycleErrorCounts (timestamp, name, task, site, errorCode, counts) "
+            "VALUES (?,?,?,?,?,?)",
+            ((timestamp, *row) for doc in docs for row in error_count_rows(doc)))
+
+    def add_predictions(self, values, latest=True, history=True):
+        self._transaction((self._insert_predictions, values, latest, history))
+
+    def complete_cycle(self, timestamp):
+        self._transaction((self._mark_cycle, timestamp))
+
+    def add_shadow_predictions(self, values):
+        self._transaction((self._insert_shadow_predictions, values))
+
+    def add_contributions(self, values):
+        self._transaction((self._insert_contributions, values))
+
+    def add_labels(self, values):
+        self._transaction((self._insert_labels, values))
+
+    def archive_docs(self, docs, timestamp):
+        self._transaction((self._insert_docs, docs, timestamp))
+
+    def update_statuses(self, values):
+        self._transaction((self._insert_statuses, values))
+
+    def write_staged(self, staged):
+        self._transaction(
+            (self._insert_predictions, staged['predictions']),
+            (self._insert_predictions, staged['carried'], True, False),
+            (self._insert_shadow_predictions, staged['shadows']),
+            (self._insert_contributions, staged['contributions']),
+            (self._insert_docs, staged['docs'], staged['timestamp']),
+            (self._insert_labels, staged['labels']),
+            (self._insert_statuses, staged['statuses']),
+            (self._mark_cycle, staged['timestamp'], staged['complete']))
+
+    def prediction_history(self, name):
+        rows = self._query("SELECT good, acdc, resubmit, timestamp FROM PredictionHistory "
+                           "WHERE name=? ORDER BY timestamp", (name,))
+        return [(*row[:3], _parse(row[3])) for row in rows]
+
+    def latest_prediction(self, name):
+        rows = self._query("SELECT good, acdc, resubmit, firstseen, timestamp, label FROM PredictionLatest "
+                           "WHERE name=?", (name,))
+        if not rows:
+            return None
+        good, acdc, resubmit, firstseen, timestamp, label = rows[0]
+        return good, acdc, resubmit, _parse(firstseen), _parse(timestamp), label
+
+    def cycle_time(self):
+        rows = self._query("SELECT timestamp FROM PredictionCycle WHERE id=1")
+        return _parse(rows[0][0]) if rows else None
+
+    def labeled_workflows(self):
+        return [row[0] for row in self._query("SELECT name FROM LabelArchive")]
+
+    def archived_doc(self, name, timestamp=None):
+        if timestamp is None:
+            rows = self._query("SELECT document, format FROM DocsOneMonthArchive "
+                               "WHERE name=? ORDER BY timestamp DESC LIMIT 1", (name,))
+        else:
+            rows = self._query("SELECT document, format FROM DocsOneMonthArchive "
+                               "WHERE name=? AND timestamp=? LIMIT 1", (name, _fmt(timestamp)))
+        return decode_doc(*rows[0]) if rows else None
+
+    def error_counts(self, name, timestamp):
+        return self._query("SELECT task, site, errorCode, counts FROM CycleErrorCounts "
+                           "WHERE name=? AND timestamp=? ORDER BY task, site, errorCode",
+                           (name, _fmt(timestamp)))
+
+    def labeled_docs(self, since=None, until=None, latest_only=False, fetchsize=200):
+        sql, params = _labeled_docs_query(since, until, latest_only, param='?')
+        conn = self._connection()
+        try:
+            cursor = conn.execute(sql, params)
+            for name, document, fmt, timestamp, label in _stream_rows(cursor, fetchsize):
+                yield name, document, fmt, int(_parse(timestamp).timestamp()), label
+        finally:
+            conn.close()
+
+    def maintain(self, retentiondays=30, futuredays=3, rawdays=None, hourlydays=None,
+                 contribsdays=None, featuredays=None, featurepath=FEATURE_STORE_PATH):
+        """delete documents and error counts older than ``retentiondays``, and
+        contributions older than ``contribsdays``; the raw prediction history is
+        kept (no rollups to fall back on)"""
+
+        cutoff = monitutils.fmttime(time.time() - retentiondays * 86400)
+        done = {}
+        conn = self._connection()
+        with conn:
+            for table in ('DocsOneMonthArchive', 'CycleErrorCounts'):
+                done[table] = conn.execute("DELETE FROM {} WHERE timestamp<?".format(table), (cutoff,)).rowcount
+            if contribsdays is not None:
+                done['contribs'] = conn.execute(
+                    "DELETE FROM PredictionContribs WHERE timestamp<?",
+                    (monitutils.fmttime(time.time() - contribsdays * 86400),)).rowcount
+        conn.close()
+        return self._maintain_features(done, featuredays, featurepath)
+
+# -----------------------------------------------------------------------------
+
+class CycleSink:
+    """stages the writes of a cycle, and commits them together over a single
+    connection and transaction, per batch (``streaming``) or per cycle. Every
+    timestamped row is stamped with the cycle's timestamp, which identifies
+    the cycle. The cycle marker moves to it with the last commit
+    (:py:meth:`complete`), so readers keep to the previous cycle while batches
+    stream in; it stays there if any commit of the cycle failed. Has the write
+    methods of :py:class:`Storage`, so it can be passed instead of one.
+
+    :param Storage storage: backend written to
+    :param float cycletime: unix time the cycle started
+    :param bool streaming: commit at each :py:meth:`end_batch`, not only at :py:meth:`commit`
+    :param WriteBehind writer: hand commits over to this background writer instead of writing them inline
+    """
+
+    def __init__(self, storage, cycletime, streaming=True, writer=None):
+        self.storage = storage
+        self.cycleid = monitutils.fmttime(cycletime)
+        self.streaming = streaming
+        self.writer = writer
+        self._lock = threading.Lock()
+        self._staged = self._empty()
+        self._failed = 0  # commits of the cycle that failed inline
+
+    def _empty(self):
+        return dict(timestamp=self.cycleid, complete=False, **{k: [] for k in _STAGED_KINDS})
+
+    def _stage(self, key, values):
+        if not isinstance(values, list):
+            values = [values,]
+        with self._lock:
+            self._staged[key].extend(values)
+
+    def add_predictions(self, values, history=True):
+        """:param list values: list of (name, good, acdc, resubmit, any timestamp)
+        :param bool history: see :py:meth:`Storage.add_predictions`
+        """
+        self._stage('predictions' if history else 'carried', [(*v[:4], self.cycleid) for v in values])
+
+    def add_shadow_predictions(self, values):
+        """:param list values: list of (model, name, good, acdc, resubmit, any timestamp)"""
+        self._stage('shadows', [(*v[:5], self.cycleid) for v in values])
+
+    def add_contributions(self, values):
+        """:param list values: list of (name, encoded contributions, any timestamp)"""
+        self._stage('contributions', [(v[0], v[1], self.cycleid) for v in values])
+
+    def archive_docs(self, docs, timestamp=None):
+        """:param list docs: list of documents, archived at the cycle's timestamp"""
+        self._stage('docs', docs)
+
+    def add_labels(self, values):
+        self._stage('labels', values)
+
+    def update_statuses(self, values):
+        self._stage('statuses', values)
+
+    def pending(self):
+        """:returns: {kind: number of rows staged}
+        :rtype: dict
+        """
+        with self._lock:
+            return _row_counts(self._staged)
+
+    def commit(self):
+        """write all staged rows in one transaction, or queue them to the
+        background writer. Staged rows are dropped if the write fails, nothing
+        of them is written.
+
+        :returns: {kind: number of rows written or queued}
+        :rtype: dict
+        """
+
+        with self._lock:
+            staged, self._staged = self._staged, self._empty()
+        counts = _row_counts(staged)
+        if not counts and not staged['complete']:
+            return counts
+
+        if self.writer is not None:
+            self.writer.submit(staged)
+            return counts
+
+        starttime = time.time()
+        try:
+            self.storage.write_staged(staged)
+        except Exception:
+            with self._lock:
+                self._failed += 1
+            raise
+        logger.info("Cycle {} committed {}{} in {:.2f}s".format(
+            self.cycleid, counts, " and completed" if staged['complete'] else "", time.time() - starttime))
+        return counts
+
+    def end_batch(self):
+        """end of a batch of the cycle: commit when streaming"""
+        if self.streaming:
+            return self.commit()
+        return {}
+
+    def complete(self):
+        """end of the cycle: commit what is staged along with the cycle marker,
+        after all earlier commits (queued ones included). The marker is not
+        moved if an earlier commit of the cycle failed; when written behind,
+        the writer checks it at the time of writing.
+
+        :returns: {kind: number of rows written or queued}
+        :rtype: dict
+        :raises IncompleteCycle: when an earlier commit failed inline
+        """
+        with self._lock:
+            failed = self._failed
+            self._staged['complete'] = not failed
+        counts = self.commit()
+        if failed:
+            raise IncompleteCycle("{} commits of cycle {} failed, the cycle marker is left "
+                                  "at the previous cycle.".format(failed, self.cycleid))
+        return counts
+
+
+def _row_counts(staged):
+    return {k: len(staged[k]) for k in _STAGED_KINDS if staged[k]}
+
+
+def _merge_staged(stageds):
+    merged = dict(stageds[0], **{k: [] for k in _STAGED_KINDS})
+    for staged in stageds:
+        for k in _STAGED_KINDS:
+            merged[k].extend(staged[k])
+    merged['complete'] = any(staged['complete'] for staged in stageds)
+    return merged
+
+
+def is_transient(exc):
+    """whether a failed write is worth retrying as is"""
+
+    if isinstance(exc, PoolTimeout):
+        return True
+    if isinstance(exc, pymysql.err.OperationalError):
+        return bool(exc.args) and exc.args[0] in TRANSIENT_MYSQL_ERRORS
+    if isinstance(exc, sqlite3.OperationalError):
+        return 'locked' in str(exc) or 'busy' in str(exc)
+    return False
+
+
+class WriteBehind:
+    """background thread writing the commits of :py:class:`CycleSink` off the
+    collection loop, which nothing reads back within the cycle.
+
+    Commits wait in a bounded queue. Those of the same cycle queued while a
+    write is in progress are coalesced into the next transaction. Writes
+    failing on transient errors (see :py:func:`is_transient`) are retried
+    with exponential backoff, others are logged and counted as failed, and
+    the cycle they belong to is not marked complete. When the queue is full
+    :py:meth:`submit` blocks until the writer catches up (backpressure, see
+    :py:meth:`stats`).
+
+    :param Storage storage: backend written to
+    :param int queuesize: max commits waiting to be written
+    :param int retries: retries of a write failing on transient errors
+    :param float retrywait: seconds before the first retry, doubled at each
+    """
+
+    def __init__(self, storage, queuesize=4, retries=3, retrywait=2.):
+        self.storage = storage
+        self._retries = retries
+        self._retrywait = retrywait
+        self._queue = queue.Queue(maxsize=queuesize)
+        self._lock = threading.Lock()
+        self._stats = dict(submitted=0, writes=0, rows=0, retried=0, failed=0, failedrows=0,
+                           incomplete=0, blocked=0.)
+        self._failedcycles = set()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='writebehind', daemon=True)
+        self._thread.start()
+
+    def submit(self, staged):
+        """queue rows staged by a :py:class:`CycleSink`, blocking while the queue is full
+
+        :param dict staged: staged rows, see :py:meth:`Storage.write_staged`
+        """
+
+        if self._closed:
+            raise RuntimeError("Write-behind writer is closed.")
+        starttime = time.time()
+        try:
+            self._queue.put_nowait(staged)
+        except queue.Full:
+            logger.warning("Write-behind queue full ({} commits), waiting for the writer..".format(
+                self._queue.maxsize))
+            self._queue.put(staged)
+        with self._lock:
+            self._stats['submitted'] += 1
+            self._stats['blocked'] += time.time() - starttime
+
+    def stats(self):
+        """:returns: counters, with ``queued`` commits waiting and ``blocked``
+            seconds submitters waited on a full queue
+        :rtype: dict
+        """
+        with self._lock:
+            return dict(self._stats, queued=self._queue.qsize())
+
+    @property
+    def lagging(self):
+        """whether the writer has fallen behind (queue full)"""
+        return self._queue.full()
+
+    def flush(self):
+        """wait until everything queued so far is written (or failed)"""
+        self._queue.join()
+
+    def close(self):
+        """write what is queued and stop the writer thread"""
+
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        stop = False
+        while not stop:
+            items = [self._queue.get()]
+            while True:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = None in items
+            stageds = [item for item in items if item is not None]
+            # coalesce consecutive commits of the same cycle
+            groups = []
+            for staged in stageds:
+                if groups and groups[-1][-1]['timestamp'] == staged['timestamp']:
+                    groups[-1].append(staged)
+                else:
+                    groups.append([staged])
+            for group in groups:
+                self._write(_merge_staged(group))
+
+            for _ in items:
+                self._queue.task_done()
+
+    def _write(self, staged):
+        nrows = sum(_row_counts(staged).values())
+        if staged['complete'] and staged['timestamp'] in self._failedcycles:
+            logger.error("Cycle {} lost rows in failed writes, not marked complete.".format(staged['timestamp']))
+            staged = dict(staged, complete=False)
+            with self._lock:
+                self._stats['incomplete'] += 1
+        attempt = 0
+        while True:
+            starttime = time.time()
+            try:
+                self.storage.write_staged(staged)
+            except Exception as e:
+                if attempt < self._retries and is_transient(e):
+                    wait = self._retrywait * 2 ** attempt
+                    attempt += 1
+                    logger.warning("Write-behind of cycle {} failed ({}), retry {}/{} in {:.0f}s".format(
+                        staged['timestamp'], e, attempt, self._retries, wait))
+                    with self._lock:
+                        self._stats['retried'] += 1
+                    time.sleep(wait)
+                    continue
+                logger.exception("Write-behind of cycle {} failed, {} rows dropped.".format(
+                    staged['timestamp'], nrows))
+                self._failedcycles.add(staged['timestamp'])
+                with self._lock:
+                    self._stats['failed'] += 1
+                    self._stats['failedrows'] += nrows
+                return
+
+            logger.info("Cycle {} written {}{} in {:.2f}s (write-behind, {} queued)".format(
+                staged['timestamp'], _row_counts(staged), " and completed" if staged['complete'] else "",
+                time.time() - starttime, self._queue.qsize()))
+            with self._lock:
+                self._stats['writes'] += 1
+                self._stats['rows'] += nrows
+            return
+
+# -----------------------------------------------------------------------------
+
+def get_storage(config):
+    """storage backend selected by the optional ``storage`` config section::
+
+        storage:
+          backend: sqlite    # mysql (default) or sqlite
+          path: osdroid.sqlite
+
+    :param dict config: config dictionary
+    :rtype: Storage
+    """
+
+    storageconfig = config.get('storage', None) or {}
+    backend = storageconfig.get('backend', 'mysql')
+    if backend == 'mysql':
+        return MySQLStorage(config)
+    if backend == 'sqlite':
+        return SQLiteStorage(monitutils.repo_path(storageconfig.get('path', DEFAULT_SQLITE_PATH)))
+    raise ValueError("Unknown storage backend: {}".format(backend))
+
+# -----------------------------------------------------------------------------
+
+def check_storage(storage):
+    """conformance check every backend has to pass. Writes rows of made-up
+    workflows, run it against a scratch database.
+
+    :param Storage storage: backend to check
+    :returns: names of the failed checks
+    :rtype: list
+    """
+
+    failed = []
+
+    def expect(label, cond):
+        if not cond:
+            failed.append(label)
+            logger.error("FAILED: {}".format(label))
+
+    run = uuid.uuid4().hex[:8]
+    wf, other = 'storagecheck_{}_a'.format(run), 'storagecheck_{}_b'.format(run)
+    t0, t1, t2 = (datetime.fromtimestamp(int(time.time()) // 60 * 60 + 60 * i) for i in (-2, -1, 0))
+
+    storage.create()
+
+    # prediction history, snapshot and cycle marker
+    marker = storage.cycle_time()
+    storage.add_predictions([(wf, 0.7, 0.2, 0.1, _fmt(t0)), (other, 0.1, 0.8, 0.1, _fmt(t0))])
+    storage.add_predictions([(wf, 0.1, 0.1, 0.8, _fmt(t2))])
+    storage.add_predictions([(wf, 0.2, 0.7, 0.1, _fmt(t1))])  # replayed older batch
+    history = storage.prediction_history(wf)
+    expect("history in time order", [h[3] for h in history] == [t0, t1, t2])
+    expect("history values", [round(h[2], 6) for h in history] == [0.1, 0.1, 0.8])
+    latest = storage.latest_prediction(wf)
+    expect("snapshot keeps newest row", latest is not None and round(latest[2], 6) == 0.8 and latest[4] == t2)
+    expect("snapshot first seen", latest is not None and latest[3] == t0)
+    expect("snapshot unlabeled", latest is not None and latest[5] == -1)
+    expect("unknown workflow has no snapshot", storage.latest_prediction('storagecheck_{}_none'.format(run)) is None)
+    expect("predictions leave the cycle marker", storage.cycle_time() == marker)
+    storage.complete_cycle(_fmt(t2))
+    storage.complete_cycle(_fmt(t1))
+    expect("cycle marker never goes back", storage.cycle_time() is not None and storage.cycle_time() >= t2)
+    storage.add_shadow_predictions([('candidate', wf, 0.3, 0.3, 0.4, _fmt(t2))])
+    storage.add_contributions([(wf, b'\x00\x01', _fmt(t2))])
+
+    # labels
+    storage.add_labels([(wf, 1)])
+    expect("labeled workflows", wf in storage.labeled_workflows() and other not in storage.labeled_workflows())
+    latest = storage.latest_prediction(wf)
+    expect("label copied onto snapshot", latest is not None and latest[5] == 1)
+
+    # document archive and error counts
+    doc = {'name': wf, 'status': 'running-closed', 'failureRate': 0.5, 'tasks': [
+        {'name': 'Task1',
+         'siteErrors': [{'site': 'T1_US_FNAL', 'counts': 5}, {'site': 'T2_CH_CERN', 'counts': 1}],
+         'errors': [{'errorCode': 50664, 'siteName': 'T1_US_FNAL', 'counts': 3},
+                    {'errorCode': 8001, 'siteName': 'T1_US_FNAL', 'counts': 2}]}]}
+    storage.archive_docs([dict(doc, failureRate=0.2)], _fmt(t1))
+    storage.archive_docs([doc, {'name': other, 'tasks': []}], _fmt(t2))
+    expect("latest document", storage.archived_doc(wf) == doc)
+    expect("document at time", (storage.archived_doc(wf, _fmt(t1)) or {}).get('failureRate') == 0.2)
+    expect("unknown document", storage.archived_doc('storagecheck_{}_none'.format(run)) is None)
+    expect("error counts", [tuple(r) for r in storage.error_counts(wf, _fmt(t2))] == [
+        ('Task1', 'T1_US_FNAL', -1, 5), ('Task1', 'T1_US_FNAL', 8001, 2),
+        ('Task1', 'T1_US_FNAL', 50664, 3), ('Task1', 'T2_CH_CERN', -1, 1)])
+    expect("no error counts", storage.error_counts(other, _fmt(t2)) == [])
+    labeled = [r for r in storage.labeled_docs(since=_fmt(t1)) if r[0] in (wf, other)]
+    expect("labeled documents", sorted((r[3], r[4]) for r in labeled) == [
+        (int(time.mktime(t1.timetuple())), 1), (int(time.mktime(t2.timetuple())), 1)])
+    labeled = [r for r in storage.labeled_docs(since=_fmt(t1), latest_only=True) if r[0] in (wf, other)]
+    expect("latest labeled document", len(labeled) == 1 and decode_doc(labeled[0][1], labeled[0][2]) == doc)
+
+    # statuses
+    storage.update_statuses([(wf, 'running-closed', 0.5), (other, 'normal-archived', 0.1)])
+    storage.update_statuses([(wf, 'rejected-archived', 0.5)])
+    completed = storage.completed_workflows()
+    expect("completed workflows", wf in completed and other in completed)
+
+    # cycle sink: staged rows committed together, stamped with the cycle
+    cycletime = time.mktime(t2.timetuple()) + 60
+    t3 = datetime.fromtimestamp(cycletime)
+    sink = storage.sink(cycletime, streaming=False)
+    sink.add_predictions([(other, 0.2, 0.2, 0.6, None)])
+    sink.archive_docs([{'name': other, 'tasks': []}])
+    sink.update_statuses([(other, 'running-open', 0.3)])
+    sink.end_batch()
+    expect("nothing written before commit", storage.latest_prediction(other)[4] == t0)
+    expect("sink commit counts", sink.commit() == {'predictions': 1, 'docs': 1, 'statuses': 1})
+    expect("sink rows stamped with cycle", storage.latest_prediction(other)[4] == t3
+           and storage.archived_doc(other, _fmt(t3)) is not None)
+    expect("cycle marker waits for completion", storage.cycle_time() < t3)
+    expect("sink completion", sink.complete() == {} and storage.cycle_time() == t3)
+    expect("sink statuses", other not in storage.completed_workflows())
+    sink.add_predictions([(wf, 0.3, 0.3, 0.4, None)])
+    sink.archive_docs([{'tasks': []}])  # no name, fails the transaction
+    try:
+        sink.commit()
+        expect("failing sink commit raises", False)
+    except Exception:
+        pass
+    expect("failed sink commit writes nothing", storage.latest_prediction(wf)[4] == t2)
+    expect("failed sink commit drops staged rows", sink.pending() == {})
+    later = storage.sink(cycletime + 30, streaming=False)
+    later.add_predictions([(other, 0.2, 0.2, 0.6, None)])
+    later.archive_docs([{'tasks': []}])
+    try:
+        later.commit()
+    except Exception:
+        pass
+    later.add_labels([(other, 0)])
+    try:
+        later.complete()
+        expect("completing a cycle with a failed commit raises", False)
+    except IncompleteCycle:
+        pass
+    expect("failed commit keeps the cycle marker", storage.cycle_time() == t3)
+
+    # same, written behind
+    writer = WriteBehind(storage, retrywait=0.)
+    sink = storage.sink(cycletime + 60, writer=writer)
+    sink.add_predictions([(other, 0.6, 0.2, 0.2, None)])
+    sink.add_predictions([(wf, 0.1, 0.1, 0.8, None)], history=False)
+    sink.end_batch()
+    sink.add_labels([(other, 2)])
+    sink.complete()
+    writer.close()
+    latest = storage.latest_prediction(other)
+    expect("written behind", latest is not None and round(latest[0], 6) == 0.6 and latest[5] == 2)
+    latest = storage.latest_prediction(wf)
+    expect("carried forward refreshes the snapshot only",
+           len(storage.prediction_history(wf)) == 3 and latest is not None
+           and latest[4] == datetime.fromtimestamp(cycletime + 60))
+    expect("cycle completed behind", storage.cycle_time() == datetime.fromtimestamp(cycletime + 60))
+    expect("write-behind stats", writer.stats()['failed'] == 0 and writer.stats()['queued'] == 0)
+    writer = WriteBehind(storage, retrywait=0.)
+    sink = storage.sink(cycletime + 120, writer=writer)
+    sink.archive_docs([{'tasks': []}])
+    sink.end_batch()
+    writer.flush()
+    sink.add_labels([(other, 0)])
+    sink.complete()
+    writer.close()
+    expect("failed write-behind keeps the cycle marker",
+           storage.cycle_time() == datetime.fromtimestamp(cycletime + 60))
+    expect("failed write-behind stats", writer.stats()['failed'] == 1 and writer.stats()['incomplete'] == 1)
+
+    storage.maintain()
+    expect("maintenance keeps recent documents", storage.archived_doc(wf) == doc)
+
+    return failed
+
+# -----------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Storage backends of the monitoring pipeline.")
+    parser.add_argument('--check', action='store_true', help="run the conformance check against a backend")
+    parser.add_argument('--backend', choices=('sqlite', 'mysql'), default='sqlite', help="backend to check")
+    parser.add_argument('--path', default=None, help="sqlite file, default a temporary one")
+    parser.add_argument('--config', default=CONFIG_FILE_PATH, help="config file with MySQL credentials")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    if not args.check:
+        parser.print_help()
+        return 0
+
+    if args.backend == 'mysql':
+        storage = MySQLStorage(monitutils.get_yamlconfig(args.config))
+        failed = check_storage(storage)
+    elif args.path is not None:
+        storage = SQLiteStorage(args.path)
+        failed = check_storage(storage)
+    else:
+        import tempfile
+
+        with tempfile.TemporaryDirectory(prefix='storagecheck_') as tmpdir:
+            storage = SQLiteStorage(join(tmpdir, 'osdroid.sqlite'))
+            failed = check_storage(storage)
+
+    if failed:
+        logger.error("{} check(s) failed for {}".format(len(failed), type(storage).__name__))
+        return 1
+    logger.info("{} passed all checks.".format(type(storage).__name__))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""benchmark feature matrix construction for `predict_docs`:
+OrderedDict -> pandas.DataFrame -> DMatrix (previous path) vs.
+preallocated float32 matrix -> DMatrix (`extract_feature_matrix`).
+
+Docs are replicated from the bundled test docs up to 10k. Peak memory is
+measured with tracemalloc, which sees python and numpy allocations but not
+the ones made inside xgboost.
+"""
+import gzip
+import json
+import sys
+import time
+import tracemalloc
+from os.path import abspath, dirname, exists, join
+
+sys.path.insert(0, join(dirname(abspath(__file__)), '..'))
+
+import numpy as np
+import xgboost as xgb
+from workflowprediction import FEATURE_NAMES, extract_doc, extract_feature_matrix
+
+TESTDOC_PATH = join(dirname(abspath(__file__)), 'toSendDoc_190624-180839.json.gz')
+MODEL_PATH = join(dirname(abspath(__file__)), '../models/xgb_optimized.model')
+NDOCS = 10000
+
+
+def load_docs(ndocs=NDOCS):
+    with gzip.GzipFile(TESTDOC_PATH, 'r') as fin:
+        docs = json.loads(fin.read())
+    return [docs[i % len(docs)] for i in range(ndocs)]
+
+
+def get_booster(docs):
+    bst = xgb.Booster({"nthread": 4})
+    if exists(MODEL_PATH):
+        bst.load_model(MODEL_PATH)
+        return bst
+    # no production model around, a throwaway one is as good for timing
+    _, X = extract_feature_matrix(docs)
+    label = np.random.randint(0, 3, size=X.shape[0])
+    dtrain = xgb.DMatrix(X, label=label, feature_names=FEATURE_NAMES)
+    return xgb.train({"objective": "multi:softprob", "num_class": 3, "nthread": 4},
+                     dtrain, num_boost_round=50)
+
+
+def pandas_path(docs, bst):
+    import pandas as pd
+
+    features = []
+    for doc in docs:
+        wname, featureExtracted = extract_doc(doc)
+        featureExtracted["name"] = wname
+        features.append(featureExtracted)
+    df = pd.DataFrame(features)
+    feature_cols = [c for c in df.columns if c != "name"]
+    X = df[feature_cols]
+    predprob = bst.predict(xgb.DMatrix(X)).reshape(X.shape[0], 3)
+    return dict(zip(df["name"].values, predprob.tolist()))
+
+
+def matrix_path(docs, bst):
+    names, X = extract_feature_matrix(docs)
+    predprob = bst.predict(xgb.DMatrix(X, feature_names=FEATURE_NAMES)).reshape(X.shape[0], 3)
+    return dict(zip(names, predprob.tolist()))
+
+
+def measure(func, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    res = func(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return res, elapsed, peak
+
+
+def main():
+    docs = load_docs()
+    bst = get_booster(docs)
+
+    # pandas import cost is part of the old path, pay it inside the measurement
+    res0, t0, m0 = measure(pandas_path, docs, bst)
+    res1, t1, m1 = measure(matrix_path, docs, bst)
+
+    # old path reads the clock per doc, so only time-independent features can match exactly
+    import pandas as pd
+    X0 = pd.DataFrame([extract_doc(doc)[1] for doc in docs]).values.astype(np.float32)[:, :-1]
+    _, X1 = extract_feature_matrix(docs)
+    assert np.array_equal(X0, X1[:, :-1], equal_nan=True)
+    assert res0.keys() == res1.keys()
+
+    print("{} docs, identical time-independent features".format(len(docs)))
+    print("{:<28} {:>10} {:>14}".format('', 'time/s', 'peak mem/MB'))
+    print("{:<28} {:>10.3f} {:>14.1f}".format('DataFrame -> DMatrix', t0, m0 / 2**20))
+    print("{:<28} {:>10.3f} {:>14.1f}".format('float32 matrix -> DMatrix', t1, m1 / 2**20))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""micro-benchmark of inference paths of `predict_matrix`:
+inplace prediction on the float32 matrix vs. DMatrix construction.
+
+- single-doc latency: extract + predict one bundled test doc at a time
+- throughput: predict 10k docs (replicated from the bundled test docs)
+"""
+import statistics
+import sys
+import tempfile
+import time
+from os.path import abspath, dirname, exists, join
+
+sys.path.insert(0, join(dirname(abspath(__file__)), '..'))
+
+import numpy as np
+from benchfeaturematrix import MODEL_PATH, get_booster, load_docs
+from workflowprediction import extract_feature_matrix, predict_docs, predict_matrix
+
+NTHREAD = 4
+NSINGLE = 500
+
+
+def model_path(docs):
+    if exists(MODEL_PATH):
+        return MODEL_PATH
+    fn = join(tempfile.mkdtemp(), 'throwaway.json')
+    get_booster(docs).save_model(fn)
+    return fn
+
+
+def single_doc_latency(docs, model, inplace):
+    predict_docs(docs[:1], model, nthread=NTHREAD, inplace=inplace)  # warm up
+    latencies = []
+    for doc in docs[:NSINGLE]:
+        start = time.perf_counter()
+        predict_docs([doc], model, nthread=NTHREAD, inplace=inplace)
+        latencies.append((time.perf_counter() - start) * 1e3)
+    latencies.sort()
+    return statistics.median(latencies), latencies[int(len(latencies) * 0.95)]
+
+
+def throughput(names, X, model, inplace, repeat=5):
+    predict_matrix(names, X, model, nthread=NTHREAD, inplace=inplace)  # warm up
+    start = time.perf_counter()
+    for _ in range(repeat):
+        res = predict_matrix(names, X, model, nthread=NTHREAD, inplace=inplace)
+    return len(names) * repeat / (time.perf_counter() - start), res
+
+
+def main():
+    docs = load_docs()
+    model = model_path(docs)
+    names, X = extract_feature_matrix(docs)
+    print("model: {}, nthread: {}".format(model, NTHREAD))
+
+    print("{:<10} {:>16} {:>16} {:>18}".format('', 'single p50/ms', 'single p95/ms', '10k docs/s'))
+    results = {}
+    for label, inplace in [('DMatrix', False), ('inplace', True)]:
+        p50, p95 = single_doc_latency(docs, model, inplace)
+        rate, results[label] = throughput(names, X, model, inplace)
+        print("{:<10} {:>16.3f} {:>16.3f} {:>18.0f}".format(label, p50, p95, rate))
+
+    maxdiff = max(np.abs(np.array(results['DMatrix'][k]) - np.array(results['inplace'][k])).max()
+                  for k in results['DMatrix'])
+    print("max |prob diff| between paths: {:.2e}".format(maxdiff))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+"""Build a training set by streaming archived documents from
+`DocsOneMonthArchive`, joined with their labels from `LabelArchive`, through
+the production feature extractor.
+
+Rows are streamed from the configured storage backend (a server-side cursor
+on MySQL) and processed in chunks, so memory stays bounded whatever the size
+of the archive. Output directory::
+
+    X.npy          # float32 (nrows, nfeatures), columns as columns.json
+    y.npy          # int8 labels
+    timestamps.npy # int64 unix time the doc was archived
+    names.txt      # workflow name, one per row
+    columns.json
+
+usage: python trainingset.py --out DIR [--since YYYY-MM-DD] [--until YYYY-MM-DD] [--latest-only] [--nproc N]
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import time
+import zlib
+from os.path import abspath, dirname, join
+
+import numpy as np
+from doccodec import decode_doc
+from monitutils import get_yamlconfig
+from keywordencoding import get_encoding_table
+from storage import get_storage
+from workflowprediction import FEATURE_NAMES, PARALLEL_EXTRACTION_THRESHOLD, ParallelExtractor
+
+CONFIG_FILE_PATH = join(dirname(abspath(__file__)), 'config/config.yml')
+
+logger = logging.getLogger("workflowmonitLogger")
+
+
+# -----------------------------------------------------------------------------
+
+def stream_labeled_docs(config, since=None, until=None, latest_only=False, fetchsize=200):
+    """stream (name, document, format, unixtime, label) of archived docs having a known label,
+    from the configured storage backend (see :py:meth:`storage.Storage.labeled_docs`).
+
+    :param dict config: config dictionary
+    :param str since: only docs archived at or after this date
+    :param str until: only docs archived before this date
+    :param bool latest_only: only the most recent doc of each workflow
+    :param int fetchsize: rows fetched from server per round trip
+    :returns: generator of tuple
+    """
+
+    return get_storage(config).labeled_docs(since=since, until=until, latest_only=latest_only,
+                                            fetchsize=fetchsize)
+
+# -----------------------------------------------------------------------------
+
+def _write_npy_from_raw(rawfn, npyfn, dtype, shape):
+    """wrap a raw binary file of C-ordered ``dtype`` items into a ``.npy`` file"""
+
+    with open(npyfn, 'wb') as fout, open(rawfn, 'rb') as fin:
+        header = {'descr': np.dtype(dtype).str, 'fortran_order': False, 'shape': shape}
+        np.lib.format.write_array_header_1_0(fout, header)
+        shutil.copyfileobj(fin, fout)
+    os.remove(rawfn)
+
+
+def build_training_set(outdir, config, since=None, until=None, latest_only=False, chunksize=500, nproc=1):
+    """stream labeled docs, extract features chunk by chunk and write the training set.
+
+    :param str outdir: output directory
+    :param dict config: config dictionary
+    :param str since: only docs archived at or after this date
+    :param str until: only docs archived before this date
+    :param bool latest_only: only the most recent doc of each workflow
+    :param int chunksize: number of docs processed at a time
+    :param int nproc: number of extraction processes; chunks are then at least
+        :py:data:`workflowprediction.PARALLEL_EXTRACTION_THRESHOLD` docs
+    :returns: number of rows written
+    :rtype: int
+    """
+
+    os.makedirs(outdir, exist_ok=True)
+    nrows = 0
+    nskipped = 0
+    if nproc > 1:
+        chunksize = max(chunksize, PARALLEL_EXTRACTION_THRESHOLD)
+
+    with open(join(outdir, 'X.raw'), 'wb') as fX, \
+         open(join(outdir, 'y.raw'), 'wb') as fy, \
+         open(join(outdir, 'timestamps.raw'), 'wb') as ft, \
+         open(join(outdir, 'names.txt'), 'w') as fn, \
+         ParallelExtractor(nproc=nproc) as extractor:
+
+        def flush(docs, labels, timestamps):
+            names, X = extractor.extract(docs, now=timestamps)
+            fX.write(X.tobytes())
+            fy.write(np.asarray(labels, dtype=np.int8).tobytes())
+            ft.write(np.asarray(timestamps, dtype=np.int64).tobytes())
+            fn.writelines(name + '\n' for name in names)
+
+        docs, labels, timestamps = [], [], []
+        for name, document, fmt, unixtime, label in stream_labeled_docs(
+                config, since=since, until=until, latest_only=latest_only):
+            try:
+                docs.append(decode_doc(document, fmt))
+            except (ValueError, zlib.error):
+                nskipped += 1
+                continue
+            labels.append(label)
+            timestamps.append(int(unixtime))
+
+            if len(docs) >= chunksize:
+                flush(docs, labels, timestamps)
+                nrows += len(docs)
+                docs, labels, timestamps = [], [], []
+                logger.info("{} rows written..".format(nrows))
+
+        if docs:
+            flush(docs, labels, timestamps)
+            nrows += len(docs)
+
+    _write_npy_from_raw(join(outdir, 'X.raw'), join(outdir, 'X.npy'), np.float32, (nrows, len(FEATURE_NAMES)))
+    _write_npy_from_raw(join(outdir, 'y.raw'), join(outdir, 'y.npy'), np.int8, (nrows,))
+    _write_npy_from_raw(join(outdir, 'timestamps.raw'), join(outdir, 'timestamps.npy'), np.int64, (nrows,))
+    with open(join(outdir, 'columns.json'), 'w') as f:
+        json.dump(FEATURE_NAMES, f)
+
+    # keywords first seen here must encode the same way at inference
+    get_encoding_table().save()
+
+    if nskipped:
+        logger.warning("{} documents could not be decoded and were skipped.".format(nskipped))
+    return nrows
+
+# -----------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a training set from archived docs and labels.")
+    parser.add_argument('--out', required=True, help="output directory")
+    parser.add_argument('--since', default=None, help="only docs archived at or after this date (YYYY-MM-DD)")
+    parser.add_argument('--until', default=None, help="only docs archived before this date (YYYY-MM-DD)")
+    parser.add_argument('--latest-only', action='store_true', help="only the most recent doc of each workflow")
+    parser.add_argument('--chunksize', type=int, default=500, help="docs processed at a time")
+    parser.add_argument('--nproc', type=int, default=1, help="processes extracting features of a chunk")
+    parser.add_argument('--config', default=CONFIG_FILE_PATH, help="config file with the storage settings")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    starttime = time.time()
+    nrows = build_training_set(args.out, get_yamlconfig(args.config),
+                               since=args.since, until=args.until,
+                               latest_only=args.latest_only, chunksize=args.chunksize,
+                               nproc=args.nproc)
+    logger.info("{} rows written to {} in {:.1f}s".format(nrows, args.out, time.time() - starttime))
+
+
+if __name__ == "__main__":
+    main()
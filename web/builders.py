@@ -1,11 +1,15 @@
 #!/usr/bin/env python
-import json
 import traceback
 from collections import defaultdict
 from os.path import abspath, dirname, join
 
 import pymysql
 import yaml
+from dbpool import get_pool_from_config
+from doccodec import decode_doc
+from contribcodec import CLASSES, COLUMNS, decode_contributions
+from errorcounts import SITE_TOTAL
+from predictionrollup import argmax_fraction, workflow_history
 
 from .database import Database
 from .forms import getSiteIssueSettings, getWorkflowIssueSettings
@@ -14,6 +18,13 @@ from .serverside.serverside_table import ServerSideTable
 
 CONFIG_FILE_PATH = join(dirname(abspath(__file__)), "../config/config.yml")
 
+def load_mysql_config():
+    """MySQL credentials from config, sizing the shared connection pool on first call
+    with the optional ``mysqlpool`` section."""
+    config = yaml.load(open(CONFIG_FILE_PATH).read(), Loader=yaml.FullLoader)
+    get_pool_from_config(config)
+    return config['mysql']
+
 def convert_time(tsecs, fmt="%Y-%m-%d %H:%M:%S"):
     from datetime import datetime
     return datetime.fromtimestamp(tsecs).strftime(fmt)
@@ -21,48 +32,43 @@ def convert_time(tsecs, fmt="%Y-%m-%d %H:%M:%S"):
 
 class TableBuilder:
     def __init__(self):
-        self._config = yaml.load(open(CONFIG_FILE_PATH).read(), Loader=yaml.FullLoader)['mysql']
+        self._config = load_mysql_config()
 
     def updatetime(self):
-        db = Database(*self._config)
-        db.execute('SELECT MAX(timestamp) FROM PredictionHistory')
-        return db.fetchone()['MAX(timestamp)'].strftime("%Y-%m-%d %H:%M:%S")
+        with Database(*self._config) as db:
+            db.execute('SELECT timestamp FROM PredictionCycle WHERE id=1')
+            return db.fetchone()['timestamp'].strftime("%Y-%m-%d %H:%M:%S")
 
     def running_counts(self):
-        db = Database(*self._config)
-        db.execute("""SELECT COUNT(DISTINCT name)
-                      FROM PredictionHistory
-                      WHERE timestamp=(SELECT MAX(timestamp)
-                      FROM PredictionHistory)""")
-        return db.fetchone()['COUNT(DISTINCT name)']
+        with Database(*self._config) as db:
+            db.execute("""SELECT COUNT(*) AS counts
+                          FROM PredictionLatest
+                          WHERE timestamp>=(SELECT timestamp
+                          FROM PredictionCycle WHERE id=1)""")
+            return db.fetchone()['counts']
 
     def archived_counts(self):
         return self.everything_counts()-self.running_counts()
 
     def everything_counts(self):
-        db = Database(*self._config)
-        db.execute('SELECT COUNT(DISTINCT name) FROM PredictionHistory')
-        return db.fetchone()['COUNT(DISTINCT name)']
+        with Database(*self._config) as db:
+            db.execute('SELECT COUNT(*) AS counts FROM PredictionLatest')
+            return db.fetchone()['counts']
 
     def _rowinfo(self, workflowname):
-        db = Database(*self._config)
-        sql = """SELECT good, acdc, resubmit, timestamp
-                 FROM PredictionHistory
-                 WHERE name=%s
-                 ORDER BY timestamp ASC"""
-        return db.query(sql, (workflowname,))
+        # raw rows for the recent past, hourly/daily aggregates beyond
+        with Database(*self._config) as db:
+            return workflow_history(db, workflowname)
 
     def collect_running(self, request):
-        db = Database(*self._config)
-
-        tabledata = []
-        sql = """SELECT name, good, acdc, resubmit, timestamp
-                 FROM PredictionHistory
-                 WHERE timestamp=(
-                     SELECT MAX(timestamp)
-                     FROM PredictionHistory
-                 )"""
-        tabledata = db.query(sql)
+        with Database(*self._config) as db:
+            sql = """SELECT name, good, acdc, resubmit, timestamp
+                     FROM PredictionLatest
+                     WHERE timestamp>=(
+                         SELECT timestamp
+                         FROM PredictionCycle WHERE id=1
+                     )"""
+            tabledata = db.query(sql)
         for i, entry in enumerate(tabledata):
             entry['id'] = str(i)
 
@@ -71,26 +77,16 @@ class TableBuilder:
         return ServerSideTable(request, tabledata, columns).output_result()
 
     def collect_running_long(self, request, days=2):
-        db = Database(*self._config)
-
-        tabledata = []
-        sql = """\
-            SELECT B.name, B.good, B.acdc, B.resubmit, B.timestamp
-            FROM (
-                SELECT *, MAX(timestamp) AS maxts, MIN(timestamp) AS mints
-                FROM (
-                    SELECT *
-                    FROM PredictionHistory
-                    ORDER BY timestamp DESC
-                ) AS T
-                GROUP BY name
-                HAVING maxts=(
-                    SELECT MAX(timestamp)
-                    FROM PredictionHistory
+        with Database(*self._config) as db:
+            sql = """\
+                SELECT name, good, acdc, resubmit, timestamp
+                FROM PredictionLatest
+                WHERE timestamp>=(
+                    SELECT timestamp
+                    FROM PredictionCycle WHERE id=1
                     )
-                    AND TIMESTAMPDIFF(DAY, mints, maxts)>%d
-            ) AS B""" % days
-        tabledata = db.query(sql)
+                    AND TIMESTAMPDIFF(DAY, firstseen, timestamp)>%s"""
+            tabledata = db.query(sql, (days,))
         for i, entry in enumerate(tabledata):
             entry['id'] = str(i)
 
@@ -99,25 +95,13 @@ class TableBuilder:
         return ServerSideTable(request, tabledata, columns).output_result()
 
     def collect_archived(self, request):
-        db = Database(*self._config)
-
-        tabledata = []
-        sql = """\
-            SELECT B.name, B.good, B.acdc, B.resubmit, B.timestamp, COALESCE(LabelArchive.label, -1) AS label
-            FROM (
-                SELECT *, MAX(timestamp) AS maxts, MIN(timestamp) AS mints
-                FROM (
-                    SELECT *
-                    FROM PredictionHistory
-                    ORDER BY timestamp DESC
-                ) AS T
-                GROUP BY name
-                HAVING maxts!=(SELECT MAX(timestamp) FROM PredictionHistory)
-            ) AS B
-                LEFT JOIN LabelArchive
-                ON B.name = LabelArchive.name
-        """
-        tabledata = db.query(sql)  # list of dictionary
+        with Database(*self._config) as db:
+            sql = """\
+                SELECT name, good, acdc, resubmit, timestamp, label
+                FROM PredictionLatest
+                WHERE timestamp<(SELECT timestamp FROM PredictionCycle WHERE id=1)
+            """
+            tabledata = db.query(sql)  # list of dictionary
         for i, entry in enumerate(tabledata):
             entry['id'] = str(i)
 
@@ -126,15 +110,10 @@ class TableBuilder:
         return ServerSideTable(request, tabledata, columns).output_result()
 
     def collect_everything(self, request):
-        db = Database(*self._config)
-
-        tabledata = []
-        sql = """SELECT name, good, acdc, resubmit, timestamp
-                 FROM (
-                     SELECT * FROM PredictionHistory
-                     ORDER BY timestamp DESC
-                 ) AS T GROUP BY name"""
-        tabledata = db.query(sql)
+        with Database(*self._config) as db:
+            sql = """SELECT name, good, acdc, resubmit, timestamp
+                     FROM PredictionLatest"""
+            tabledata = db.query(sql)
         for i, entry in enumerate(tabledata):
             entry['id'] = str(i)
 
@@ -148,86 +127,111 @@ class TableBuilder:
             record['timestamp'] = record['timestamp'].strftime("%Y-%m-%d %H:%M:%S")
         return rowinfo
 
+    def get_workflow_contributions(self, wfname, timestamp=None):
+        """per-feature contributions to the prediction of a workflow, as stored at
+        prediction time (most recent unless ``timestamp`` is given)
+
+        :param str wfname: workflow name
+        :param str timestamp: prediction timestamp
+        :return: features, classes and contributions (class x feature, in margin space),
+            ``None`` if nothing stored
+        :rtype: dict
+        """
+        with Database(*self._config) as db:
+            if not timestamp:
+                sql = """SELECT contribs, timestamp FROM PredictionContribs
+                         WHERE name=%s ORDER BY timestamp DESC LIMIT 1"""
+                rawdata = db.query(sql, (wfname,))
+            else:
+                sql = "SELECT contribs, timestamp FROM PredictionContribs WHERE name=%s AND timestamp=%s"
+                rawdata = db.query(sql, (wfname, timestamp))
+            if not rawdata:
+                return None
+
+            return {
+                'features': COLUMNS,
+                'classes': CLASSES,
+                'contribs': decode_contributions(rawdata[0]['contribs']).tolist(),
+                'timestamp': rawdata[0]['timestamp'].strftime("%Y-%m-%d %H:%M:%S"),
+            }
+
 
 class DocBuilder:
     def __init__(self):
-        self._config = yaml.load(open(CONFIG_FILE_PATH).read(), Loader=yaml.FullLoader)['mysql']
+        self._config = load_mysql_config()
         self._lastdoc = None
         self._lasttimestamp = None
 
     @property
     def lastdoc(self):
         if not self._lastdoc:
-            db = Database(*self._config)
-            sql = """\
-                SELECT document FROM DocsOneMonthArchive
-                WHERE timestamp=(
-                    SELECT MAX(timestamp)
-                    FROM DocsOneMonthArchive
-                );"""
-            rawdata = db.query(sql)
-            self._lastdoc = [json.loads(d['document']) for d in rawdata]
+            with Database(*self._config) as db:
+                sql = """\
+                    SELECT document, format FROM DocsOneMonthArchive
+                    WHERE timestamp=(
+                        SELECT timestamp
+                        FROM PredictionCycle WHERE id=1
+                    );"""
+                rawdata = db.query(sql)
+                self._lastdoc = [decode_doc(d['document'], d['format']) for d in rawdata]
         return self._lastdoc
 
     @property
     def updatetime(self):
         if not self._lasttimestamp:
-            db = Database(*self._config)
-            db.execute('SELECT MAX(timestamp) FROM DocsOneMonthArchive;')
-            self._lasttimestamp = db.fetchone()['MAX(timestamp)'].strftime("%Y-%m-%d %H:%M:%S")
+            with Database(*self._config) as db:
+                db.execute('SELECT timestamp FROM PredictionCycle WHERE id=1')
+                self._lasttimestamp = db.fetchone()['timestamp'].strftime("%Y-%m-%d %H:%M:%S")
         return self._lasttimestamp
 
     def workflow_last_updatetime(self, name):
-        db = Database(*self._config)
-        sql = """SELECT MAX(timestamp) FROM DocsOneMonthArchive WHERE name=%s;"""
-        db.execute(sql, (name,))
-        return db.fetchone()['MAX(timestamp)'].strftime("%Y-%m-%d %H:%M:%S")
+        with Database(*self._config) as db:
+            sql = """SELECT MAX(timestamp) FROM DocsOneMonthArchive WHERE name=%s;"""
+            db.execute(sql, (name,))
+            return db.fetchone()['MAX(timestamp)'].strftime("%Y-%m-%d %H:%M:%S")
 
     def totalerror_per_site(self):
-        cnt = defaultdict(int)
-
-        for doc in self.lastdoc:
-            for tsk in doc.get('tasks', []):
-                for se in tsk.get('siteErrors', []):
-                    cnt[se['site']] += se['counts']
+        with Database(*self._config) as db:
+            sql = """\
+                SELECT site, SUM(counts) AS errors FROM CycleErrorCounts
+                WHERE timestamp=(SELECT timestamp FROM PredictionCycle WHERE id=1) AND errorCode=%s
+                GROUP BY site"""
+            rawdata = db.query(sql, (SITE_TOTAL,))
 
-        data_ = []
-        for k, v in cnt.items():
-            data_.append({'site': k, 'errors': v})
+        data_ = [{'site': d['site'], 'errors': int(d['errors'])} for d in rawdata]
 
         return {'data': data_, 'timestamp': self.updatetime}
 
     def get_error_report(self, name, timestamp=None):
-        db = Database(*self._config)
-        if not timestamp:
-            sql = "SELECT document FROM DocsOneMonthArchive WHERE name=%s ORDER BY timestamp DESC;"
-            db.execute(sql, (name,))
-        else:
-            sql = "SELECT document FROM DocsOneMonthArchive WHERE name=%s AND timestamp=%s;"
-            db.execute(sql, (name, timestamp))
-        rawdata = db.fetchone()
-        if rawdata:
-            return json.loads(rawdata['document'])
-        else:
-            return None
+        with Database(*self._config) as db:
+            if not timestamp:
+                sql = "SELECT document, format FROM DocsOneMonthArchive WHERE name=%s ORDER BY timestamp DESC LIMIT 1;"
+                db.execute(sql, (name,))
+            else:
+                sql = "SELECT document, format FROM DocsOneMonthArchive WHERE name=%s AND timestamp=%s;"
+                db.execute(sql, (name, timestamp))
+            rawdata = db.fetchone()
+            if rawdata:
+                return decode_doc(rawdata['document'], rawdata['format'])
+            else:
+                return None
 
     def get_history_timestamps(self, name):
-        db = Database(*self._config)
-        sql="SELECT timestamp FROM DocsOneMonthArchive WHERE name=%s;"
-        rawdata = db.query(sql, (name,))
-        return [d['timestamp'].strftime("%Y-%m-%d %H:%M:%S") for d in rawdata]
+        with Database(*self._config) as db:
+            sql="SELECT timestamp FROM DocsOneMonthArchive WHERE name=%s;"
+            rawdata = db.query(sql, (name,))
+            return [d['timestamp'].strftime("%Y-%m-%d %H:%M:%S") for d in rawdata]
 
 
 class IssueBuilder:
     def __init__(self):
-        self._config = yaml.load(open(CONFIG_FILE_PATH).read(),
-                                 Loader=yaml.FullLoader)['mysql']
+        self._config = load_mysql_config()
 
     def _workflow_running_period(self, workflow):
-        db = Database(*self._config)
-        sql = "SELECT MAX(timestamp) AS maxts, MIN(timestamp) AS mints FROM PredictionHistory WHERE name=%s"
-        result = db.query(sql, (workflow,))[0]
-        return result['maxts']-result['mints']
+        with Database(*self._config) as db:
+            sql = "SELECT timestamp AS maxts, firstseen AS mints FROM PredictionLatest WHERE name=%s"
+            result = db.query(sql, (workflow,))[0]
+            return result['maxts']-result['mints']
 
     def _workflow_prediction_probabilities(self, workflow):
         """workflow prediction result from last time
@@ -237,10 +241,10 @@ class IssueBuilder:
         :rtype: list
         """
 
-        db = Database(*self._config, dictcursor=False)
-        sql = "SELECT good, acdc, resubmit FROM PredictionHistory WHERE name=%s"
-        rawdata = db.query(sql, (workflow,))[-1]
-        return list(rawdata)
+        with Database(*self._config, dictcursor=False) as db:
+            sql = "SELECT good, acdc, resubmit FROM PredictionLatest WHERE name=%s"
+            rawdata = db.query(sql, (workflow,))[0]
+            return list(rawdata)
 
 
     def _workflow_prediction_fraction(self, workflow, pred=2, dayframe=1):
@@ -249,79 +253,69 @@ class IssueBuilder:
         :param int pred: prediction label: 0: good, 1: acdc, 2: resubmit
         :param int dayframe: number of days to look
         """
-        import numpy as np
         from datetime import timedelta
 
-        db = Database(*self._config, dictcursor=False)
-        sql = "SELECT good, acdc, resubmit FROM PredictionHistory WHERE name=%s"
-        dataarray = np.array(db.query(sql, (workflow,)))
-
-        sql = "SELECT timestamp FROM PredictionHistory WHERE name=%s"
-        tsarray = np.array(db.query(sql, (workflow,))).flatten()
-        intimeframe = (tsarray[-1]-timedelta(days=dayframe)) < tsarray
+        with Database(*self._config) as db:
+            sql = "SELECT timestamp FROM PredictionLatest WHERE name=%s"
+            lastts = db.query(sql, (workflow,))[0]['timestamp']
+            # only the timeframe is read, from the right tier(s)
+            rows = workflow_history(db, workflow, since=lastts-timedelta(days=dayframe))
+            return argmax_fraction(rows, pred)
 
-        inframe_preds = dataarray.argmax(axis=1)[intimeframe]
-        return (inframe_preds==pred).sum()/inframe_preds.size
-
-    def _get_workflow_report(self, workflow):
-        """return the most recent json document of ``workflow``
+    def _get_workflow_report(self, workflow, timestamp=None):
+        """return the most recent json document of ``workflow``, or the one
+        archived at ``timestamp``
 
         :param str workflow: workflow name
+        :param timestamp: archive time of the document
         """
-        db = Database(*self._config)
-        sql = "SELECT document FROM DocsOneMonthArchive WHERE name=%s"
-        rawdata = db.query(sql, (workflow,))[-1]['document']
-        return json.loads(rawdata)
-
-    def _get_last_reports(self):
-        """return the most recent json documents
-        """
-        db = Database(*self._config)
-        sql = "SELECT document FROM DocsOneMonthArchive WHERE timestamp=(SELECT MAX(timestamp) FROM DocsOneMonthArchive)"
-        rawdata = db.query(sql)
-        return [json.loads(x['document']) for x in rawdata]
-
+        with Database(*self._config) as db:
+            if timestamp is None:
+                sql = "SELECT document, format FROM DocsOneMonthArchive WHERE name=%s ORDER BY timestamp DESC LIMIT 1"
+                rawdata = db.query(sql, (workflow,))[0]
+            else:
+                sql = "SELECT document, format FROM DocsOneMonthArchive WHERE name=%s AND timestamp=%s LIMIT 1"
+                rawdata = db.query(sql, (workflow, timestamp))[0]
+            return decode_doc(rawdata['document'], rawdata['format'])
+
+    def get_sitecnt_percode(self, workflow):
+        """error site-count grouped by code, from the most recent error report of ``workflow``.
 
-    @staticmethod
-    def get_sitecnt_percode(report):
-        """ from an error report extract error site-count grouped by code.
-
-        :param dict report: report as dictionary
+        :param str workflow: workflow name
         :return: {code: {site: count}, ...}
         :rtype: dict
         """
+        with Database(*self._config) as db:
+            sql = """\
+                SELECT errorCode, site, SUM(counts) AS counts FROM CycleErrorCounts
+                WHERE name=%s AND errorCode<>%s
+                    AND timestamp=(SELECT MAX(timestamp) FROM DocsOneMonthArchive WHERE name=%s)
+                GROUP BY errorCode, site"""
+            rawdata = db.query(sql, (workflow, SITE_TOTAL, workflow))
+
         res = {}
-        for _task in report.get('tasks', []):
-            for _error in _task.get('errors', []):
-                if _error['errorCode'] in res:
-                    if _error['siteName'] in res[_error['errorCode']]:
-                        res[_error['errorCode']][_error['siteName']] += _error['counts']
-                    else:
-                        res[_error['errorCode']][_error['siteName']] = _error['counts']
-                else:
-                    res[_error['errorCode']] = {}
-                    res[_error['errorCode']][_error['siteName']] = _error['counts']
+        for d in rawdata:
+            res.setdefault(d['errorCode'], {})[d['site']] = int(d['counts'])
         return res
 
-    @staticmethod
-    def get_codecnt_persite(report):
-        """from an error reprot extract error code-count grouped by site.
+    def get_codecnt_perworkflow(self, site):
+        """error code-count at ``site`` grouped by workflow, from the most recent error reports.
 
-        :param dict report: report as dictionary
-        :return: {site: {code: count}, ...}
+        :param str site: site name
+        :return: {workflow: {code: count}, ...}
         :rtype: dict
         """
+        with Database(*self._config) as db:
+            sql = """\
+                SELECT name, errorCode, SUM(counts) AS counts FROM CycleErrorCounts
+                WHERE site=%s AND errorCode<>%s
+                    AND timestamp=(SELECT timestamp FROM PredictionCycle WHERE id=1)
+                GROUP BY name, errorCode"""
+            rawdata = db.query(sql, (site, SITE_TOTAL))
+
         res = {}
-        for _task in report.get('tasks', []):
-            for _error in _task.get('errors', []):
-                if _error['siteName'] in res:
-                    if _error['errorCode'] in res[_error['siteName']]:
-                        res[_error['siteName']][_error['errorCode']] += _error['counts']
-                    else:
-                        res[_error['siteName']][_error['errorCode']] = _error['counts']
-                else:
-                    res[_error['siteName']] = {}
-                    res[_error['siteName']][_error['errorCode']] = _error['counts']
+        for d in rawdata:
+            res.setdefault(d['name'], {})[d['errorCode']] = int(d['counts'])
         return res
 
 
@@ -333,10 +327,10 @@ class WorkflowIssueBuilder(IssueBuilder):
     def _running_workflow_names(self):
         """return running workflow names whose predicted probability of *resubmit* > 0.3 (default)"""
 
-        db = Database(*self._config)
-        sql = "SELECT name FROM PredictionHistory WHERE timestamp=(SELECT MAX(timestamp) FROM PredictionHistory) and resubmit>{}".format(self.settings['resubmitProb'])
-        result = db.query(sql)
-        return [d['name'] for d in result]
+        with Database(*self._config) as db:
+            sql = "SELECT name FROM PredictionLatest WHERE timestamp>=(SELECT timestamp FROM PredictionCycle WHERE id=1) and resubmit>{}".format(self.settings['resubmitProb'])
+            result = db.query(sql)
+            return [d['name'] for d in result]
 
     def is_workflow_flagged(self, workflow):
         """determine whether a ``workflow`` should be flagged as **workflowIssue**.
@@ -379,7 +373,7 @@ class WorkflowIssueBuilder(IssueBuilder):
         lastdoc = self._get_workflow_report(workflow)
         res['total_error'] = lastdoc.get('totalError', 0)
         res['failure_rate'] = lastdoc.get('failureRate', 0.)
-        res['errorcnt_percode'] = IssueBuilder.get_sitecnt_percode(lastdoc)
+        res['errorcnt_percode'] = self.get_sitecnt_percode(workflow)
 
         return res
 
@@ -414,57 +408,61 @@ class SiteIssueBuilder(IssueBuilder):
     def _running_workflow_names(self, minacdcprob=None):
         """return running workflow names whose predicted probability of *acdc* > 0.5 (default)"""
 
-        db = Database(*self._config)
-        if minacdcprob is None:
-            minacdcprob = self.settings['acdcProb']
-        sql = "SELECT name FROM PredictionHistory WHERE timestamp=(SELECT MAX(timestamp) FROM PredictionHistory) and acdc>{}".format(minacdcprob)
-        result = db.query(sql)
-        return [d['name'] for d in result]
+        with Database(*self._config) as db:
+            if minacdcprob is None:
+                minacdcprob = self.settings['acdcProb']
+            sql = "SELECT name FROM PredictionLatest WHERE timestamp>=(SELECT timestamp FROM PredictionCycle WHERE id=1) and acdc>{}".format(minacdcprob)
+            result = db.query(sql)
+            return [d['name'] for d in result]
 
-    def _get_workflow_reports(self, workflow):
-        db = Database(*self._config)
-        sql = "SELECT document FROM DocsOneMonthArchive WHERE name=%s"
-        rawdata = db.query(sql, (workflow,))
-        return [d['document'] for d in rawdata]
-
-    def _get_two_reports(self, workflow, timespan=4):
-        """return two reports to be compared.
-        The first one is closest to max(timestamp),
-        The second one is closest to max(timestamp)-4h (default).
+    def _get_two_timestamps(self, workflow, timespan=4):
+        """return archive timestamps of two reports to be compared.
+        The first one is the most recent one,
+        The second one is closest to the last complete cycle-4h (default).
 
         :param str workflow: workflow name
-        :param int timespan: hour diff wrt. max(timestamp)
+        :param int timespan: hour diff wrt. the last complete cycle
         """
         from datetime import timedelta
         import numpy as np
 
-        db = Database(*self._config, dictcursor=False)
-        sql = "SELECT MAX(timestamp) FROM DocsOneMonthArchive"
-        ts0 = db.query(sql)[0][0]
-        ts1 = ts0 - timedelta(hours=timespan)
-        sql = "SELECT timestamp FROM DocsOneMonthArchive WHERE name=%s ORDER BY timestamp DESC" # desc order..
-        timestamps = db.query(sql, (workflow,))
-        ts1diffarrays = [(x[0]-ts1).total_seconds() for x in timestamps]
-        idx = np.abs(np.array(ts1diffarrays)).argmin()
-
-        totalreports = self._get_workflow_reports(workflow)
-        return json.loads(totalreports[0]), json.loads(totalreports[idx])
+        with Database(*self._config, dictcursor=False) as db:
+            sql = "SELECT timestamp FROM PredictionCycle WHERE id=1"
+            ts0 = db.query(sql)[0][0]
+            ts1 = ts0 - timedelta(hours=timespan)
+            sql = "SELECT timestamp FROM DocsOneMonthArchive WHERE name=%s ORDER BY timestamp DESC" # desc order..
+            timestamps = db.query(sql, (workflow,))
+            ts1diffarrays = [(x[0]-ts1).total_seconds() for x in timestamps]
+            idx = np.abs(np.array(ts1diffarrays)).argmin()
 
-    @staticmethod
-    def siteerror_from_report(report):
-        cnt = defaultdict(int)
+        return timestamps[0][0], timestamps[idx][0]
 
-        for tsk in report.get('tasks', []):
-            for se in tsk.get('siteErrors', []):
-                cnt[se['site']] += se['counts']
+    def _siteerror_counts(self, workflow, timestamps):
+        """total errors per site of ``workflow``'s reports archived at ``timestamps``
 
-        return cnt
+        :param str workflow: workflow name
+        :param list timestamps: archive timestamps
+        :return: {timestamp: {site: count}, ...}
+        :rtype: dict
+        """
+        with Database(*self._config) as db:
+            sql = """\
+                SELECT timestamp, site, SUM(counts) AS counts FROM CycleErrorCounts
+                WHERE name=%s AND errorCode=%s AND timestamp IN %s
+                GROUP BY timestamp, site"""
+            rawdata = db.query(sql, (workflow, SITE_TOTAL, tuple(timestamps)))
+
+        res = {ts: defaultdict(int) for ts in timestamps}
+        for d in rawdata:
+            res[d['timestamp']][d['site']] = int(d['counts'])
+        return res
 
     @staticmethod
-    def siteerror_increase(report_past, report_present):
+    def siteerror_increase(cnt_past, cnt_present):
+        """:param dict cnt_past: {site: count} of the past report
+        :param dict cnt_present: {site: count} of the present report
+        """
         res = {}
-        cnt_past = SiteIssueBuilder.siteerror_from_report(report_past)
-        cnt_present = SiteIssueBuilder.siteerror_from_report(report_present)
 
         for site in cnt_present:
             res[site] = cnt_present[site] - cnt_past.get(site, 0)
@@ -477,8 +475,9 @@ class SiteIssueBuilder(IssueBuilder):
     def _siteerror_increase_per_workflow(self, workflow):
         if self._workflow_running_period(workflow).seconds < 60*60*self.settings['runningHours']:
             return {}
-        report_present, report_past = self._get_two_reports(workflow, timespan=self.settings['runningHours'])
-        return SiteIssueBuilder.siteerror_increase(report_past, report_present)
+        ts_present, ts_past = self._get_two_timestamps(workflow, timespan=self.settings['runningHours'])
+        counts = self._siteerror_counts(workflow, (ts_present, ts_past))
+        return SiteIssueBuilder.siteerror_increase(counts[ts_past], counts[ts_present])
 
     def dress_siteissue(self, site):
         """dress site issue with associated information
@@ -490,12 +489,7 @@ class SiteIssueBuilder(IssueBuilder):
 
         res = {'site': site,}
 
-        running_workflow_reports = self._get_last_reports()
-        running_workflow_error_onsite = {}
-        for report in running_workflow_reports:
-            errcodecnt_onsite = IssueBuilder.get_codecnt_persite(report).get(site, {})
-            if errcodecnt_onsite:
-                running_workflow_error_onsite[report['name']] = errcodecnt_onsite
+        running_workflow_error_onsite = self.get_codecnt_perworkflow(site)
         res['errorcnt_perworkflow'] = running_workflow_error_onsite
 
         total_errorcodes = []
@@ -556,5 +550,5 @@ if __name__ =="__main__":
     # site = 'T2_US_Caltech'
     # pprint(sib.dress_siteissue(site))
     # wf='pdmvserv_task_B2G-RunIIFall17wmLHEGS-01648__v1_T_190709_120529_981'
-    # print(sib._get_two_reports(wf))
+    # print(sib._get_two_timestamps(wf))
     # print(sib.flagged_sites())
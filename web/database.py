@@ -1,35 +1,33 @@
 #!/usr/bin/env python
-"""wrapper of pymysql for common operations"""
+"""wrapper of pymysql for common operations, on connections of the shared pool"""
 
 import pymysql
 
+from dbpool import get_pool
+
 
 class Database:
+    """checks out a pooled connection for its lifetime, use as context manager
+    so that the connection is returned as soon as the block exits.
+    """
+
     def __init__(self, user, password, dbname, dictcursor=True):
+        self._checkout = get_pool(user, password, dbname).connection()
+        self._conn = self._checkout.__enter__()
         if dictcursor:
-            self._conn = pymysql.connect(
-                host='localhost',
-                user=user,
-                password=password,
-                db=dbname,
-                cursorclass=pymysql.cursors.DictCursor
-            )
+            self._cursor = self._conn.cursor(pymysql.cursors.DictCursor)
         else:
-            self._conn = pymysql.connect(
-                host='localhost',
-                user=user,
-                password=password,
-                db=dbname,
-                cursorclass=pymysql.cursors.Cursor
-            )
-        self._cursor = self._conn.cursor()
+            self._cursor = self._conn.cursor(pymysql.cursors.Cursor)
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.commit()
-        self.connection.close()
+        self.close(exc_type, exc_val, exc_tb)
+
+    def __del__(self):
+        # never leak a pooled connection, even if not closed explicitly
+        self.close()
 
     @property
     def connection(self):
@@ -39,6 +37,15 @@ class Database:
     def cursor(self):
         return self._cursor
 
+    def close(self, exc_type=None, exc_val=None, exc_tb=None):
+        """commit (or roll back on error) and give the connection back to the pool"""
+        checkout = getattr(self, '_checkout', None)
+        if checkout is None:
+            return
+        self._checkout = None
+        self._cursor.close()
+        checkout.__exit__(exc_type, exc_val, exc_tb)
+
     def commit(self):
         self.connection.commit()
 
@@ -53,4 +60,4 @@ class Database:
 
     def query(self, sql, params=None):
         self.cursor.execute(sql, params or ())
-        return self.fetchall()
\ No newline at end of file
+        return self.fetchall()
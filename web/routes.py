@@ -166,6 +166,16 @@ predhistory = Blueprint('predhistory', __name__, url_prefix='/predhistory')
 def workflow_history(wfname):
     return jsonify(TableBuilder().get_workflow_history(wfname))
 
+@predhistory.route('contribs/<wfname>', methods=['GET'])
+@cache.cached(query_string=True)
+def workflow_contributions(wfname):
+    timestamp = request.args.get('timestamp', default='', type=str)
+    contribs = TableBuilder().get_workflow_contributions(wfname, timestamp=timestamp)
+    response = jsonify(contribs)
+    if contribs is None:
+        response.status_code = 404
+    return response
+
 ###############################################################################
 
 docs = Blueprint('docs', __name__, url_prefix='/docs')
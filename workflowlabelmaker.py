@@ -26,8 +26,8 @@ from os.path import abspath, dirname, join
 import yaml
 from cmstoolbox.webtools import get_json
 from workflowwrapper import Workflow, PrepID
-from monitutils import (get_labeled_workflows, get_yamlconfig,
-                        update_label_archive_db)
+from monitutils import get_yamlconfig
+from storage import get_storage
 
 LOGGING_CONFIG = join(dirname(abspath(__file__)), 'config/configLogging.yml')
 CONFIG_FILE_PATH = join(dirname(abspath(__file__)), 'config/config.yml')
@@ -125,22 +125,23 @@ def label_workflows(wfnames):
     return wflabelmap
 
 
-def updateLabelArchives(wfnames, configpath=CONFIG_FILE_PATH):
+def updateLabelArchives(wfnames, configpath=CONFIG_FILE_PATH, sink=None):
     """Given a list of workflownames, make labels for those that has not been
     labelled before, and update db
 
     :param list wfnames: list of workflow names
     :param str configpath: path of config yml contains db connection info
+    :param storage.CycleSink sink: stage labels in the cycle's sink instead of writing them
     """
 
-    config = get_yamlconfig(configpath)
+    storage = get_storage(get_yamlconfig(configpath))
 
-    labeled_ = get_labeled_workflows(config)
+    labeled_ = storage.labeled_workflows()
     workflowstoquery = [w for w in wfnames if w not in labeled_]
     logger.info("Making labels for {} workflows...".format(len(workflowstoquery)))
 
     values = list(label_workflows(workflowstoquery).items())
-    update_label_archive_db(config, values)
+    (sink or storage).add_labels(values)
 
 
 def test():
@@ -1,9 +1,7 @@
 #!/usr/bin/env python
 
-import os
 import sys
 import time
-import sqlite3
 import logging
 import random
 import concurrent.futures
@@ -11,8 +9,10 @@ import logging.config
 from os.path import join, dirname, abspath
 
 import yaml
+import workflowwrapper
 from CMSMonitoring.StompAMQ import StompAMQ
 from monitutils import get_yamlconfig, get_workflow_from_db
+from storage import get_storage
 from workflowcollector import populate_error_for_workflow
 
 
@@ -33,24 +33,18 @@ rootlogger.addFilter(No502WarningFilter())
 # -----------------------------------------------------------------------------
 
 def do_work(item):
-    """Query, build and return the error doc.
+    """Query, build and return the error doc, and the workflow status.
+    Nothing is written here, the caller stages the status with the batch.
 
     :param tuple item: (``Workflow``, minFailureRate, configPath)
-    :returns: error doc
-    :rtype: dict
+    :returns: (error doc, (name, status, failure rate) or ``None``)
+    :rtype: tuple
     """
 
     wf, minFailureRate, configPath = item
 
-    # database path and insertion command
-    dbPath = get_yamlconfig(configPath).get(
-        'workflow_status_db',
-        os.path.join(
-            os.path.dirname(os.path.abspath(__file__)),
-            'workflow_status.sqlite'))
-    DB_UPDATE_CMD = """INSERT OR REPLACE INTO workflowStatuses VALUES (?,?,?)"""
-
     res = {}
+    status = None
 
     try:
         time.sleep(random.random()*0.1)
@@ -58,10 +52,7 @@ def do_work(item):
         toUpdate = (wf.name, wf.get_reqdetail().get(wf.name, {}).get(
             'RequestStatus', ''), failurerate)
         if any(toUpdate[:-1]):
-            conn = sqlite3.connect(dbPath)
-            with conn:
-                c = conn.cursor()
-                c.execute(DB_UPDATE_CMD, toUpdate)
+            status = toUpdate
 
         if failurerate > minFailureRate:
             res = populate_error_for_workflow(wf)
@@ -70,7 +61,7 @@ def do_work(item):
             wf.name, str(e)))
         pass
 
-    return res
+    return res, status
 
 
 # -----------------------------------------------------------------------------
@@ -89,50 +80,24 @@ def getCompletedWorkflowsFromDb(configPath):
     config = get_yamlconfig(configPath)
     if not config:
         sys.exit('Config file: {} not exist, exiting..'.format(configPath))
-    dbPath = config.get(
-        'workflow_status_db',
-        os.path.join(
-            os.path.dirname(os.path.abspath(__file__)),
-            'workflow_status.sqlite'))
-
-    DB_CREATE_CMD = """CREATE TABLE IF NOT EXISTS workflowStatuses (
-        name TEXT PRIMARY KEY,
-        status TEXT,
-        failurerate REAL
-    );"""
-    DB_QUERY_CMD = """SELECT * FROM workflowStatuses WHERE status LIKE '%archived'"""
-
-    res = []
-    conn = sqlite3.connect(dbPath)
-    with conn:
-        c = conn.cursor()
-        c.execute(DB_CREATE_CMD)
-        for row in c.execute(DB_QUERY_CMD):
-            res.append(row[0])
 
-    return res
+    return get_storage(config).completed_workflows()
 
 # -----------------------------------------------------------------------------
 
-def updateWorkflowStatusToDb(configPath, wcErrorInfos):
+def updateWorkflowStatusToDb(configPath, wcErrorInfos, storage=None):
     """
     update workflow status to local status db, with the information from ``wcErrorInfos``.
 
     :param str configPath: location of config file
     :param list wcErrorInfos: list of dicts returned by :py:func:`buildDoc`
+    :param storage: :py:class:`storage.Storage` (or `storage.CycleSink`) written to, default from config
     :returns: True
     """
 
     config = get_yamlconfig(configPath)
     if not config:
         sys.exit('Config path: {} not exist, exiting..'.format(configPath))
-    dbPath = config.get(
-        'workflow_status_db',
-        os.path.join(
-            os.path.dirname(os.path.abspath(__file__)),
-            'workflow_status.sqlite'))
-
-    DB_UPDATE_CMD = """INSERT OR REPLACE INTO workflowStatuses VALUES (?,?,?)"""
 
     toUpdate = []
     for e in wcErrorInfos:
@@ -142,10 +107,7 @@ def updateWorkflowStatusToDb(configPath, wcErrorInfos):
             continue
         toUpdate.append(entry)
 
-    conn = sqlite3.connect(dbPath)
-    with conn:
-        c = conn.cursor()
-        c.executemany(DB_UPDATE_CMD, toUpdate)
+    (storage or get_storage(config)).update_statuses(toUpdate)
 
     return True
 
@@ -193,18 +155,21 @@ def prepareWorkflows(configpath, minfailurerate=0., test=False, batchsize=15):
 
 # -----------------------------------------------------------------------------
 
-def buildDoc(source, doconcurrent=True, timeout=300):
+def buildDoc(source, doconcurrent=True, timeout=300, withstatuses=False):
     """
     Given a list of workflow packs, returns a list of documents (each for one workflow)
 
     :param list source: a list of workflow packs (tuple)
     :param bool doconcurrent: default True. If True, concurrently execute jobs
     :param float timeout: default 300. timeout limit/seconds for each job when launching jobs parallelly
-    :returns: list of documents
-    :rtype: list
+    :param bool withstatuses: also return the statuses of all workflows of ``source``,
+     those without a document included
+    :returns: list of documents, or (list of documents, list of (name, status, failure rate))
+    :rtype: list or tuple
     """
 
     results = list()
+    statuses = list()
 
     startTime = time.time()
 
@@ -212,25 +177,37 @@ def buildDoc(source, doconcurrent=True, timeout=300):
         with concurrent.futures.ThreadPoolExecutor(
                 max_workers=len(source)) as executor:
             futures = {executor.submit(do_work, item): item for item in source}
-            for future in concurrent.futures.as_completed(futures, timeout=timeout):
-                wfname = futures[future][0].name
-                try:
-                    res = future.result()
-                    if res: results.append(res)
-                except Exception as e:
-                    print("*** Exception occured in buildDoc ***")
-                    print("Workflow:", wfname)
-                    print("Msg:", str(e))
+            try:
+                for future in concurrent.futures.as_completed(futures, timeout=timeout):
+                    wfname = futures[future][0].name
+                    try:
+                        res, status = future.result()
+                        if res: results.append(res)
+                        if status: statuses.append(status)
+                    except Exception as e:
+                        print("*** Exception occured in buildDoc ***")
+                        print("Workflow:", wfname)
+                        print("Msg:", str(e))
+            except concurrent.futures.TimeoutError:
+                if workflowwrapper.TRACER is not None:
+                    for endpoint, wfname, elapsed in workflowwrapper.TRACER.inflight():
+                        logger.warning("cmsweb call still pending at buildDoc timeout: "
+                                       "{0} <{1}> {2}s".format(endpoint, wfname, elapsed))
+                raise
     else:
         for item in source:
             _starttime = time.time()
-            results.append(do_work(item))
+            res, status = do_work(item)
+            results.append(res)
+            if status: statuses.append(status)
             logger.info("--> took {0}s".format(time.time()-_starttime))
 
     elapsedTime = time.time() - startTime
     msg = '---> took {}s'.format(elapsedTime)
     logger.info(msg)
 
+    if withstatuses:
+        return results, statuses
     return results
 
 # -----------------------------------------------------------------------------
@@ -290,8 +267,8 @@ def test():
 
     # test only the first batch
     firstbatch = wfpacks[0]
-    docs = buildDoc(firstbatch, doconcurrent=True)
-    updateWorkflowStatusToDb(CONFIG_FILE_PATH, docs)
+    docs, statuses = buildDoc(firstbatch, doconcurrent=True, withstatuses=True)
+    get_storage(get_yamlconfig(CONFIG_FILE_PATH)).update_statuses(statuses)
     logger.info('Number of updated workflows: {}'.format(len(docs)))
 
 
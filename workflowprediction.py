@@ -6,16 +6,30 @@
 import os
 import json
 import time
+import hashlib
+import logging
+import sqlite3
 import statistics
+import multiprocessing
+import concurrent.futures
 from collections import OrderedDict
+from multiprocessing import shared_memory
 from os.path import join, dirname, abspath
 
 import numpy as np
-import pandas as pd
 import xgboost as xgb
-from monitutils import get_yamlconfig, fmttime, update_prediction_history_db
+from contribcodec import encode_contributions
+from featurenames import FEATURE_NAMES
+from featurestore import FEATURE_STORE_PATH, FeatureStore
+from keywordencoding import encode_errorKeyword, encode_keyword, get_encoding_table
+from modelregistry import REGISTRY, get_model
+from monitutils import get_yamlconfig, get_workflow_status_db, fmttime, repo_path
+from storage import PREDICTION_CACHE_PRUNE, PREDICTION_CACHE_SCHEMA, PREDICTION_CACHE_UPDATE, get_storage
 
 CONFIG_FILE_PATH = join(dirname(abspath(__file__)), 'config/config.yml')
+MODEL_FILE_PATH = join(dirname(abspath(__file__)), 'models/xgb_optimized.model')
+
+logger = logging.getLogger("workflowmonitLogger")
 
 
 # ------------------------------------------------------------------------------
@@ -287,26 +301,7 @@ def get_errorKeywords_multiplicity(doc):
 
 
 def get_errorKeywords_leading_encoded(doc):
-    """
-    error keywords are strings, to pipe into ML training and inference,
-    they need to be transformed as numbers.
-    LabelEncoder works for training, but not able to group similar
-    errorkeywords together. And does not work during inference. For now
-    a rule-based approach is taken. Describled below:
-    ---
-    These errorkeywords are extracted from logs if they contain some
-    *buzzword*, like error(s), failure(s), failed. So we first get rid
-    of those, and also sep char like -_, and group by other keywords:
-
-        step, submit, report, job, log, rss, assert, performance,
-        fileopen, hlt, reco, script, event
-
-    , each stratified by 1000, added by the length of the rest chars.
-    If an errorkeyword does not have any above keyword, then it's just
-     encoded as the length of the rest chars, should fall into range
-    [0, 1000). Here we assume the length of an errorkeyword should be
-    no more than 1000.
-    """
+    """leading error keyword, encoded with :py:func:`encode_errorKeyword`"""
 
     tasks = doc["tasks"]
     errors = [tsk.get("errors", []) for tsk in tasks]
@@ -324,33 +319,7 @@ def get_errorKeywords_leading_encoded(doc):
         )
         kwrd_leading = errorKeywordsSorted[0][0]
 
-    # encoding
-    ekwrd = (
-        kwrd_leading.lower()
-        .replace("-", "")
-        .replace("_", "")
-        .replace("errors", "")
-        .replace("error", "")
-        .replace("failures", "")
-        .replace("failure", "")
-        .replace("failed", "")
-        .replace("fail", "")
-    )
-    signaturekwrd = [
-        "step", "submit", "report", "job",
-        "log", "rss", "assert", "performance",
-        "fileopen", "hlt", "reco", "script", "event",
-    ]
-
-    totalweight = 0
-    for w, sk in enumerate(signaturekwrd, 1):
-        if sk in ekwrd:
-            totalweight += 1000 * w
-            ekwrd = ekwrd.replace(sk, "")
-    if ekwrd:
-        totalweight += len(ekwrd)
-
-    return totalweight
+    return encode_errorKeyword(kwrd_leading)
 
 
 # ------------------------------------------------------------------------------
@@ -377,59 +346,266 @@ def get_errorKeywords_leadingRatio(doc):
 # ------------------------------------------------------------------------------
 
 
+def _leading(countsUnique):
+    """key with most counts and its share of total counts.
+    Ties go to the first key seen, same as a stable descending sort.
+
+    :param dict countsUnique: {key: counts}
+    :return: (key, ratio), ``(None, None)`` if empty
+    :rtype: tuple
+    """
+    if not countsUnique:
+        return None, None
+    key, cnt = max(countsUnique.items(), key=lambda kv: kv[1])
+    return key, cnt / sum(countsUnique.values())
+
+
+def _feature_values(doc, now):
+    """Single-pass equivalent of all ``get_*`` feature functions: walks
+    ``doc["tasks"]`` once, accumulating site errors, primary/secondary error
+    codes and error keywords together.
+
+    :param dict doc: workflow document
+    :param int now: reference unix time for ``time_sinceOpenInHour``
+    :return: feature values, ordered as :py:data:`FEATURE_NAMES`
+    :rtype: tuple
+    """
+
+    siteErrorsUnique = dict()
+    primaryCodesUnique = dict()
+    secondaryCodeUnique = dict()
+    errorKeywordsUnique = dict()
+
+    for tsk in doc["tasks"]:
+        for se in tsk.get("siteErrors", []):
+            siteErrorsUnique[se["site"]] = siteErrorsUnique.get(se["site"], 0) + se["counts"]
+        for err in tsk.get("errors", []):
+            counts = err["counts"]
+            primaryCodesUnique[err["errorCode"]] = primaryCodesUnique.get(err["errorCode"], 0) + counts
+            if err["secondaryErrorCodes"]:
+                for serr in err["secondaryErrorCodes"]:
+                    secondaryCodeUnique[serr] = secondaryCodeUnique.get(serr, 0) + counts
+            if err["errorKeywords"]:
+                for kw in err["errorKeywords"]:
+                    errorKeywordsUnique[kw] = errorKeywordsUnique.get(kw, 0) + counts
+
+    errorPerSite = list(siteErrorsUnique.values())
+    prim_leadingCode, prim_leadingRatio = _leading(primaryCodesUnique)
+    secd_leadingCode, secd_leadingRatio = _leading(secondaryCodeUnique)
+    kwrd_leading, kwrd_leadingRatio = _leading(errorKeywordsUnique)
+
+    runningOpenTime = None
+    for cell in doc["transitions"]:
+        if cell.get("Status", None) == "running-open":
+            runningOpenTime = cell.get("UpdateTime", None)
+            break
+
+    return (
+        doc["failureRate"],                                                     # failureRate
+        doc["totalError"],                                                      # totalError
+        len(siteErrorsUnique),                                                  # sites_siteCounts
+        get_type_encoded(doc),                                                  # type
+        max(errorPerSite) if errorPerSite else -1,                              # sites_errorPerSite_max
+        min(errorPerSite) if errorPerSite else -1,                              # sites_errorPerSite_min
+        statistics.median(errorPerSite) if errorPerSite else -1.0,              # sites_errorPerSite_median
+        statistics.mean(errorPerSite) if errorPerSite else -1.0,                # sites_errorPerSite_mean
+        statistics.stdev(errorPerSite) if len(errorPerSite) > 1 else -1.0,      # sites_errorPerSite_stdDev
+        len(primaryCodesUnique),                                                # errorCode_primary_multiplicity
+        int(prim_leadingCode) if primaryCodesUnique else -1,                    # errorCode_primary_leadingCode
+        prim_leadingRatio if primaryCodesUnique else -1.0,                      # errorCode_primary_leadingRatio
+        len(secondaryCodeUnique),                                               # errorCode_secondary_multiplicity
+        int(secd_leadingCode) if secondaryCodeUnique else -1,                   # errorCode_secondary_leadingCode
+        secd_leadingRatio if secondaryCodeUnique else -1.0,                     # errorCode_secondary_leadingRatio
+        len(errorKeywordsUnique),                                               # errorKeywords_multiplicity
+        encode_keyword(kwrd_leading or ""),                                     # errorKeywords_leading
+        kwrd_leadingRatio if errorKeywordsUnique else -1.0,                     # errorKeywords_leadingRatio
+        (now - runningOpenTime) / 60.0 / 60.0 if runningOpenTime else np.nan,   # time_sinceOpenInHour
+    )
+
+
+def extract_features(doc, now=None):
+    """extract features of one doc, see :py:func:`_feature_values`
+
+    :param dict doc: workflow document
+    :param int now: reference unix time for ``time_sinceOpenInHour``, default current time
+    :return: features keyed by name, ordered as :py:data:`FEATURE_NAMES`
+    :rtype: collections.OrderedDict
+    """
+    if now is None:
+        now = int(time.time())
+    return OrderedDict(zip(FEATURE_NAMES, _feature_values(doc, now)))
+
+
+def extract_feature_matrix(docs, now=None):
+    """extract features of a batch of docs straight into a preallocated
+    float32 matrix, rows follow ``docs``, columns follow :py:data:`FEATURE_NAMES`.
+
+    :param list docs: workflow documents
+    :param now: reference unix time for ``time_sinceOpenInHour``, either one for
+        all docs or a list with one per doc, default current time
+    :return: (workflow names, feature matrix)
+    :rtype: tuple
+    """
+    if now is None:
+        now = int(time.time())
+    if np.isscalar(now):
+        now = [now] * len(docs)
+
+    names = [doc["name"] for doc in docs]
+
+    X = np.empty((len(docs), len(FEATURE_NAMES)), dtype=np.float32)
+    for i, (doc, _now) in enumerate(zip(docs, now)):
+        X[i] = _feature_values(doc, _now)
+
+    return names, X
+
+
+# below this many docs, extraction stays in the calling process: docs are
+# pickled to the workers, which pays off only for large inputs
+PARALLEL_EXTRACTION_THRESHOLD = 5000
+
+
+def _extract_chunk(shmname, shape, start, docs, now):
+    """extraction worker: fill rows [start, start+len(docs)) of the shared
+    feature block
+
+    :return: keyword encoding table of the worker, to merge back into the parent's
+    :rtype: dict
+    """
+    shm = shared_memory.SharedMemory(name=shmname)
+    try:
+        X = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+        for i, (doc, _now) in enumerate(zip(docs, now)):
+            X[start + i] = _feature_values(doc, _now)
+        del X  # release the buffer before closing
+    finally:
+        shm.close()
+
+    return get_encoding_table().to_dict()
+
+
+class ParallelExtractor:
+    """:py:func:`extract_feature_matrix` spread over a pool of processes for
+    large inputs, e.g. the chunks of an offline training set build. Workers
+    write their rows straight into one shared-memory block, no feature rows
+    are pickled back, and keywords first seen by a worker are merged back into
+    this process's encoding table.
+
+    Workers are started with ``spawn`` (or ``forkserver``), never forked from
+    a process that may hold threads, locks or connections, and are kept for
+    the lifetime of the extractor.
+
+    :param int nproc: number of worker processes, default cpu count
+    :param int threshold: number of docs from which extraction goes parallel
+    :param str method: multiprocessing start method, ``spawn`` or ``forkserver``
+    """
+
+    def __init__(self, nproc=None, threshold=PARALLEL_EXTRACTION_THRESHOLD, method="spawn"):
+        if method not in ("spawn", "forkserver"):
+            raise ValueError("Unsupported start method for extraction workers: {}".format(method))
+        self._nproc = nproc or os.cpu_count() or 1
+        self._threshold = threshold
+        self._context = multiprocessing.get_context(method)
+        self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def extract(self, docs, now=None):
+        """same as :py:func:`extract_feature_matrix`, in parallel from ``threshold`` docs on
+
+        :param list docs: workflow documents
+        :param now: reference unix time, one for all docs or one per doc, default current time
+        :return: (workflow names, feature matrix)
+        :rtype: tuple
+        """
+        if self._nproc < 2 or len(docs) < self._threshold:
+            return extract_feature_matrix(docs, now=now)
+
+        if now is None:
+            now = int(time.time())
+        if np.isscalar(now):
+            now = [now] * len(docs)
+        if self._executor is None:
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self._nproc, mp_context=self._context)
+
+        names = [doc["name"] for doc in docs]
+        shape = (len(docs), len(FEATURE_NAMES))
+        shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * 4)
+        bounds = np.linspace(0, len(docs), self._nproc + 1).astype(int)
+        try:
+            futures = [
+                self._executor.submit(_extract_chunk, shm.name, shape, lo, docs[lo:hi], now[lo:hi])
+                for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo
+            ]
+            table = get_encoding_table()
+            for future in futures:
+                table.update(future.result())
+            X = np.ndarray(shape, dtype=np.float32, buffer=shm.buf).copy()
+        finally:
+            shm.close()
+            shm.unlink()
+
+        return names, X
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
+# ------------------------------------------------------------------------------
+
+
 def extract_doc(sdoc):
-    wname = sdoc["name"]
-    featureExtracted = OrderedDict()
-
-    featureExtracted["failureRate"] = get_failureRate(sdoc)
-    featureExtracted["totalError"] = get_totalError(sdoc)
-    featureExtracted["sites_siteCounts"] = get_sites_siteCounts(sdoc)
-    featureExtracted["type"] = get_type_encoded(sdoc)
-    featureExtracted["sites_errorPerSite_max"] = get_sites_errorPerSite_max(sdoc)
-    featureExtracted["sites_errorPerSite_min"] = get_sites_errorPerSite_min(sdoc)
-    featureExtracted["sites_errorPerSite_median"] = get_sites_errorPerSite_median(sdoc)
-    featureExtracted["sites_errorPerSite_mean"] = get_sites_errorPerSite_mean(sdoc)
-    featureExtracted["sites_errorPerSite_stdDev"] = get_sites_errorPerSite_stdDev(sdoc)
-    featureExtracted["errorCode_primary_multiplicity"] = get_errorCode_primary_multiplicity(sdoc)
-    featureExtracted["errorCode_primary_leadingCode"] = get_errorCode_primary_leadingCode(sdoc)
-    featureExtracted["errorCode_primary_leadingRatio"] = get_errorCode_primary_leadingRatio(sdoc)
-    featureExtracted["errorCode_secondary_multiplicity"] = get_errorCode_secondary_multiplicity(sdoc)
-    featureExtracted["errorCode_secondary_leadingCode"] = get_errorCode_secondary_leadingCode(sdoc)
-    featureExtracted["errorCode_secondary_leadingRatio"] = get_errorCode_secondary_leadingRatio(sdoc)
-    featureExtracted["errorKeywords_multiplicity"] = get_errorKeywords_multiplicity(sdoc)
-    featureExtracted["errorKeywords_leading"] = get_errorKeywords_leading_encoded(sdoc)
-    featureExtracted["errorKeywords_leadingRatio"] = get_errorKeywords_leadingRatio(sdoc)
-    featureExtracted["time_sinceOpenInHour"] = get_time_sinceOpenInHour(sdoc)
-
-    return wname, featureExtracted
+    return sdoc["name"], extract_features(sdoc)
 
 
 # ------------------------------------------------------------------------------
 
 
-def predict_docs(docs, model):
+_INPLACE_UNSUPPORTED = set()  # digests of models for which inplace prediction failed
 
-    if not docs:
+
+def predict_matrix(names, X, model, nthread=None, inplace=True):
+    """predict an extracted feature matrix with model
+
+    Arguments:
+        names {list} -- workflow names, one per row of X
+        X {numpy.ndarray} -- feature matrix, columns as FEATURE_NAMES
+        model {str} -- path of model file, served warm by :py:mod:`modelregistry`
+        nthread {int} -- number of threads used for prediction
+        inplace {bool} -- predict in place on X without building a DMatrix,
+            falls back to the DMatrix path if the booster does not support it
+
+    Returns:
+        dict -- {wfname: [good_prob, acdc_prob, resubmit_prob]}
+    """
+
+    if not names:
         return {}
-    features = []
-    for doc in docs:
-        wname, featureExtracted = extract_doc(doc)
-        featureExtracted["name"] = wname
-        features.append(featureExtracted)
-    df = pd.DataFrame(features)
-    feature_cols = [c for c in df.columns if c != "name"]
-    X = df[feature_cols]
-    Xxg = xgb.DMatrix(X)
 
-    bst = xgb.Booster({"nthread": 4})
-    bst.load_model(model)
+    bst = get_model(model, nthread=nthread)
+    # keyed by content, so that a model hot-reloaded at the same path gets another try
+    digest = REGISTRY.digest(model)
 
-    if bst.attributes().get('SAVED_PARAM_predictor', None)=='gpu_predictor':
-        bst.set_attr(SAVED_PARAM_predictor=None)
+    predprob = None
+    if inplace and digest not in _INPLACE_UNSUPPORTED:
+        try:
+            predprob = bst.inplace_predict(np.ascontiguousarray(X, dtype=np.float32))
+        except Exception as e:
+            logger.warning("Inplace prediction failed for {}, using DMatrix for this model. Msg: {}".format(model, str(e)))
+            _INPLACE_UNSUPPORTED.add(digest)
+    if predprob is None:
+        predprob = bst.predict(xgb.DMatrix(X, feature_names=FEATURE_NAMES))
 
-    predprob = bst.predict(Xxg).reshape(X.shape[0], 3)
+    predprob = predprob.reshape(X.shape[0], 3)
 
-    res = dict(zip(df["name"].values, predprob.tolist()))
+    res = dict(zip(names, predprob.tolist()))
     # print(json.dumps(res, indent=4))
     return res
 
@@ -437,35 +613,351 @@ def predict_docs(docs, model):
 # ------------------------------------------------------------------------------
 
 
-def update_prediction_db(preds, configpath=CONFIG_FILE_PATH):
+def predict_contributions(names, X, model, nthread=None):
+    """per-feature contributions (SHAP values, in margin space) of a whole batch
+
+    Arguments:
+        names {list} -- workflow names, one per row of X
+        X {numpy.ndarray} -- feature matrix, columns as FEATURE_NAMES
+        model {str} -- path of model file
+        nthread {int} -- number of threads used for prediction
+
+    Returns:
+        dict -- {wfname: numpy.ndarray of shape (3, len(FEATURE_NAMES)+1)},
+            per class (good, acdc, resubmit), last column is the bias
+    """
+
+    if not names:
+        return {}
+
+    bst = get_model(model, nthread=nthread)
+    contribs = bst.predict(xgb.DMatrix(X, feature_names=FEATURE_NAMES), pred_contribs=True)
+    contribs = contribs.reshape(X.shape[0], 3, len(FEATURE_NAMES) + 1)
+
+    return dict(zip(names, contribs))
+
+
+# ------------------------------------------------------------------------------
+
+
+def predict_docs(docs, model, nthread=None, inplace=True):
+    """predict docs with model
+
+    Arguments:
+        docs {list} -- workflow documents
+        model {str} -- path of model file, served warm by :py:mod:`modelregistry`
+        nthread {int} -- number of threads used for prediction
+        inplace {bool} -- use inplace prediction, see :py:func:`predict_matrix`
+
+    Returns:
+        dict -- {wfname: [good_prob, acdc_prob, resubmit_prob]}
+    """
+
+    if not docs:
+        return {}
+    names, X = extract_feature_matrix(docs)
+    return predict_matrix(names, X, model, nthread=nthread, inplace=inplace)
+
+
+# ------------------------------------------------------------------------------
+
+
+def store_features(names, X, timestamp, configpath=CONFIG_FILE_PATH):
+    """persist the feature matrix of a cycle into the feature store,
+    unless disabled in config (``feature_store: {enabled: false}``).
+    Best effort: failures (e.g. disk full) are logged, never raised, so that
+    predictions and archiving go on.
+
+    Arguments:
+        names {list} -- workflow names, one per row of X
+        X {numpy.ndarray} -- feature matrix, columns as FEATURE_NAMES
+        timestamp {float} -- unix time of the cycle
+        configpath {str} -- path of configs
+    """
+
+    storeconfig = get_yamlconfig(configpath).get("feature_store", {})
+    if not names or not storeconfig.get("enabled", True):
+        return
+    try:
+        store = FeatureStore(repo_path(storeconfig.get("path", FEATURE_STORE_PATH)), columns=FEATURE_NAMES)
+        store.append(names, X, timestamp=timestamp)
+    except Exception as e:
+        logger.exception("Failed to persist features of {} workflows. Msg: {}".format(len(names), str(e)))
+
+
+def store_cycle_features(batches, timestamp, configpath=CONFIG_FILE_PATH):
+    """persist the feature matrices of all batches of a cycle as a single chunk,
+    see :py:func:`store_features`
+
+    Arguments:
+        batches {list} -- (names, X) of each batch, as returned by :py:func:`makingPredictionsWithML`
+        timestamp {float} -- unix time of the cycle
+        configpath {str} -- path of configs
+    """
+
+    batches = [(names, X) for names, X in batches if names]
+    if not batches:
+        return
+    names = [name for _names, _ in batches for name in _names]
+    store_features(names, np.concatenate([X for _, X in batches]), timestamp, configpath=configpath)
+
+
+# ------------------------------------------------------------------------------
+
+
+def update_prediction_db(preds, configpath=CONFIG_FILE_PATH, timestamp=None, storage=None, history=True):
     """update prediction results
 
     Arguments:
         preds {dict} -- dictionary -> {wfname: [good_prob, acdc_prob, resubmit_prob]}
-        configpath {str} -- path of configs contains db connection info
+        configpath {str} -- path of configs contains storage config (see storage.py)
+        timestamp {float} -- unix time stamped on the rows, default now. Batches
+            of the same cycle share the cycle's timestamp.
+        storage {storage.Storage} -- written to (or a `storage.CycleSink`), default from config
+        history {bool} -- append to PredictionHistory; False for predictions carried
+            forward, which only refresh the latest-prediction snapshot
     """
 
     if not preds: return
     config = get_yamlconfig(configpath)
 
-    timestamp = fmttime(time.time())
+    timestamp = fmttime(timestamp if timestamp is not None else time.time())
     values = [
         (wf, round(predval[0], 6), round(predval[1], 6), round(predval[2], 6), timestamp)
         for wf, predval in preds.items()
     ]
-    update_prediction_history_db(config, values)
+    (storage or get_storage(config)).add_predictions(values, history=history)
+
+
+# ------------------------------------------------------------------------------
+
+
+def update_shadow_prediction_db(shadowpreds, configpath=CONFIG_FILE_PATH, timestamp=None, storage=None):
+    """update prediction results of shadow models
+
+    Arguments:
+        shadowpreds {dict} -- {modelname: {wfname: [good_prob, acdc_prob, resubmit_prob]}}
+        configpath {str} -- path of configs contains db connection info
+        timestamp {float} -- unix time stamped on the rows, default now
+        storage {storage.Storage} -- written to (or a `storage.CycleSink`), default from config
+    """
+
+    if not any(shadowpreds.values()): return
+    config = get_yamlconfig(configpath)
+
+    timestamp = fmttime(timestamp if timestamp is not None else time.time())
+    values = [
+        (mname, wf, round(predval[0], 6), round(predval[1], 6), round(predval[2], 6), timestamp)
+        for mname, preds in shadowpreds.items()
+        for wf, predval in preds.items()
+    ]
+    (storage or get_storage(config)).add_shadow_predictions(values)
+
+
+# ------------------------------------------------------------------------------
+
+
+def update_contributions_db(contribs, configpath=CONFIG_FILE_PATH, timestamp=None, storage=None):
+    """store prediction contributions
+
+    Arguments:
+        contribs {dict} -- {wfname: numpy.ndarray}, from :py:func:`predict_contributions`
+        configpath {str} -- path of configs contains db connection info
+        timestamp {float} -- unix time stamped on the rows, default now
+        storage {storage.Storage} -- written to (or a `storage.CycleSink`), default from config
+    """
+
+    if not contribs: return
+    config = get_yamlconfig(configpath)
+
+    timestamp = fmttime(timestamp if timestamp is not None else time.time())
+    values = [(wf, encode_contributions(c), timestamp) for wf, c in contribs.items()]
+    (storage or get_storage(config)).add_contributions(values)
+
+
+# ------------------------------------------------------------------------------
+
+
+def feature_hashes(X, salt=""):
+    """hash of each row's time-independent features (all but time_sinceOpenInHour)
+
+    Arguments:
+        X {numpy.ndarray} -- feature matrix, columns as FEATURE_NAMES
+        salt {str} -- mixed into every hash, e.g. model digest
+
+    Returns:
+        list -- hex digests, one per row
+    """
+
+    timecol = FEATURE_NAMES.index("time_sinceOpenInHour")
+    Xstatic = np.ascontiguousarray(np.delete(X, timecol, axis=1))
+    return [
+        hashlib.blake2b(row.tobytes() + salt.encode(), digest_size=16).hexdigest()
+        for row in Xstatic
+    ]
+
+
+def predict_matrix_changed(names, X, model, dbpath, nthread=None, inplace=True, maxtimedrift=6.):
+    """predict only rows whose time-independent features changed since they were
+    last scored, or whose time_sinceOpenInHour drifted more than ``maxtimedrift``
+    hours since; other rows carry forward the cached prediction.
+    Rows to score are predicted together in one batch.
+
+    Only scored rows go to `PredictionHistory`; carried forward predictions
+    refresh the latest-prediction snapshot, and history reads carry values
+    forward (see `predictionrollup.workflow_history`). History growth then
+    tracks change rather than the number of running workflows.
+
+    Arguments:
+        names {list} -- workflow names, one per row of X
+        X {numpy.ndarray} -- feature matrix, columns as FEATURE_NAMES
+        model {str} -- path of model file
+        dbpath {str} -- sqlite db holding the prediction cache
+        nthread {int} -- number of threads used for prediction
+        inplace {bool} -- use inplace prediction, see :py:func:`predict_matrix`
+        maxtimedrift {float} -- hours of time_sinceOpenInHour drift tolerated
+
+    Returns:
+        tuple -- ({wfname: [good_prob, acdc_prob, resubmit_prob]}, row indices of X scored)
+    """
+
+    if not names:
+        return {}, []
+
+    get_model(model, nthread=nthread)  # make sure digest reflects the model in use
+    hashes = feature_hashes(X, salt=REGISTRY.digest(model))
+    timecol = FEATURE_NAMES.index("time_sinceOpenInHour")
+
+    conn = sqlite3.connect(dbpath)
+    with conn:
+        c = conn.cursor()
+        c.execute(PREDICTION_CACHE_SCHEMA)
+        cache = {row[0]: row[1:] for row in c.execute("SELECT * FROM predictionCache")}
+
+    res = {}
+    toscore = []
+    for i, (name, fhash) in enumerate(zip(names, hashes)):
+        cached = cache.get(name, None)
+        if cached is None or cached[0] != fhash:
+            toscore.append(i)
+            continue
+        sinceopen, cachedsinceopen = float(X[i, timecol]), cached[1]
+        if np.isnan(sinceopen) != (cachedsinceopen is None):
+            toscore.append(i)
+            continue
+        if cachedsinceopen is not None and abs(sinceopen - cachedsinceopen) > maxtimedrift:
+            toscore.append(i)
+            continue
+        res[name] = list(cached[2:5])
+
+    if toscore:
+        scorednames = [names[i] for i in toscore]
+        scored = predict_matrix(scorednames, X[toscore], model, nthread=nthread, inplace=inplace)
+        res.update(scored)
+
+        now = time.time()
+        values = []
+        for i, name in zip(toscore, scorednames):
+            sinceopen = float(X[i, timecol])
+            values.append((name, hashes[i], None if np.isnan(sinceopen) else sinceopen,
+                           *scored[name], now))
+        with conn:
+            c = conn.cursor()
+            c.executemany(PREDICTION_CACHE_UPDATE, values)
+            c.execute(PREDICTION_CACHE_PRUNE, (now - 7 * 24 * 60 * 60,))
+    conn.close()
+
+    logger.info("Change detection: {} workflows scored, {} carried forward.".format(
+        len(toscore), len(names) - len(toscore)))
+    return res, toscore
 
 
 # ------------------------------------------------------------------------------
 
 
-def makingPredictionsWithML(docs):
-    from os.path import join, dirname, abspath
+def makingPredictionsWithML(docs, configpath=CONFIG_FILE_PATH, timestamp=None, sink=None, storefeatures=True):
+    """predict docs and write results, can be called once per batch of a cycle
 
-    mfile = join(dirname(abspath(__file__)), "models/xgb_optimized.model")
+    Arguments:
+        docs {list} -- workflow documents
+        configpath {str} -- path of configs
+        timestamp {float} -- unix time of the cycle, default now
+        sink {storage.CycleSink} -- stage results in the cycle's sink instead of writing them
+        storefeatures {bool} -- persist the feature matrix; per batch callers pass False
+            and store the whole cycle's at once (see :py:func:`store_cycle_features`)
+
+    Returns:
+        tuple -- (workflow names, feature matrix) extracted
+    """
 
-    predres = predict_docs(docs, mfile)
-    update_prediction_db(predres)
+    config = get_yamlconfig(configpath)
+    modelconfig = config.get("model", {})
+    predconfig = config.get("prediction", {})
+    mfile = repo_path(modelconfig.get("path", MODEL_FILE_PATH))
+    nthread = modelconfig.get("nthread", None)
+    inplace = modelconfig.get("inplace", True)
+
+    if timestamp is None:
+        timestamp = time.time()
+    names, X = extract_feature_matrix(docs)
+    if storefeatures:
+        store_features(names, X, timestamp, configpath=configpath)
+
+    shadows = {m["name"]: repo_path(m["path"]) for m in modelconfig.get("shadows", [])}
+
+    # primary and shadow models (and contributions) score the same matrix concurrently,
+    # xgboost releases the GIL while predicting
+    changedetection = predconfig.get("changedetection", False)
+    contributions = predconfig.get("contributions", False)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2 + len(shadows)) as executor:
+        if changedetection:
+            primary = executor.submit(predict_matrix_changed, names, X, mfile,
+                                      get_workflow_status_db(config),
+                                      nthread=nthread, inplace=inplace,
+                                      maxtimedrift=predconfig.get("maxtimedrift", 6.))
+        else:
+            primary = executor.submit(predict_matrix, names, X, mfile,
+                                      nthread=nthread, inplace=inplace)
+        shadowfutures = {
+            executor.submit(predict_matrix, names, X, mpath, nthread=nthread, inplace=inplace): mname
+            for mname, mpath in shadows.items()
+        }
+        contribfuture = None
+        if contributions and not changedetection:
+            contribfuture = executor.submit(predict_contributions, names, X, mfile, nthread=nthread)
+
+        predres = primary.result()
+        if changedetection:
+            # carried forward predictions keep the contributions stored when they were scored
+            predres, scored = predres
+            if contributions and scored:
+                contribfuture = executor.submit(predict_contributions, [names[i] for i in scored],
+                                                X[scored], mfile, nthread=nthread)
+        shadowres = {}
+        for future in concurrent.futures.as_completed(shadowfutures):
+            mname = shadowfutures[future]
+            try:
+                shadowres[mname] = future.result()
+            except Exception as e:
+                logger.exception("Shadow model <{}> failed to predict. Msg: {}".format(mname, str(e)))
+        contribres = {}
+        if contribfuture is not None:
+            try:
+                contribres = contribfuture.result()
+            except Exception as e:
+                logger.exception("Failed to compute prediction contributions. Msg: {}".format(str(e)))
+
+    if changedetection:
+        scorednames = {names[i] for i in scored}
+        carried = {name: pred for name, pred in predres.items() if name not in scorednames}
+        predres = {name: pred for name, pred in predres.items() if name in scorednames}
+        update_prediction_db(carried, configpath=configpath, timestamp=timestamp, storage=sink, history=False)
+    update_prediction_db(predres, configpath=configpath, timestamp=timestamp, storage=sink)
+    update_shadow_prediction_db(shadowres, configpath=configpath, timestamp=timestamp, storage=sink)
+    update_contributions_db(contribres, configpath=configpath, timestamp=timestamp, storage=sink)
+    get_encoding_table().save()
+
+    return names, X
 
 
 ###############################################################################
@@ -487,6 +979,66 @@ def test_multiDocs(docs):
         test_singleDoc(doc)
 
 
+def test_extractorEquivalence(docs):
+    """differential check of :py:func:`extract_features` against the
+    per-feature ``get_*`` functions it replaces.
+    """
+    getters = [
+        get_failureRate,
+        get_totalError,
+        get_sites_siteCounts,
+        get_type_encoded,
+        get_sites_errorPerSite_max,
+        get_sites_errorPerSite_min,
+        get_sites_errorPerSite_median,
+        get_sites_errorPerSite_mean,
+        get_sites_errorPerSite_stdDev,
+        get_errorCode_primary_multiplicity,
+        get_errorCode_primary_leadingCode,
+        get_errorCode_primary_leadingRatio,
+        get_errorCode_secondary_multiplicity,
+        get_errorCode_secondary_leadingCode,
+        get_errorCode_secondary_leadingRatio,
+        get_errorKeywords_multiplicity,
+        get_errorKeywords_leading_encoded,
+        get_errorKeywords_leadingRatio,
+        get_time_sinceOpenInHour,
+    ]
+
+    for doc in docs:
+        now = int(time.time())
+        reference = [getter(doc) for getter in getters]
+        featureExtracted = extract_features(doc, now=now)
+        assert list(featureExtracted) == FEATURE_NAMES
+
+        for fname, ref, val in zip(FEATURE_NAMES, reference, featureExtracted.values()):
+            if fname == "time_sinceOpenInHour":
+                # reference reads the clock itself
+                if np.isnan(ref):
+                    assert np.isnan(val), (doc["name"], fname)
+                else:
+                    assert abs(ref - val) < 2 / 3600., (doc["name"], fname)
+                continue
+            assert type(ref) == type(val) and ref == val, (doc["name"], fname, ref, val)
+
+    print("extract_features matches get_* functions on {} docs".format(len(docs)))
+
+
+def test_parallelExtractionEquivalence(docs, nproc=4):
+    """differential check of :py:class:`ParallelExtractor` against the serial
+    :py:func:`extract_feature_matrix`, on the same docs and reference time.
+    """
+    now = int(time.time())
+    names, X = extract_feature_matrix(docs, now=now)
+    with ParallelExtractor(nproc=nproc, threshold=0) as extractor:
+        pnames, pX = extractor.extract(docs, now=now)
+
+    assert pnames == names
+    assert np.array_equal(X, pX, equal_nan=True)
+
+    print("ParallelExtractor matches extract_feature_matrix on {} docs".format(len(docs)))
+
+
 def main():
     testdocfn = "./test/bab2ef60-b0f2-4b55-9434-95a9cfd00510.json"
     sdoc = json.load(open(testdocfn))["data"]
@@ -501,6 +1053,8 @@ def main():
         mdocs = json.loads(fin.read())
     print("\n\nmultiple docs -->")
     # test_multiDocs(mdocs)
+    test_extractorEquivalence(mdocs)
+    test_parallelExtractionEquivalence(mdocs)
 
     modelfile = "./models/xgb_optimized.model"
     predres = predict_docs(mdocs[:20], modelfile)
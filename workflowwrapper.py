@@ -2,18 +2,204 @@
 """simple wrapper around workflow, only has functions needed for monitoring
 """
 
+import csv
+import gzip
+import http.client
+import json
+import random
+import socket
+import threading
+import time
+import urllib.error
+from os.path import join
+
 from cmstoolbox import webtools
 webtools.USER_AGENT = 'OSDroid'
 
+# number of extra attempts for a cmsweb call failing on transient errors
+RETRIES = 0
+# seconds before the first retry, doubled on each retry (with jitter)
+RETRY_WAIT = 1.
+# max seconds between two attempts
+RETRY_WAIT_MAX = 30.
+# active :py:class:`CallTracer`, ``None`` when tracing is off
+TRACER = None
+
+
+class CallTracer:
+    """records every cmsweb call issued by :py:class:`Workflow` and
+    :py:class:`PrepID` -- endpoint, workflow name, bytes received, latency
+    and retry count -- so that slow endpoints/workflows can be spotted.
+    Thread-safe, as calls are issued from ``buildDoc`` worker threads.
+    """
+
+    FIELDS = ['endpoint', 'workflow', 'bytes', 'latency', 'retries', 'status', 'start']
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._records = []
+        self._inflight = {}
+
+    def start(self, endpoint, workflow):
+        key = object()
+        with self._lock:
+            self._inflight[key] = (endpoint, workflow, time.time())
+        return key
+
+    def finish(self, key, nbytes, retries, status):
+        with self._lock:
+            endpoint, workflow, start = self._inflight.pop(key)
+            self._records.append({
+                'endpoint': endpoint,
+                'workflow': workflow,
+                'bytes': nbytes,
+                'latency': round(time.time() - start, 3),
+                'retries': retries,
+                'status': status,
+                'start': round(start, 3),
+            })
+
+    @property
+    def records(self):
+        with self._lock:
+            return list(self._records)
+
+    def inflight(self):
+        """calls not returned yet, longest running first
+
+        :return: list of (endpoint, workflow, elapsed seconds)
+        :rtype: list
+        """
+        now = time.time()
+        with self._lock:
+            res = [(e, w, round(now - s, 3)) for e, w, s in self._inflight.values()]
+        return sorted(res, key=lambda x: x[2], reverse=True)
+
+    def slowest(self, n=20):
+        return sorted(self.records, key=lambda r: r['latency'], reverse=True)[:n]
+
+    def dump(self, dirname, topn=20):
+        """write the compact trace (gzipped csv) and a top-N slowest-calls report,
+        then reset recorded calls for the next cycle.
+
+        :param str dirname: directory to write into
+        :param int topn: number of calls in the report
+        :return: (trace filename, report filename)
+        :rtype: tuple
+        """
+        records = self.records
+        suffix = time.strftime('%y%m%d-%H%M%S')
+
+        tracefn = join(dirname, f'cmswebTrace_{suffix}.csv.gz')
+        with gzip.open(tracefn, 'wt', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=self.FIELDS)
+            writer.writeheader()
+            writer.writerows(records)
+
+        perendpoint = {}
+        for r in records:
+            cnt, tot = perendpoint.get(r['endpoint'], (0, 0.))
+            perendpoint[r['endpoint']] = (cnt + 1, tot + r['latency'])
+
+        lines = [f'{len(records)} cmsweb calls traced', '']
+        lines.append(f"{'endpoint':<12} {'calls':>7} {'total/s':>10} {'mean/s':>8}")
+        for endpoint, (cnt, tot) in sorted(perendpoint.items(), key=lambda x: x[1][1], reverse=True):
+            lines.append(f'{endpoint:<12} {cnt:>7} {tot:>10.1f} {tot/cnt:>8.2f}')
+        lines.extend(['', f'top {topn} slowest calls:'])
+        for r in sorted(records, key=lambda r: r['latency'], reverse=True)[:topn]:
+            lines.append('{latency:>8.2f}s {endpoint:<12} {bytes:>10}B retries={retries} {status:<5} {workflow}'.format(**r))
+
+        reportfn = join(dirname, f'cmswebSlowest_{suffix}.txt')
+        with open(reportfn, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+        with self._lock:
+            self._records = []
+
+        return tracefn, reportfn
+
+
+def enable_tracing():
+    """turn on tracing of cmsweb calls, returns the active tracer"""
+    global TRACER
+    if TRACER is None:
+        TRACER = CallTracer()
+    return TRACER
+
+
+def disable_tracing():
+    global TRACER
+    TRACER = None
+
+
+def is_transient(exc):
+    """whether a failed cmsweb call is worth retrying: server errors (5xx),
+    timeouts and dropped connections
+
+    :param Exception exc: exception raised by the call
+    :rtype: bool
+    """
+
+    if isinstance(exc, urllib.error.HTTPError):
+        return exc.code >= 500
+    status = getattr(exc, 'status', None) or getattr(exc, 'code', None)
+    if isinstance(status, int) and 100 <= status < 600:
+        return status >= 500
+    return isinstance(exc, (socket.timeout, TimeoutError, ConnectionError,
+                            http.client.HTTPException, urllib.error.URLError))
+
+
+def retry_wait(attempt):
+    """seconds to wait before retry number ``attempt`` (from 0): exponential
+    backoff with full jitter, so that workers do not retry in lockstep
+    """
+
+    return random.uniform(0, min(RETRY_WAIT_MAX, RETRY_WAIT * 2 ** attempt))
+
+
+def get_json(url, request, *args, endpoint='', workflow='', **kwargs):
+    """``webtools.get_json`` with retries on transient failures (see
+    :py:func:`is_transient`), backing off between attempts, and optional tracing.
+
+    :param str url: host
+    :param str request: request path
+    :param str endpoint: short endpoint label for the trace
+    :param str workflow: workflow (or prepid) name for the trace
+    :return: decoded json
+    :rtype: dict
+    """
+    tracer = TRACER
+    key = tracer.start(endpoint, workflow) if tracer is not None else None
+
+    retries = 0
+    while True:
+        try:
+            result = webtools.get_json(url, request, *args, **kwargs)
+            break
+        except Exception as e:
+            if retries >= RETRIES or not is_transient(e):
+                if tracer is not None:
+                    tracer.finish(key, 0, retries, 'error')
+                raise
+            time.sleep(retry_wait(retries))
+            retries += 1
+
+    if tracer is not None:
+        tracer.finish(key, len(json.dumps(result)), retries, 'ok')
+    return result
+
 
 class PrepID:
     def __init__(self, prepid, url="cmsweb.cern.ch"):
         self.name_ = prepid
         self.url_ = url
 
-        result = webtools.get_json(self.url_, '/reqmgr2/data/request',
-                          params={'prep_id': self.name_, 'detail': 'true'},
-                          use_cert=True)
+        result = get_json(
+            self.url_,
+            '/reqmgr2/data/request',
+            params={'prep_id': self.name_, 'detail': 'true'},
+            use_cert=True,
+            endpoint='prepid', workflow=self.name_)
         result = result.get('result', [])
         self.data_ = result[0] if result else {}
 
@@ -63,10 +249,11 @@ class Workflow:
         :rtype: dict
         """
         if not self.jobdetail_:
-            self.jobdetail_ = webtools.get_json(
+            self.jobdetail_ = get_json(
                 self.url_,
                 f"/wmstatsserver/data/jobdetail/{self.name_}",
-                use_cert=True)
+                use_cert=True,
+                endpoint='jobdetail', workflow=self.name_)
         return self.jobdetail_
 
     def get_reqdetail(self):
@@ -77,10 +264,11 @@ class Workflow:
         """
         if not self.reqdetail_:
             reqDetail = {self.name_: dict()}
-            raw = webtools.get_json(
+            raw = get_json(
                 self.url_,
                 f'/wmstatsserver/data/request/{self.name_}',
-                use_cert=True)
+                use_cert=True,
+                endpoint='reqdetail', workflow=self.name_)
             result = raw.get('result', None)
             if result is None:
                 return reqDetail
@@ -98,12 +286,13 @@ class Workflow:
         :rtype: dict
         """
         if not self.reqparams_:
-            result = webtools.get_json(
+            result = get_json(
                 self.url_,
                 '/reqmgr2/data/request',
                 params={'name': self.name_},
                 use_https=True,
-                use_cert=True
+                use_cert=True,
+                endpoint='reqparams', workflow=self.name_
             )
             for params in result['result']:
                 for key, item in params.items():
@@ -168,14 +357,15 @@ class Workflow:
                     if sites: errors[code] = sites
                 if errors: output[step] = errors
 
-        acdc_server_response = webtools.get_json(
+        acdc_server_response = get_json(
             self.url_,
             '/couchdb/acdcserver/_design/ACDC/_view/byCollectionName', {
                 'key': f'"{self.name_}"',
                 'include_docs': 'true',
                 'reduce': 'false'
             },
-            use_cert=True)
+            use_cert=True,
+            endpoint='acdc', workflow=self.name_)
 
         for row in acdc_server_response.get('rows', []):
             task = row['doc']['fileset_name']